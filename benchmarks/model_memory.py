@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#
+#   WiX model memory benchmark
+#
+#   Copyright (C) 2018 by Igor E. Novikov
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures memory retained by installed file tree model per payload file.
+Tree is built from synthetic scanner entries, so neither source folder
+nor MSI backend is required.
+
+Usage: python3 benchmarks/model_memory.py [FILES] [FILES_PER_FOLDER]
+"""
+
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+from wixpy import model  # noqa: E402
+from wixpy import scanner  # noqa: E402
+from wixpy import utils  # noqa: E402
+
+
+def build_tree(files, per_folder):
+    ctx = utils.BuildContext()
+    data = model.defaults()
+    root = model.WixDirectory(ctx, scanner.Entry('root', '/src', True))
+    folder = None
+    for index in range(files):
+        if not index % per_folder:
+            name = 'folder%d' % (index // per_folder)
+            folder = model.WixDirectory(ctx, scanner.Entry(
+                name, '/src/%s' % name, True))
+            root.add(folder)
+        name = 'file%d.dll' % index
+        entry = scanner.Entry(name, '%s/%s' % (folder.path, name), False,
+                              index, 1500000000000000000 + index)
+        folder.add(model.WixComponent(ctx, entry, data))
+    return root
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    per_folder = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    root = build_tree(files, per_folder)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print('files: %d, folders: %d' % (files, len(root.childs)))
+    print('model size: %.1f MB' % (size / 1024.0 / 1024.0))
+    print('bytes per file: %d' % (size // files))
+
+
+if __name__ == '__main__':
+    main()
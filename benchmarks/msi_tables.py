@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+#   MSI table generation benchmark
+#
+#   Copyright (C) 2018 by Igor E. Novikov
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures model building and MSI table generation for a synthetic source
+folder. Tables are written by in-memory null backend, so libmsi is not
+required and backend time is excluded. Then the package is written by
+pure Python backend.
+
+Usage: python3 benchmarks/msi_tables.py [FILES] [FILES_PER_FOLDER]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+import wixpy  # noqa: E402
+from wixpy import msi  # noqa: E402
+from wixpy import nullmsi  # noqa: E402
+from wixpy import utils  # noqa: E402
+
+
+def make_source(path, files, per_folder):
+    folder = None
+    for index in range(files):
+        if not index % per_folder:
+            folder = os.path.join(path, 'folder%d' % (index // per_folder))
+            os.mkdir(folder)
+        with open(os.path.join(folder, 'file%d.dll' % index), 'w') as fp:
+            fp.write(str(index))
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    per_folder = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        source_dir = os.path.join(tmp_dir, 'src')
+        os.mkdir(source_dir)
+        make_source(source_dir, files, per_folder)
+        json_data = {
+            'Name': 'Benchmark',
+            'UpgradeCode': '3AC4B4FF-10C4-4B8F-81AD-BAC3238BF690',
+            'Version': '1.0',
+            'Manufacturer': 'Benchmark',
+            '_SourceDir': source_dir,
+            '_InstallDir': 'benchmark',
+        }
+        output = os.path.join(tmp_dir, 'benchmark.msi')
+        start = time.time()
+        wixmodel = wixpy.create_model(json_data,
+                                      ctx=utils.BuildContext(backend='null'))
+        model_time = time.time() - start
+        start = time.time()
+        msi.get_database('null')(wixmodel).write_msi(output)
+        tables_time = time.time() - start
+        rows = sum(len(item) for item in
+                   nullmsi.pop_database(output).rows.values())
+        start = time.time()
+        msi.get_database('python')(wixmodel).write_msi(output)
+        package_time = time.time() - start
+        print('files: %d, rows: %d' % (files, rows))
+        print('model: %.2f s' % model_time)
+        print('tables: %.2f s' % tables_time)
+        print('python backend: %.2f s, %d bytes' %
+              (package_time, os.path.getsize(output)))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+#   wix.py startup benchmark
+#
+#   Copyright (C) 2018 by Igor E. Novikov
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures wall time of `wix.py --help` and `wix.py --xml_only` runs for
+a small project and reports which heavy modules (MSI backends, GObject
+introspection) each run has imported. `--xml_only` run should not load
+any MSI backend.
+
+Usage: python3 benchmarks/startup.py [RUNS]
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SCRIPT = os.path.join(ROOT, 'scripts', 'py%d' % sys.version_info[0],
+                      'wix.py')
+WATCHED = ('gi', 'wixpy.libmsi', 'wixpy.libmsiw', 'wixpy.pymsi',
+           'wixpy.msi', 'wixpy.model', 'concurrent.futures',
+           'urllib.request')
+
+# Runs wix.py and reports watched modules loaded at exit
+MODULES_CHECK = '''
+import atexit, runpy, sys
+atexit.register(lambda: sys.stderr.write('modules: %s\\n' % (' '.join(
+    [name for name in WATCHED if name in sys.modules]) or '-')))
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name='__main__')
+'''
+
+
+def make_project(path):
+    source_dir = os.path.join(path, 'src')
+    os.mkdir(source_dir)
+    for index in range(10):
+        with open(os.path.join(source_dir, 'file%d.dll' % index), 'w') as fp:
+            fp.write(str(index))
+    json_file = os.path.join(path, 'app.json')
+    with open(json_file, 'w') as fp:
+        json.dump({
+            'Name': 'Benchmark',
+            'UpgradeCode': '3AC4B4FF-10C4-4B8F-81AD-BAC3238BF690',
+            'Version': '1.0',
+            'Manufacturer': 'Benchmark',
+            '_SourceDir': source_dir,
+            '_InstallDir': 'benchmark',
+        }, fp)
+    return json_file
+
+
+def run(args, env):
+    with open(os.devnull, 'w') as devnull:
+        start = time.time()
+        subprocess.check_call([sys.executable, SCRIPT] + args,
+                              stdout=devnull, env=env)
+        return time.time() - start
+
+
+def loaded_modules(args, env):
+    code = 'WATCHED = %r\n%s' % (WATCHED, MODULES_CHECK)
+    with open(os.devnull, 'w') as devnull:
+        output = subprocess.Popen(
+            [sys.executable, '-c', code, SCRIPT] + args, stdout=devnull,
+            stderr=subprocess.PIPE, env=env).communicate()[1]
+    lines = output.decode('utf-8', 'replace').splitlines()
+    return lines[-1].split(':', 1)[-1].strip() if lines else '?'
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.join(ROOT, 'src')] +
+        ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        json_file = make_project(tmp_dir)
+        output = os.path.join(tmp_dir, 'benchmark.wxs')
+        cases = [
+            ('--help', ['--help']),
+            ('--xml_only', ['--xml_only', '--output=%s' % output, json_file]),
+        ]
+        # Interpreter startup without wix.py
+        baseline = []
+        for _index in range(runs):
+            start = time.time()
+            subprocess.check_call([sys.executable, '-c', 'pass'], env=env)
+            baseline.append(time.time() - start)
+        baseline.sort()
+        print('python: %.3f s' % baseline[len(baseline) // 2])
+        for name, args in cases:
+            times = sorted(run(args, env) for _index in range(runs))
+            print('%s: %.3f s (min %.3f s), modules: %s' % (
+                name, times[len(times) // 2], times[0],
+                loaded_modules(args, env)))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
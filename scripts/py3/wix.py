@@ -39,6 +39,7 @@ Copyright (C) 2018 sK1 Project Team (https://wix.sk1project.net)
 
 Usage: wix.py [OPTIONS] [INPUT FILE]
 Example: wix.py myapp.json
+         wix.py myapp.wxs
 
 Available options:
  --help                Display this help and exit
@@ -47,6 +48,13 @@ Available options:
  --output=FILE         Resulted MSI/WXS filename
  --xml_encoding=ENC    WXS content encoding. Default "utf-8"
  --json_encoding=ENC   JSON content encoding. Default "utf-8"
+ --jobs=N              Number of source folder scanning threads. Default 1
+ --watch               Rebuild on source folder changes until interrupted
+ --save_snapshot=FILE  Save scanned package model instead of building package
+ --snapshot=FILE       Build package from saved model, JSON file is not used
+ --canonical           Reproducible output: sorted scan and stable Ids
+ --backend=NAME        MSI backend: "libmsi", "libmsiw", "python" (no libmsi
+                       required) or "null" (no output)
 '''
 
 if '--help' in sys.argv or '-help' in sys.argv or len(sys.argv) == 1:
@@ -69,10 +77,28 @@ for item in options:
         key = item[2:]
         args[key] = True
 
-if not non_options:
+if args.get('snapshot'):
+    wixpy.build(snapshot=args.get('snapshot'),
+                output=args.get('output'),
+                stdout=args.get('stdout', False),
+                xml_only=args.get('xml_only', False),
+                xml_encoding=args.get('xml_encoding', 'utf-8'),
+                backend=args.get('backend'))
+    sys.exit(0)
+
+if len(non_options) < 2:
     print('Input JSON file is not provided!')
     sys.exit(1)
 
+if non_options[1].lower().endswith('.wxs'):
+    wixpy.build(xml_file=non_options[1],
+                output=args.get('output'),
+                stdout=args.get('stdout', False),
+                xml_only=args.get('xml_only', False),
+                xml_encoding=args.get('xml_encoding', 'utf-8'),
+                backend=args.get('backend'))
+    sys.exit(0)
+
 json_file = non_options[1]
 if not os.path.exists(json_file):
     print('Specified JSON file "%s" is not found!' % json_file)
@@ -82,7 +108,7 @@ json_data = {}
 try:
     with open(json_file, 'rb') as fp:
         json_encoding = args.get('json_encoding', 'utf-8')
-        json_data = json.load(fp, encoding=json_encoding)
+        json_data = json.loads(fp.read().decode(json_encoding))
     if not json_data:
         raise Exception('Empty JSON data!')
     json_data = wixpy.utils.encode_json(json_data)
@@ -90,8 +116,25 @@ except Exception as e:
     print('Error reading JSON file! %s' % str(e))
     sys.exit(1)
 
-wixpy.build(json_data,
-            output=args.get('output'),
-            stdout=args.get('stdout', False),
-            xml_only=args.get('xml_only', False),
-            xml_encoding=args.get('xml_encoding', 'utf-8'))
+if args.get('canonical'):
+    json_data['_StableIds'] = True
+    json_data['_SortedScan'] = True
+
+if args.get('save_snapshot'):
+    wixpy.save_snapshot(json_data, args.get('save_snapshot'),
+                        jobs=args.get('jobs'))
+elif args.get('watch'):
+    wixpy.watch(json_data,
+                output=args.get('output'),
+                xml_only=args.get('xml_only', False),
+                xml_encoding=args.get('xml_encoding', 'utf-8'),
+                jobs=args.get('jobs'),
+                backend=args.get('backend'))
+else:
+    wixpy.build(json_data,
+                output=args.get('output'),
+                stdout=args.get('stdout', False),
+                xml_only=args.get('xml_only', False),
+                xml_encoding=args.get('xml_encoding', 'utf-8'),
+                jobs=args.get('jobs'),
+                backend=args.get('backend'))
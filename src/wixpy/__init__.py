@@ -135,8 +135,12 @@ def _normalize_json_data(json_data):
     if '_OsCondition' in json_data:
         json_data['_OsCondition'] = str(json_data['_OsCondition'])
 
-    for key in ('_Icon', '_OutputDir', '_SourceDir'):
-        if key in json_data:
+    if '_ScanJobs' in json_data:
+        json_data['_ScanJobs'] = max(1, int(json_data['_ScanJobs']))
+
+    for key in ('_Icon', '_OutputDir', '_SourceDir', '_ScanCache',
+                '_TemplateCache'):
+        if isinstance(json_data.get(key), utils.STRING_TYPES):
             json_data[key] = _normalize_path(json_data[key])
 
     return json_data
@@ -170,39 +174,125 @@ def _get_output_path(json_data=None, output=None, xml_only=False, stdout=False):
     return os.path.join(dirpath, filename)
 
 
-def create_model(json_data=None, xml_file=None):
+def create_model(json_data=None, xml_file=None, ctx=None):
     from wixpy import model
     if json_data:
-        return model.Wix(_normalize_json_data(json_data))
+        return model.Wix(_normalize_json_data(json_data), ctx)
     elif xml_file:
-        raise Exception('XML loader is not implemented yet')
+        from wixpy import loader
+        return loader.load(_normalize_path(xml_file), ctx)
     else:
         raise Exception('Neither JSON nor XML data have been provided!')
 
 
 def build(json_data=None, output=None, xml_only=False, xml_encoding=None,
-          engine=Engine.WIXPY, stdout=False):
-    output = _get_output_path(json_data, output, xml_only, stdout)
-    utils.XML_ENCODING = xml_encoding or 'utf-8'
+          engine=Engine.WIXPY, stdout=False, jobs=None, snapshot=None,
+          xml_file=None, backend=None):
+    """Builds MSI or WXS from JSON data, WXS file or model snapshot file.
+    backend is MSI backend name ("libmsi", "libmsiw", "python" or "null")
+    or module, by default it depends on platform.
+    """
+    ctx = utils.BuildContext(engine == Engine.WIXL, xml_encoding,
+                             backend=backend)
+    if snapshot:
+        from wixpy import model
+        wixmodel = model.Wix.load_snapshot(_normalize_path(snapshot), ctx)
+        output = _get_output_path(wixmodel.msi_data, output, xml_only,
+                                  stdout)
+    elif xml_file:
+        wixmodel = create_model(xml_file=xml_file, ctx=ctx)
+        output = _get_output_path(wixmodel.msi_data, output, xml_only,
+                                  stdout)
+        if output == _normalize_path(xml_file):
+            raise Exception('Output file overwrites source WXS file!')
+    else:
+        output = _get_output_path(json_data, output, xml_only, stdout)
+        if jobs:
+            json_data['_ScanJobs'] = jobs
+        wixmodel = create_model(json_data, ctx=ctx)
+    _write_output(wixmodel, output, xml_only, stdout)
+    wixmodel.destroy()
+
+
+def save_snapshot(json_data, path, jobs=None):
+    """Scans source folder and saves the model for later build() calls"""
+    if jobs:
+        json_data['_ScanJobs'] = jobs
+    # Snapshot keeps the complete model tree
+    json_data.pop('_Streaming', None)
 
-    from wixpy import model
     wixmodel = create_model(json_data)
+    path = _normalize_path(path)
+    utils.echo_msg('Writing model snapshot into %s...' % path)
+    wixmodel.save_snapshot(path)
+    wixmodel.destroy()
+
 
+def _write_output(wixmodel, output, xml_only=False, stdout=False,
+                  hash_cache=None, cabinet_cache=None):
     if xml_only:
-        model.WIXL = engine == Engine.WIXL
         if stdout:
             wixmodel.write_xml(sys.stdout)
         else:
             utils.echo_msg('Writing XML into %s...' % output)
             with open(output, 'wb') as fp:
-                wixmodel.write_xml(utils.XmlWriter(fp))
+                writer = utils.XmlWriter(fp, wixmodel.ctx.xml_encoding)
+                wixmodel.write_xml(writer)
+                writer.flush()
     else:
         from wixpy import msi
-        msi.MSI_CODEPAGE = wixmodel.get_package().get('SummaryCodepage')
         utils.echo_msg('Writing MSI package into %s...' % output)
-        msi.MsiDatabase(wixmodel).write_msi(output)
+        database = msi.get_database(wixmodel.ctx.backend)
+        database(wixmodel, hash_cache, cabinet_cache).write_msi(output)
 
         if stdout:
             wixmodel.write_xml(sys.stdout)
 
-    wixmodel.destroy()
+
+def watch(json_data=None, output=None, xml_only=False, xml_encoding=None,
+          engine=Engine.WIXPY, jobs=None, interval=1.0, backend=None):
+    """Builds the package and rebuilds it on each source folder change
+    until interrupted. Model, file hashes and compressed cabinet folders
+    are kept between builds, so only changed folders are rescanned,
+    changed files rehashed and cabinet folders having changed files
+    compressed again. MSI tables are written from the model each time.
+    """
+    output = _get_output_path(json_data, output, xml_only)
+    ctx = utils.BuildContext(engine == Engine.WIXL, xml_encoding,
+                             backend=backend)
+    if jobs:
+        json_data['_ScanJobs'] = jobs
+    # Incremental updates need the complete model tree
+    json_data.pop('_Streaming', None)
+
+    from wixpy import watcher
+    wixmodel = create_model(json_data, ctx=ctx)
+    hash_cache = {}
+    cabinet_cache = None
+    if not xml_only:
+        from wixpy import pymsi
+        cabinet_cache = pymsi.CabinetCache()
+    _write_output(wixmodel, output, xml_only, hash_cache=hash_cache,
+                  cabinet_cache=cabinet_cache)
+
+    install_dir = wixmodel.get_product().get_install_dir()
+    source_dir = install_dir.path
+    monitor = watcher.get_watcher(source_dir,
+                                  install_dir.data.get('_SkipHidden'),
+                                  interval,
+                                  follow_links=install_dir.follow_links)
+    utils.echo_msg('Watching %s for changes...' % source_dir)
+    try:
+        while True:
+            paths = monitor.wait()
+            if wixmodel.update(paths):
+                _write_output(wixmodel, output, xml_only,
+                              hash_cache=hash_cache,
+                              cabinet_cache=cabinet_cache)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        monitor.close()
+        if cabinet_cache is not None:
+            cabinet_cache.close()
+        wixmodel.destroy()
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+#
+#   MSI backend interface
+#
+#   Copyright (C) 2018 by Igor E. Novikov
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+MSI backend is a module providing SummaryInfo, Table and Database classes
+derived from the classes below. MSI tables and database of wixpy.msi are
+combined with backend classes when the package is written, so backends
+are imported only when they are used.
+"""
+
+import importlib
+import os
+import shutil
+import tempfile
+
+from wixpy import utils
+
+BACKENDS = {
+    'libmsi': 'wixpy.libmsi',
+    'libmsiw': 'wixpy.libmsiw',
+    'null': 'wixpy.nullmsi',
+    'python': 'wixpy.pymsi',
+}
+
+
+def default_backend():
+    return 'libmsiw' if os.name == 'nt' else 'libmsi'
+
+
+def remove_file(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def write_file(path, write):
+    """Writes file by write(fp) callback replacing path at once, so
+    concurrent readers get either old or new file
+    """
+    dirpath = os.path.dirname(path)
+    if not os.path.isdir(dirpath):
+        os.makedirs(dirpath)
+    fd, tmp_path = tempfile.mkstemp(dir=dirpath)
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            write(fp)
+        if os.path.exists(path) and not hasattr(os, 'replace'):
+            os.remove(path)
+        getattr(os, 'replace', os.rename)(tmp_path, path)
+    except Exception:
+        remove_file(tmp_path)
+        raise
+
+
+def get_backend(backend=None):
+    """Returns backend module by name, modules are returned as is"""
+    if backend is None:
+        backend = default_backend()
+    if not isinstance(backend, utils.STRING_TYPES):
+        return backend
+    if backend not in BACKENDS:
+        raise Exception('Unknown MSI backend "%s"' % backend)
+    return importlib.import_module(BACKENDS[backend])
+
+
+class SummaryInfo(object):
+    """Summary information stream properties"""
+    title = None
+    author = None
+    subject = None
+    comments = None
+    template = None
+    keywords = None
+    codepage = None
+    uuid = None
+    filetime = None
+    version = None
+    appname = None
+    security = None
+    source = None
+
+    def write_msi(self, db):
+        """Saves properties into database handle"""
+        raise NotImplementedError
+
+
+class Table(object):
+    """MSI table, records are lists of int, str, None or
+    ('filepath', path) stream values in table_spec column order.
+    """
+    length = None
+    name = None
+    records = None
+
+    def __init__(self, name, table_spec):
+        self.name = name
+        self.records = []
+        self.length = len(table_spec)
+        self.tbl_spec = table_spec
+
+    def _create_table(self, db):
+        raise NotImplementedError
+
+    def _normalize_str(self, text):
+        return text
+
+    def _write_records(self, db):
+        """Inserts collected records into created table"""
+        raise NotImplementedError
+
+    def write_msi(self, db):
+        pass
+
+
+class Database(object):
+    """MSI database, db is the backend database handle. files are
+    (filepath, file_id, size, mtime) tuples of cabinet files.
+    """
+
+    def __init__(self):
+        self.db = None
+        self.files = []
+        self.medias = []
+        self.tables = None
+
+    def build_cabinet(self, cabfile, compressed=True, embed=True):
+        raise NotImplementedError
+
+    def init_db(self, msifile):
+        raise NotImplementedError
+
+    def open_db(self, msifile):
+        """Opens existing database for modification"""
+        raise NotImplementedError
+
+    def commit_db(self):
+        raise NotImplementedError
+
+    def save_template(self, msifile, path=None):
+        """Returns template of database content written so far, which
+        load_template() copies into new databases. Database is committed
+        and its copy is kept in temporary file until remove_template(), or
+        in path, where read_template() finds it in later runs.
+        """
+        self.commit_db()
+        self.db = None
+        template = None
+        if path is not None:
+            def copy(fp):
+                with open(msifile, 'rb') as source:
+                    shutil.copyfileobj(source, fp)
+            try:
+                write_file(path, copy)
+                template = path
+            except (IOError, OSError):
+                pass
+        if template is None:
+            fd, template = tempfile.mkstemp(suffix='.msi')
+            os.close(fd)
+            shutil.copyfile(msifile, template)
+        self.open_db(msifile)
+        return template
+
+    @staticmethod
+    def read_template(path):
+        """Returns template saved into path or None"""
+        return path if os.path.isfile(path) else None
+
+    def load_template(self, msifile, template):
+        shutil.copyfile(template, msifile)
+        self.open_db(msifile)
+
+    @staticmethod
+    def remove_template(template):
+        remove_file(template)
+
+    def write_msi(self, db):
+        pass
@@ -27,24 +27,12 @@ from gi.repository import Libmsi
 from gi.repository import GCab
 from gi.repository import Gio
 
-MAXINT = 4294967295
+from wixpy import backend
 
+MAXINT = 4294967295
 
-class SummaryInfo(object):
-    title = None
-    author = None
-    subject = None
-    comments = None
-    template = None
-    keywords = None
-    codepage = None
-    uuid = None
-    filetime = None
-    version = None
-    appname = None
-    security = None
-    source = None
 
+class SummaryInfo(backend.SummaryInfo):
     def write_msi(self, db):
         properties = [
             (Libmsi.Property.TITLE, self.title),
@@ -75,17 +63,7 @@ class SummaryInfo(object):
         msi_prop.save(db)
 
 
-class Table(object):
-    length = None
-    name = None
-    records = None
-
-    def __init__(self, name, table_spec):
-        self.name = name
-        self.records = []
-        self.length = len(table_spec)
-        self.tbl_spec = table_spec
-
+class Table(backend.Table):
     def _create_table(self, db):
         fields = ['`%s` %s' % (name, tp)
                   for name, tp in self.tbl_spec]
@@ -93,31 +71,29 @@ class Table(object):
         sql = 'CREATE TABLE `%s` (%s)' % (self.name, table_description)
         Libmsi.Query.new(db, sql).execute()
 
-    def _normalize_str(self, text):
-        return text
-
     def _write_records(self, db):
+        # INSERT query and record are prepared once per set of non-null
+        # columns and reused for all rows having the same set
+        prepared = {}
         for record in self.records:
-            idx = 0
-            fields = []
-            values = []
-            for item in record:
-                if item is not None:
-                    fields.append('`%s`' % self.tbl_spec[idx][0])
-                    values.append('?')
-                idx += 1
-
-            sql = 'INSERT INTO `%s` (%s) VALUES (%s)' % \
-                  (self.name, ', '.join(fields), ', '.join(values))
-            query = Libmsi.Query.new(db, sql)
+            mask = tuple(item is not None for item in record)
+            query_rec = prepared.get(mask)
+            if query_rec is None:
+                fields = ['`%s`' % spec[0]
+                          for spec, used in zip(self.tbl_spec, mask) if used]
+                sql = 'INSERT INTO `%s` (%s) VALUES (%s)' % \
+                      (self.name, ', '.join(fields),
+                       ', '.join(['?'] * len(fields)))
+                query_rec = prepared[mask] = \
+                    (Libmsi.Query.new(db, sql), Libmsi.Record.new(len(fields)))
+            query, msirec = query_rec
 
-            msirec = Libmsi.Record.new(len(fields))
             index = 1
             for item in record:
-                if isinstance(item, int):
+                if item is None:
+                    continue
+                elif isinstance(item, int):
                     msirec.set_int(index, item)
-                elif item is None:
-                    index -= 1
                 elif isinstance(item, str):
                     msirec.set_string(index, self._normalize_str(item))
                 elif isinstance(item, tuple) and item[0] == 'filepath':
@@ -127,22 +103,15 @@ class Table(object):
                     raise ValueError(msg % (str(type(item)), str(item)))
                 index += 1
             query.execute(msirec)
+            # View has to be closed before it is executed again
+            query.close()
 
-    def write_msi(self, db):
-        pass
-
-
-class Database(object):
-    def __init__(self):
-        self.db = None
-        self.files = []
-        self.medias = []
-        self.tables = None
 
+class Database(backend.Database):
     def build_cabinet(self, cabfile, compressed=True, embed=True):
         folder = GCab.Folder.new(GCab.Compression.MSZIP if compressed
                                  else GCab.Compression.NONE)
-        for filepath, file_id in self.files:
+        for filepath, file_id, _size, _mtime in self.files:
             gpointer = Gio.File.new_for_path(filepath)
             folder.add_file(GCab.File.new_with_file(file_id, gpointer), False)
         cab = GCab.Cabinet.new()
@@ -156,8 +125,8 @@ class Database(object):
     def init_db(self, msifile):
         self.db = Libmsi.Database.new(msifile, Libmsi.DbFlags.CREATE, None)
 
+    def open_db(self, msifile):
+        self.db = Libmsi.Database.new(msifile, Libmsi.DbFlags.TRANSACT, None)
+
     def commit_db(self):
         self.db.commit()
-
-    def write_msi(self, db):
-        pass
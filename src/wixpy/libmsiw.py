@@ -20,22 +20,10 @@
 import os
 import _msi
 
+from wixpy import backend
 
-class SummaryInfo(object):
-    title = None
-    author = None
-    subject = None
-    comments = None
-    template = None
-    keywords = None
-    codepage = None
-    uuid = None
-    filetime = None
-    version = None
-    appname = None
-    security = None
-    source = None
 
+class SummaryInfo(backend.SummaryInfo):
     def write_msi(self, db):
         si = db.GetSummaryInformation(20)
         si.SetProperty(_msi.PID_TITLE, self.title)
@@ -53,17 +41,7 @@ class SummaryInfo(object):
         si.Persist()
 
 
-class Table(object):
-    length = None
-    name = None
-    records = None
-
-    def __init__(self, name, table_spec):
-        self.name = name
-        self.records = []
-        self.length = len(table_spec)
-        self.tbl_spec = table_spec
-
+class Table(backend.Table):
     def _create_table(self, db):
         fields = ['`%s` %s' % (name, tp) for name, tp in self.tbl_spec]
         table_description = ', '.join(fields)
@@ -72,9 +50,6 @@ class Table(object):
         db_view.Execute(None)
         db_view.Close()
 
-    def _normalize_str(self, text):
-        return text
-
     def _write_records(self, db):
         db_view = db.OpenView('SELECT * FROM `%s`' % self.name)
         count = db_view.GetColumnInfo(_msi.MSICOLINFO_NAMES).GetFieldCount()
@@ -101,19 +76,11 @@ class Table(object):
             msirec.ClearData()
         db_view.Close()
 
-    def write_msi(self, db):
-        pass
-
-
-class Database(object):
-    def __init__(self):
-        self.db = None
-        self.files = []
-        self.medias = []
-        self.tables = None
 
+class Database(backend.Database):
     def build_cabinet(self, cabfile, compressed=True, embed=True):
-        _msi.FCICreate(cabfile, self.files)
+        _msi.FCICreate(cabfile, [(filepath, file_id) for filepath, file_id,
+                                 _size, _mtime in self.files])
         if embed:
             self.tables['_Streams'].add(os.path.basename(cabfile),
                                         ('filepath', cabfile))
@@ -121,8 +88,8 @@ class Database(object):
     def init_db(self, msifile):
         self.db = _msi.OpenDatabase(msifile, _msi.MSIDBOPEN_CREATE)
 
+    def open_db(self, msifile):
+        self.db = _msi.OpenDatabase(msifile, _msi.MSIDBOPEN_TRANSACT)
+
     def commit_db(self):
         self.db.Commit()
-
-    def write_msi(self, db):
-        pass
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+#
+#   WXS file loader
+#
+#   Copyright (C) 2018 by Igor E. Novikov
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
+from wixpy import model
+from wixpy import scanner
+from wixpy import utils
+
+CHUNK_SIZE = 64 * 1024
+
+# Model classes of WXS elements which need no special handling
+ELEMENTS = {
+    'Media': model.WixMedia,
+    'Property': model.WixProperty,
+    'DirectoryRef': model.WixDirectoryRef,
+    'Component': model.WixComponent,
+    'ComponentRef': model.WixComponentRef,
+    'Shortcut': model.WixShortcut,
+    'RemoveFolder': model.WixRemoveFolder,
+    'RegistryValue': model.WixRegistryValue,
+    'Environment': model.WixEnvironment,
+}
+
+
+def new_element(cls, ctx, attrs):
+    """Creates model element from WXS attributes bypassing JSON-driven
+    constructor of its class. Attributes unknown to the model are dropped.
+    """
+    item = cls.__new__(cls)
+    model.WixElement.__init__(item, ctx, **attrs)
+    return item
+
+
+class WxsLoader(object):
+    """Builds Wix model from WXS file. The loader is XMLParser target:
+    model elements are created on start tags, so XML tree is not built at
+    all. Comments are kept as comment of the next element, the way the
+    model writes them. Relative paths are resolved against WXS file
+    folder.
+    """
+    path = None
+    base_dir = None
+    ctx = None
+
+    def __init__(self, path, ctx=None):
+        self.path = path
+        self.base_dir = os.path.dirname(path)
+        self.ctx = ctx or utils.BuildContext()
+        self.root = None
+        self.stack = []
+        self.comments = []
+        self.text = []
+
+    def load(self):
+        parser = ElementTree.XMLParser(target=self)
+        with open(self.path, 'rb') as fp:
+            while True:
+                data = fp.read(CHUNK_SIZE)
+                if not data:
+                    break
+                parser.feed(data)
+        parser.close()
+        return self.root
+
+    # XMLParser target methods
+
+    def start(self, tag, attrib):
+        tag = tag.rsplit('}', 1)[-1]
+        parent = self.stack[-1] if self.stack else None
+        item = self.create(tag, utils.encode_json(dict(attrib)), parent)
+        if self.comments:
+            item.comment = utils.encode_json(' '.join(self.comments))
+            self.comments = []
+        self.root = self.root or item
+        self.stack.append(item)
+        self.text = []
+
+    def end(self, tag):
+        item = self.stack.pop()
+        if item.tag == 'Condition':
+            item.condition = utils.encode_json(''.join(self.text).strip())
+        # Comments before end tag have no element to belong to
+        self.comments = []
+
+    def data(self, data):
+        self.text.append(data)
+
+    def comment(self, text):
+        self.comments.append(text.strip())
+
+    def close(self):
+        return self.root
+
+    def create(self, tag, attrs, parent):
+        if parent is None:
+            if tag != 'Wix':
+                raise Exception('%s is not a WXS file' % self.path)
+            return self.create_wix()
+        factory = getattr(self, 'create_' + tag.lower(), None)
+        if factory is not None:
+            item = factory(attrs, parent)
+        elif tag in ELEMENTS:
+            item = new_element(ELEMENTS[tag], self.ctx, attrs)
+        else:
+            raise Exception('Unsupported WXS element <%s> in %s' %
+                            (tag, self.path))
+        if item.parent is None:
+            parent.add(item)
+        return item
+
+    def get_path(self, path):
+        return os.path.normpath(os.path.join(self.base_dir, path))
+
+    def create_wix(self):
+        item = new_element(model.Wix, self.ctx, {'xmlns': model.XMLNS})
+        item.pop('Id')
+        item.ctx = self.ctx
+        item.source_dir = self.base_dir
+        # Package is written next to WXS file by default
+        name = os.path.splitext(os.path.basename(self.path))[0]
+        item.msi_data = {'_OutputName': name, '_OutputDir': self.base_dir}
+        return item
+
+    def create_product(self, attrs, parent):
+        if attrs.get('Id', '*') == '*':
+            attrs['Id'] = self.ctx.ids.get_guid()
+        attrs.setdefault('Codepage', model.defaults()['Codepage'])
+        self.ctx.codepage = attrs['Codepage']
+        item = new_element(model.WixProduct, self.ctx, attrs)
+        item.ctx = self.ctx
+        return item
+
+    def create_package(self, attrs, parent):
+        defaults = model.defaults()
+        for key in ('Description', 'Comments', 'Keywords', 'InstallerVersion',
+                    'SummaryCodepage', 'InstallScope'):
+            attrs.setdefault(key, defaults[key])
+        attrs.setdefault('Languages', parent.get('Language') or
+                         defaults['Languages'])
+        item = new_element(model.WixPackage, self.ctx, attrs)
+        item.ctx = self.ctx
+        return item
+
+    def create_icon(self, attrs, parent):
+        attrs['SourceFile'] = self.get_path(attrs.get('SourceFile', ''))
+        return new_element(model.WixIcon, self.ctx, attrs)
+
+    def create_condition(self, attrs, parent):
+        if parent.tag != 'Product':
+            raise Exception('Unsupported <Condition> in <%s> in %s' %
+                            (parent.tag, self.path))
+        item = new_element(model.WixCondition, self.ctx, attrs)
+        item.pop('Id')
+        item.ctx = self.ctx
+        item.condition = ''
+        return item
+
+    def create_directory(self, attrs, parent):
+        cls = model.WixTargetDir if parent.tag == 'Product' \
+            else model.WixDirectory
+        item = new_element(cls, self.ctx, attrs)
+        if cls is model.WixDirectory:
+            item.path = None
+        return item
+
+    def create_feature(self, attrs, parent):
+        attrs.setdefault('Level', '1')
+        return new_element(model.WixFeature, self.ctx, attrs)
+
+    def create_file(self, attrs, parent):
+        path = self.get_path(attrs.get('Source', ''))
+        try:
+            entry = scanner.stat_file(path)
+        except OSError:
+            raise Exception('File %s is not found' % path)
+        attrs['Source'] = path
+        attrs.setdefault('Name', entry.name)
+        item = new_element(model.WixFile, self.ctx, attrs)
+        item.path = entry.path
+        item.size = entry.size
+        item.mtime = entry.mtime
+        item.ino = None
+        return item
+
+    def create_copyfile(self, attrs, parent):
+        if parent.tag == 'File':
+            # Duplicate of the parent file belongs to its component
+            attrs['FileId'] = parent.get('Id')
+            attrs.setdefault('DestinationName', parent.get('Name'))
+            parent = parent.parent
+        if parent.tag != 'Component' or not attrs.get('FileId'):
+            raise Exception('Unsupported <CopyFile> in %s' % self.path)
+        item = new_element(model.WixCopyFile, self.ctx, attrs)
+        item.wixfile = None
+        parent.add(item)
+        return item
+
+    def create_createfolder(self, attrs, parent):
+        item = new_element(model.WixCreateFolder, self.ctx, attrs)
+        item.pop('Id')
+        return item
+
+
+def load(path, ctx=None):
+    """Loads Wix model from WXS file"""
+    return WxsLoader(path, ctx).load()
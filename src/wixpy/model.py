@@ -18,18 +18,17 @@
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import pickle
+import uuid
 
 from wixpy import msi
+from wixpy import scanner
 from wixpy import utils
 
-WIXL = False
-
 XMLNS = 'http://schemas.microsoft.com/wix/2006/wi'
 INDENT = 4
 WRAP = 3
 
-COMPONENTS = []
-
 ATTRS = {
     'Wix': ('xmlns',),
     'Product': ('Id', 'Name', 'UpgradeCode', 'Language', 'Codepage', 'Version',
@@ -45,6 +44,8 @@ ATTRS = {
     'Component': ('Id', 'Guid', 'Win64'),
     'ComponentRef': ('Id',),
     'File': ('Id', 'DiskId', 'Name', 'KeyPath', 'Source'),
+    'CopyFile': ('Id', 'FileId', 'DestinationDirectory', 'DestinationName'),
+    'CreateFolder': (),
     'Shortcut': ('Id', 'Name', 'Description', 'Target', 'WorkingDirectory'),
     'Feature': ('Id', 'Title', 'Level'),
     'RemoveFolder': ('Id', 'On'),
@@ -54,6 +55,33 @@ ATTRS = {
                     'Permanent', 'Part', 'Action', 'System'),
 }
 
+# Attribute value slots per tag, Id (which any element gets) comes first.
+# WXS attributes are written in this order rather than in the order they
+# are set as it was before slotted nodes.
+FIELDS = {tag: ('Id',) + tuple(key for key in keys if key != 'Id')
+          for tag, keys in ATTRS.items()}
+INDEX = {tag: {key: i for i, key in enumerate(fields)}
+         for tag, fields in FIELDS.items()}
+
+SNAPSHOT_VERSION = 2
+
+# Files getting own component in _ComponentGrouping mode
+VERSIONED_EXTS = ('.exe', '.dll', '.ocx', '.sys', '.drv', '.cpl', '.scr')
+
+
+def project(ctx, tag, data):
+    """Returns tag attribute values picked from data dict. Projection is
+    computed once per build and dict, elements created from the same data
+    share it as a template of their values.
+    """
+    key = (tag, id(data))
+    cached = ctx.projections.get(key)
+    if cached is None or cached[0] is not data:
+        # Dict is kept referenced, so its id cannot be reused
+        values = tuple(data.get(name) for name in FIELDS[tag])
+        cached = ctx.projections[key] = (data, values)
+    return cached[1]
+
 
 def defaults():
     return {
@@ -76,108 +104,185 @@ def defaults():
         'DiskPrompt': 'CD-ROM #1',
         'DiskId': '1',
         '_SkipHidden': True,
+        '_ScanJobs': 1,
+        '_Symlinks': 'follow',
         '_OsCondition': '601',
     }
 
 
+def quote(value):
+    """Returns attribute value escaped for WXS"""
+    value = str(value)
+    if '&' in value or '<' in value or '>' in value or '"' in value:
+        # xml.sax.saxutils is not used as it imports urllib
+        value = value.replace('&', '&amp;').replace('<', '&lt;') \
+            .replace('>', '&gt;').replace('"', '&quot;')
+    return value
+
+
+def msi_name(name):
+    """Returns 'SHORTNAME|Long Name' pair of MSI file or folder name"""
+    longname = short = name.replace(' ', '_')
+    ext = None
+    if '.' in longname:
+        short = ''.join(longname.split('.')[:-1])
+        ext = longname.split('.')[-1]
+    short = short[:8] if len(short) > 8 else short
+    ext = ext[:3] if ext and len(ext) > 3 else ext
+    shortname = '.'.join([short, ext]) if ext else short
+    return '|'.join([shortname, name]) if shortname != name else name
+
+
 class WixElement(object):
-    parent = None
-    childs = None
+    """Model node. Attribute values are kept in a list ordered by FIELDS
+    of the tag (None for absent attribute), leaf nodes share empty childs
+    tuple. Large trees consist of slotted nodes without instance dicts.
+    """
+    __slots__ = ('parent', 'childs', 'values', 'comment')
     tag = None
-    attrs = None
-    comment = None
     is_file = False
     is_dir = False
     is_comp = False
     nl = False
     id_prefix = 'i'
 
-    def __init__(self, **kwargs):
-        self.childs = []
-        self.attrs = {key: value for key, value in kwargs.items()
-                      if key in ATTRS[self.tag]}
-        if 'Id' not in self.attrs or self.attrs['Id'] == '*':
-            self.attrs['Id'] = utils.get_id(self.id_prefix)
-        if self.attrs.get('Guid') == '*':
-            self.attrs['Guid'] = utils.get_guid()
+    def __init__(self, ctx, id_key=None, template=None, **kwargs):
+        # id_key is the source path key of payload elements,
+        # template is projected values, see project()
+        self.parent = None
+        self.childs = ()
+        self.comment = None
+        index = INDEX[self.tag]
+        self.values = values = list(template) if template \
+            else [None] * len(index)
+        for key, value in kwargs.items():
+            if key in index:
+                values[index[key]] = value
+        if values[0] is None or values[0] == '*':
+            values[0] = ctx.ids.get_id(self.id_prefix, id_key)
+        if 'Guid' in index and values[index['Guid']] == '*':
+            values[index['Guid']] = ctx.ids.get_guid(id_key)
 
     def destroy(self):
-        for child in self.childs:
-            child.destroy()
-        for item in self.__dict__.keys():
-            self.__dict__[item] = None
+        # Subtree is dropped as a whole instead of being walked, its
+        # parent references are reclaimed by cyclic garbage collector
+        self.parent = None
+        self.childs = ()
 
     def add(self, child):
-        self.childs.append(child)
+        if self.childs:
+            self.childs.append(child)
+        else:
+            self.childs = [child]
         child.parent = self
 
+    def walk(self):
+        stack = [self]
+        while stack:
+            item = stack.pop()
+            yield item
+            if item.childs:
+                stack.extend(reversed(item.childs))
+
+    def find(self, tag):
+        for item in self.childs:
+            if item.tag == tag:
+                return item
+
     def set(self, **kwargs):
-        self.attrs.update(kwargs)
+        index = INDEX[self.tag]
+        for key, value in kwargs.items():
+            self.values[index[key]] = value
 
     def get(self, key):
-        return self.attrs.get(key)
+        i = INDEX[self.tag].get(key)
+        return None if i is None else self.values[i]
 
     def pop(self, key):
-        if key in self.attrs:
-            self.attrs.pop(key)
-
-    def write_xml(self, fp, indent=0):
+        i = INDEX[self.tag].get(key)
+        if i is not None:
+            self.values[i] = None
+
+    def items(self):
+        return [(key, value) for key, value in
+                zip(FIELDS[self.tag], self.values) if value is not None]
+
+    def write_tag(self, fp, indent, has_childs=None):
+        """Writes element start tag, returns True if element has childs
+        to be written before the end tag.
+        """
+        if has_childs is None:
+            has_childs = bool(self.childs)
         if self.nl:
             fp.write('\n')
         tab = indent * ' '
         if self.comment:
             fp.write('%s<!-- %s -->\n' % (tab, self.comment))
         fp.write('%s<%s' % (tab, self.tag))
-        prefix = '\n%s  ' % tab if len(self.attrs) > WRAP else ' '
-        for key, value in self.attrs.items():
-            fp.write('%s%s="%s"' % (prefix, key, value))
-        if self.childs:
+        attrs = self.items()
+        prefix = '\n%s  ' % tab if len(attrs) > WRAP else ' '
+        for key, value in attrs:
+            fp.write('%s%s="%s"' % (prefix, key, quote(value)))
+        if has_childs:
             fp.write('>\n')
-            for child in self.childs:
-                child.write_xml(fp, indent + INDENT)
-            fp.write('%s</%s>\n' % (tab, self.tag))
-        else:
-            fp.write(' />\n')
+            return True
+        fp.write(' />\n')
+        return False
+
+    def write_xml(self, fp, indent=0):
+        # Stack items are (element, indent, is end tag)
+        stack = [(self, indent, False)]
+        while stack:
+            item, indent, end = stack.pop()
+            if end:
+                fp.write('%s</%s>\n' % (indent * ' ', item.tag))
+            elif item.write_tag(fp, indent):
+                stack.append((item, indent, True))
+                child_indent = indent + INDENT
+                stack.extend((child, child_indent, False)
+                             for child in reversed(item.childs))
 
     def write_msi_records(self, db):
         pass
 
     def write_msi(self, db):
-        self.write_msi_records(db)
-        if self.childs:
-            for child in self.childs:
-                child.write_msi(db)
+        for item in self.walk():
+            item.write_msi_records(db)
 
 
 class WixCondition(WixElement):
+    __slots__ = ('condition', 'ctx')
     tag = 'Condition'
     nl = True
 
-    def __init__(self, msg, condition, level=None, comment=None):
+    def __init__(self, ctx, msg, condition, level=None, comment=None):
+        super(WixCondition, self).__init__(ctx, Message=msg)
         self.comment = comment
         self.condition = condition
-        super(WixCondition, self).__init__(Message=msg)
+        self.ctx = ctx
         if level:
             self.set(Level=str(level))
         self.pop('Id')
 
-    def write_xml(self, fp, indent=0):
+    def write_tag(self, fp, indent, has_childs=None):
         if self.nl:
             fp.write('\n')
         tab = indent * ' '
         if self.comment:
             fp.write('%s<!-- %s -->\n' % (tab, self.comment))
         fp.write('%s<%s' % (tab, self.tag))
-        prefix = '\n%s  ' % tab if len(self.attrs) > WRAP else ' '
-        for key, value in self.attrs.items():
-            fp.write('%s%s="%s"' % (prefix, key, value))
-        if WIXL:
+        attrs = self.items()
+        prefix = '\n%s  ' % tab if len(attrs) > WRAP else ' '
+        for key, value in attrs:
+            fp.write('%s%s="%s"' % (prefix, key, quote(value)))
+        if self.ctx.wixl:
             condition = self.condition
             fp.write('>%s</%s>\n' % (condition, self.tag))
         else:
             tab_int = (indent + INDENT) * ' '
             condition = '%s<![CDATA[%s]]>' % (tab_int, self.condition)
             fp.write('>\n%s\n%s</%s>\n' % (condition, tab, self.tag))
+        return False
 
     def write_msi_records(self, db):
         db.tables[msi.MT_LAUNCHCONDITION].add(self.condition,
@@ -196,43 +301,49 @@ OS_CONDITION = {
 
 
 class WixOsCondition(WixCondition):
-    def __init__(self, os_condition):
+    __slots__ = ()
+
+    def __init__(self, ctx, os_condition):
         comment = 'Launch Condition to check suitable system version'
         os_condition = '501' if str(os_condition) not in OS_CONDITION \
             else str(os_condition)
         msg = 'This application is only ' \
               'supported on %s or higher.' % OS_CONDITION[os_condition]
         os_condition = 'Installed OR (VersionNT >= %s)' % os_condition
-        super(WixOsCondition, self).__init__(msg, os_condition,
+        super(WixOsCondition, self).__init__(ctx, msg, os_condition,
                                              comment=comment)
 
 
 class WixArchCondition(WixCondition):
-    def __init__(self):
+    __slots__ = ()
+
+    def __init__(self, ctx):
         comment = 'Launch Condition to check that ' \
                   'x64 installer is used on x64 systems'
         msg = '64-bit operating system was not detected, ' \
               'please use the 32-bit installer.'
-        super(WixArchCondition, self).__init__(msg, 'VersionNT64',
+        super(WixArchCondition, self).__init__(ctx, msg, 'VersionNT64',
                                                comment=comment)
 
 
 class WixProperty(WixElement):
+    __slots__ = ()
     tag = 'Property'
 
-    def __init__(self, pid, value):
-        super(WixProperty, self).__init__(Id=pid, Value=value)
+    def __init__(self, ctx, pid, value):
+        super(WixProperty, self).__init__(ctx, Id=pid, Value=value)
 
     def write_msi_records(self, db):
         db.tables[msi.MT_PROPERTY].add(self.get('Id'), self.get('Value'))
 
 
 class WixIcon(WixElement):
+    __slots__ = ()
     tag = 'Icon'
     nl = True
 
-    def __init__(self, source):
-        super(WixIcon, self).__init__(SourceFile=source,
+    def __init__(self, ctx, source):
+        super(WixIcon, self).__init__(ctx, SourceFile=source,
                                       Id=os.path.basename(source))
 
     def write_msi_records(self, db):
@@ -242,11 +353,12 @@ class WixIcon(WixElement):
 
 
 class WixMedia(WixElement):
+    __slots__ = ()
     tag = 'Media'
     nl = True
 
-    def __init__(self, data):
-        super(WixMedia, self).__init__(Id='1', **data)
+    def __init__(self, ctx, data):
+        super(WixMedia, self).__init__(ctx, Id='1', **data)
 
     def write_msi_records(self, db):
         cabinet = '#%s' % self.get('Cabinet') if self.get('EmbedCab') == 'yes' \
@@ -258,53 +370,88 @@ class WixMedia(WixElement):
 
 
 class WixFile(WixElement):
+    __slots__ = ('path', 'size', 'mtime', 'ino')
     tag = 'File'
-    path = None
     is_file = True
     id_prefix = 'fil'
 
-    def __init__(self, data, path, rel_path):
-        self.path = path
-        super(WixFile, self).__init__(**data)
-        self.set(Name=os.path.basename(rel_path), Source=path)
+    def __init__(self, ctx, data, entry):
+        self.path = entry.path
+        self.size = entry.size
+        self.mtime = entry.mtime
+        self.ino = entry.ino
+        super(WixFile, self).__init__(ctx, ctx.ids.path_key(entry.path),
+                                      project(ctx, self.tag, data),
+                                      Name=entry.name, Source=entry.path)
 
     def get_msi_name(self):
-        filename = self.get('Name')
-        longname = name = filename.replace(' ', '_')
-        ext = None
-        if '.' in longname:
-            name = ''.join(longname.split('.')[:-1])
-            ext = longname.split('.')[-1]
-        name = name[:8] if len(name) > 8 else name
-        ext = ext[:3] if ext and len(ext) > 3 else ext
-        shortname = '.'.join([name, ext]) if ext else name
-        return '|'.join([shortname, filename]) \
-            if shortname != filename else filename
+        return msi_name(self.get('Name'))
 
     def write_msi_records(self, db):
         table = db.tables[msi.MT_FILE]
         file_id = self.get('Id')
         comp_id = self.parent.get('Id')
         name = self.get_msi_name()
-        size = os.path.getsize(self.get('Source'))
-        sequence = len(table.records) + 1
+        if self.mtime is None:
+            # Taken from scan cache, file may be rewritten in place
+            entry = scanner.stat_file(self.path)
+            self.size, self.mtime = entry.size, entry.mtime
+        size = self.size
+        sequence = table.count + 1
         table.add(file_id, comp_id, name, size, None, None,
                   msi.FileAttribute.VITAL, sequence)
-        db.files.append((self.get('Source'), file_id))
+        db.files.append((self.get('Source'), file_id, size, self.mtime))
+
+
+class WixCopyFile(WixElement):
+    __slots__ = ('wixfile',)
+    tag = 'CopyFile'
+
+    def __init__(self, ctx, wixfile, source_id, dir_id):
+        self.wixfile = wixfile
+        super(WixCopyFile, self).__init__(ctx, Id=wixfile.get('Id'),
+                                          FileId=source_id,
+                                          DestinationDirectory=dir_id,
+                                          DestinationName=wixfile.get('Name'))
+
+    def write_msi_records(self, db):
+        table = db.tables[msi.MT_DUPLICATEFILE]
+        name = self.get('DestinationName')
+        table.add(self.get('Id'), self.parent.get('Id'), self.get('FileId'),
+                  msi_name(name) if name else None,
+                  self.get('DestinationDirectory'))
+
+
+class WixCreateFolder(WixElement):
+    """Makes the component folder its KeyPath, for payload components
+    holding CopyFile elements only.
+    """
+    __slots__ = ()
+    tag = 'CreateFolder'
+
+    def __init__(self, ctx):
+        # Empty Id is not generated, so stable Ids of other elements do
+        # not depend on where key folders are created
+        super(WixCreateFolder, self).__init__(ctx, Id='')
+        self.pop('Id')
+
+    def write_msi_records(self, db):
+        db.tables[msi.MT_CREATEFOLDER].add(self.parent.parent.get('Id'),
+                                           self.parent.get('Id'))
 
 
 class WixComponent(WixElement):
+    __slots__ = ()
     tag = 'Component'
     is_comp = True
     id_prefix = 'cmp'
 
-    def __init__(self, path=None, rel_path=None, **data):
-        super(WixComponent, self).__init__(Guid=utils.get_guid(),
-                                           **data)
-        if path and rel_path:
-            self.add(WixFile(data, path, rel_path))
-
-        COMPONENTS.append(self.attrs['Id'])
+    def __init__(self, ctx, entry=None, data=None):
+        id_key = ctx.ids.path_key(entry.path) if entry else None
+        template = project(ctx, self.tag, data) if data else None
+        super(WixComponent, self).__init__(ctx, id_key, template, Guid='*')
+        if entry:
+            self.add(WixFile(ctx, data, entry))
 
     def write_msi_records(self, db):
         attr = msi.ComponentAttribute.LOCAL_ONLY
@@ -317,47 +464,64 @@ class WixComponent(WixElement):
                 if child.tag == 'RegistryValue':
                     key = child.get('Id')
                     break
-        elif self.childs[0].tag == 'File':
-            key = self.childs[0].get('Id')
+        else:
+            files = [child for child in self.childs if child.tag == 'File']
+            keys = [child for child in files if child.get('KeyPath') == 'yes']
+            if keys or files:
+                key = (keys or files)[0].get('Id')
 
         table = db.tables[msi.MT_COMPONENT]
         table.add(self.get('Id'), '{%s}' % self.get('Guid'),
                   self.parent.get('Id'), attr, None, key)
 
 
+class WixDirComponent(WixComponent):
+    """Component of unversioned files of a folder, the first file is
+    its KeyPath.
+    """
+    __slots__ = ()
+
+    def __init__(self, ctx, folder, data):
+        id_key = ctx.ids.path_key(folder.path)
+        if id_key is not None:
+            # Keeps folder key apart from file component keys
+            id_key += '/'
+        super(WixComponent, self).__init__(ctx, id_key,
+                                           project(ctx, self.tag, data),
+                                           Guid='*')
+
+    def add(self, child):
+        child.set(KeyPath=None if self.childs else 'yes')
+        super(WixDirComponent, self).add(child)
+
+    def remove(self, child):
+        self.childs.remove(child)
+        child.parent = None
+        if self.childs:
+            self.childs[0].set(KeyPath='yes')
+
+    def set_key_path(self):
+        # The first file left in the component is its KeyPath
+        files = [child for child in self.childs if child.tag == 'File']
+        for child in files:
+            child.set(KeyPath='yes' if child is files[0] else None)
+
+
 class WixDirectory(WixElement):
+    __slots__ = ('path',)
     tag = 'Directory'
     is_dir = True
     id_prefix = 'dir'
 
-    def __init__(self, data=None, path=None, rel_path=None, **kwargs):
-        name = kwargs['Name'] if 'Name' in kwargs \
-            else os.path.basename(rel_path)
+    def __init__(self, ctx, entry=None, **kwargs):
+        name = kwargs['Name'] if 'Name' in kwargs else entry.name
         pid = kwargs['Id'] if 'Id' in kwargs else '*'
-        super(WixDirectory, self).__init__(Id=pid, Name=name)
-
-        if data is not None:
-            for item in os.listdir(path):
-                if data.get('_SkipHidden') and item.startswith('.'):
-                    continue
-                item_path = os.path.join(path, item)
-                item_rel_path = os.path.join(rel_path, item)
-                if os.path.isdir(item_path):
-                    self.add(WixDirectory(data, item_path, item_rel_path))
-                elif os.path.isfile(item_path):
-                    self.add(WixComponent(item_path, item_rel_path, **data))
+        id_key = ctx.ids.path_key(entry.path) if entry else None
+        super(WixDirectory, self).__init__(ctx, id_key, Id=pid, Name=name)
+        self.path = entry.path if entry else None
 
     def get_msi_name(self, dirname):
-        longname = name = dirname.replace(' ', '_')
-        ext = None
-        if '.' in longname:
-            name = ''.join(longname.split('.')[:-1])
-            ext = longname.split('.')[-1]
-        name = name[:8] if len(name) > 8 else name
-        ext = ext[:3] if ext and len(ext) > 3 else ext
-        shortname = '.'.join([name, ext]) if ext else name
-        return '|'.join([shortname, dirname]) \
-            if shortname != dirname else dirname
+        return msi_name(dirname)
 
     def write_msi_records(self, db):
         table = db.tables[msi.MT_DIRECTORY]
@@ -369,37 +533,524 @@ class WixDirectory(WixElement):
 class WixInstallDir(WixElement):
     tag = 'Directory'
     is_dir = True
-
-    def __init__(self, data):
-        super(WixInstallDir, self).__init__(Id='INSTALLDIR',
+    path = None
+    data = None
+    path_filter = None
+    streaming = False
+    dedup = False
+    follow_links = True
+    grouping = False
+    payload_refs = None
+
+    def __init__(self, ctx, data):
+        super(WixInstallDir, self).__init__(ctx, Id='INSTALLDIR',
                                             Name=data.get('_InstallDir'))
-        path = data.get('_SourceDir')
-        rel_path = os.path.basename(path)
-        # Recursive scan start
-        for item in os.listdir(path):
-            if data.get('_SkipHidden') and item.startswith('.'):
+        self.ctx = ctx
+        self.path = data.get('_SourceDir')
+        self.data = data
+        self.streaming = bool(data.get('_Streaming'))
+        self.dedup = bool(data.get('_Deduplicate'))
+        self.follow_links = data.get('_Symlinks') != 'skip'
+        self.grouping = bool(data.get('_ComponentGrouping'))
+        if data.get('_Include') or data.get('_Exclude'):
+            self.path_filter = scanner.PathFilter(data.get('_Include'),
+                                                  data.get('_Exclude'))
+        self.reserved = {}
+        self.reserved_dirs = {}
+        self.retired = {}
+        self.targets = set()
+        self.hashes = {}
+        # Source file path: WixFile index filled while building the tree
+        self.files = {}
+        if not self.streaming:
+            # Source tree scan start
+            self.add_tree(self, self.path)
+
+    def scan(self, path=None):
+        sort = bool(self.data.get('_SortedScan'))
+        if path is None:
+            cache_dir = self.data.get('_ScanCache', True)
+            if cache_dir is True:
+                cache_dir = scanner.default_cache_dir()
+            return scanner.walk(self.path, self.data.get('_SkipHidden'),
+                                self.data.get('_ScanJobs'), cache_dir,
+                                self.path_filter,
+                                follow_links=self.follow_links, sort=sort)
+        return scanner.walk(path, self.data.get('_SkipHidden'),
+                            self.data.get('_ScanJobs'), None,
+                            self.path_filter, self.path, self.follow_links,
+                            sort)
+
+    def is_grouped(self, entry):
+        return self.grouping and \
+            not entry.name.lower().endswith(VERSIONED_EXTS)
+
+    def add_tree(self, parent, path):
+        dirs = {path: parent}
+        groups = {}
+        for parent_path, entry in self.scan(None if parent is self else path):
+            if entry.is_dir:
+                dirs[entry.path] = WixDirectory(self.ctx, entry)
+                dirs[parent_path].add(dirs[entry.path])
+            elif self.is_grouped(entry):
+                comp = groups.get(parent_path)
+                if comp is None:
+                    comp = WixDirComponent(self.ctx, dirs[parent_path],
+                                           self.data)
+                    groups[parent_path] = comp
+                wixfile = WixFile(self.ctx, self.data, entry)
+                comp.add(wixfile)
+                self.files[entry.path] = wixfile
+            else:
+                comp = WixComponent(self.ctx, entry, self.data)
+                dirs[parent_path].add(comp)
+                self.files[entry.path] = comp.childs[0]
+        # Folder components follow the folder content as in streaming mode
+        for parent_path, comp in groups.items():
+            dirs[parent_path].add(comp)
+
+    def update(self, paths):
+        """Rescans changed source folders. Unchanged files keep their
+        components with their Ids and GUIDs. Returns True if installed
+        file tree has been changed.
+        """
+        self.restore_copies()
+        dirs = {item.path: item for item in self.walk() if item.is_dir}
+        changed = False
+        for path in sorted(paths, key=lambda item: item.count(os.sep)):
+            item = dirs.get(path)
+            if item is not None and self.is_attached(item):
+                changed = self.update_dir(item) or changed
+        self.deduplicate()
+        return changed
+
+    def is_attached(self, item):
+        while item is not self:
+            if item is None:
+                return False
+            item = item.parent
+        return True
+
+    def update_dir(self, parent):
+        rel_path = scanner.rel_dir(self.path, parent.path) \
+            if self.path_filter else ''
+        try:
+            listing = scanner.listdir(parent.path,
+                                      self.data.get('_SkipHidden'),
+                                      self.path_filter, rel_path,
+                                      self.follow_links)
+        except OSError:
+            # Removed folder, its parent is updated as well
+            return False
+        entries = {entry.name: entry for entry in listing}
+        changed = False
+        group = None
+        for child in list(parent.childs):
+            if child.is_dir:
+                entry = entries.get(os.path.basename(child.path))
+                if entry is not None and entry.is_dir:
+                    entries.pop(entry.name)
+                    continue
+            elif isinstance(child, WixDirComponent):
+                changed = self.update_group(child, entries) or changed
+                if child.childs:
+                    group = child
+                    continue
+            elif child.is_comp:
+                wixfile = child.childs[0]
+                entry = entries.get(wixfile.get('Name'))
+                if entry is not None and not entry.is_dir:
+                    entries.pop(entry.name)
+                    changed = self.update_file(wixfile, entry) or changed
+                    continue
+                self.retired[wixfile.path] = child
+                self.files.pop(wixfile.path, None)
+            if child.is_dir:
+                for item in child.walk():
+                    if item.is_file:
+                        self.files.pop(item.path, None)
+            parent.childs.remove(child)
+            child.parent = None
+            changed = True
+        for entry in listing:
+            if entry.name not in entries:
+                continue
+            if entry.is_dir:
+                item = WixDirectory(self.ctx, entry)
+                parent.add(item)
+                self.add_tree(item, entry.path)
+            elif self.is_grouped(entry):
+                if group is None:
+                    group = WixDirComponent(self.ctx, parent, self.data)
+                # Returned file gets its former Ids back
+                item = self.retired.pop(entry.path, None)
+                if item is None:
+                    item = WixFile(self.ctx, self.data, entry)
+                else:
+                    self.update_file(item, entry)
+                group.add(item)
+                self.files[entry.path] = item
+            else:
+                item = self.retired.pop(entry.path, None)
+                if item is None:
+                    item = WixComponent(self.ctx, entry, self.data)
+                else:
+                    self.update_file(item.childs[0], entry)
+                parent.add(item)
+                self.files[entry.path] = item.childs[0]
+            changed = True
+        if group is not None:
+            # Folder component is the last child
+            if group.parent is parent:
+                parent.childs.remove(group)
+            parent.add(group)
+        return changed
+
+    def update_group(self, comp, entries):
+        changed = False
+        for wixfile in list(comp.childs):
+            entry = entries.get(wixfile.get('Name'))
+            if entry is not None and not entry.is_dir:
+                entries.pop(entry.name)
+                changed = self.update_file(wixfile, entry) or changed
+                continue
+            self.retired[wixfile.path] = wixfile
+            self.files.pop(wixfile.path, None)
+            comp.remove(wixfile)
+            changed = True
+        return changed
+
+    @staticmethod
+    def update_file(wixfile, entry):
+        # Returns True if file stat data has been changed
+        if (entry.size, entry.mtime, entry.ino) == \
+                (wixfile.size, wixfile.mtime, wixfile.ino):
+            return False
+        wixfile.size, wixfile.mtime = entry.size, entry.mtime
+        wixfile.ino = entry.ino
+        return True
+
+    def restore_copies(self):
+        groups = set()
+        items = [item for item in self.walk()
+                 if item.tag in ('CopyFile', 'CreateFolder')]
+        for item in items:
+            comp = item.parent
+            if item.tag == 'CreateFolder':
+                comp.childs.remove(item)
+                continue
+            comp.childs[comp.childs.index(item)] = item.wixfile
+            if isinstance(comp, WixDirComponent):
+                groups.add(comp)
+        for comp in groups:
+            comp.set_key_path()
+
+    def set_copy(self, wixfile, source):
+        comp = wixfile.parent
+        copy = WixCopyFile(self.ctx, wixfile, source.get('Id'),
+                           comp.parent.get('Id'))
+        comp.childs[comp.childs.index(wixfile)] = copy
+        copy.parent = comp
+        return copy
+
+    def is_kept(self, wixfile):
+        # Shortcut targets are never replaced by copies
+        return wixfile.path in self.targets
+
+    def deduplicate(self):
+        """Replaces hardlinks and symlinks to an already listed file by
+        CopyFile elements, so each physical file is read and compressed
+        into cabinet once. With _Deduplicate files with content identical
+        to an earlier file are replaced as well, only files of colliding
+        sizes are hashed. The source is the first file in walk order,
+        shortcut targets are kept in File table. KeyPath of folder component
+        goes to its first file left, a component left with copies only gets
+        its folder as KeyPath as in streaming mode.
+        """
+        self.restore_copies()
+        inodes = {}
+        sizes = {}
+        # Replaced file: its source file
+        sources = {}
+        files = [item for item in self.walk() if item.is_file]
+        for item in files:
+            if item.ino is not None:
+                source = inodes.setdefault(item.ino, item)
+                if source is not item and not self.is_kept(item):
+                    sources[item] = source
+                    continue
+            if self.dedup and item.size:
+                sizes.setdefault(item.size, []).append(item)
+        for group in sizes.values():
+            if len(group) < 2:
                 continue
-            item_path = os.path.join(path, item)
-            item_rel_path = os.path.join(rel_path, item)
-            if os.path.isdir(item_path):
-                self.add(WixDirectory(data, item_path, item_rel_path))
-            elif os.path.isfile(item_path):
-                self.add(WixComponent(item_path, item_rel_path, **data))
+            hashes = {}
+            for wixfile in group:
+                md5 = utils.get_filehash(self.hashes, wixfile.path,
+                                         wixfile.size, wixfile.mtime)
+                source = hashes.setdefault(md5, wixfile)
+                if source is not wixfile and not self.is_kept(wixfile):
+                    sources[wixfile] = source
+        copies = []
+        for item in files:
+            source = sources.get(item)
+            if source is not None:
+                # Hardlink source may be a copy of identical file itself
+                source = sources.get(source, source)
+                copies.append(self.set_copy(item, source))
+        for comp in set(copy.parent for copy in copies):
+            if not any(item.tag == 'File' for item in comp.childs):
+                key_folder = WixCreateFolder(self.ctx)
+                comp.childs.append(key_folder)
+                key_folder.parent = comp
+            elif isinstance(comp, WixDirComponent):
+                comp.set_key_path()
+
+    def find_by_path(self, path):
+        """Returns (directory Id, file Id) of the source file"""
+        if self.streaming:
+            return self.reserve(path)
+        wixfile = self.files.get(path)
+        if wixfile is None:
+            return None, None
+        return wixfile.parent.parent.get('Id'), wixfile.get('Id')
+
+    def reserve(self, path):
+        # Pre-assigns Ids for a payload file in streaming mode
+        dir_path = os.path.dirname(path)
+        if dir_path == self.path:
+            dir_id = self.get('Id')
+        else:
+            dir_id = self.reserved_dirs.get(dir_path)
+            if dir_id is None:
+                dir_id = self.ctx.ids.get_id('dir',
+                                             self.ctx.ids.path_key(dir_path))
+                self.reserved_dirs[dir_path] = dir_id
+        file_id = self.reserved.get(path)
+        if file_id is None:
+            file_id = self.ctx.ids.get_id('fil', self.ctx.ids.path_key(path))
+            self.reserved[path] = file_id
+        return dir_id, file_id
+
+    def get_filehash(self, path, size, mtime):
+        return utils.get_filehash(self.hashes, path, size, mtime)
+
+    def stream_payload(self, get_filehash, hash_all=False):
+        """Scans source folder in streaming mode yielding (element, md5)
+        pairs: folders, file components before their payload element,
+        File or CopyFile payload elements and folder components after
+        their folder is scanned. Only folders and folder components being
+        scanned are kept, files of folder components are resolved when
+        their folder is scanned, i.e. in the order deduplicate() walks
+        the model tree, so copies and their sources are the same in both
+        modes. get_filehash(path, size, mtime) is called for each stored
+        file if hash_all is set, otherwise to find duplicates only. Inodes
+        are recorded for hardlinks, symlinks and files of symlinked folders
+        only, so a single-link file is stored again when it is reached
+        through a symlink after its real path.
+        """
+        dirs = {self.path: self}
+        # Folder path: (folder component, [(file, entry, inode recorded)])
+        groups = {}
+        # Stored file Ids by inode and by (size, md5)
+        stored = ({}, {})
+        # Folders being scanned, entries of the last one are listed now
+        scanned = [self.path]
+        # Depth of the first symlinked folder being scanned
+        link_depth = None
+        for parent, entry in self.scan():
+            while scanned[-1] != parent:
+                path = scanned.pop()
+                del dirs[path]
+                if link_depth is not None and len(scanned) < link_depth:
+                    link_depth = None
+                for item in self.close_group(groups.pop(path, None), stored,
+                                             get_filehash, hash_all):
+                    yield item
+            if entry.is_dir:
+                item = WixDirectory(self.ctx, entry)
+                if entry.path in self.reserved_dirs:
+                    item.set(Id=self.reserved_dirs[entry.path])
+                item.parent = dirs[parent]
+                dirs[entry.path] = item
+                scanned.append(entry.path)
+                if entry.is_link and link_depth is None:
+                    link_depth = len(scanned)
+                yield item, None
+                continue
+            record = bool(entry.nlink != 1 or entry.is_link or link_depth)
+            if self.is_grouped(entry):
+                group = groups.get(parent)
+                if group is None:
+                    comp = WixDirComponent(self.ctx, dirs[parent], self.data)
+                    comp.parent = dirs[parent]
+                    group = groups[parent] = (comp, [])
+                wixfile = WixFile(self.ctx, self.data, entry)
+                wixfile.set(KeyPath=None)
+                wixfile.parent = group[0]
+                if entry.path in self.reserved:
+                    wixfile.set(Id=self.reserved[entry.path])
+                group[1].append((wixfile, entry, record))
+                continue
+            comp = WixComponent(self.ctx, entry, self.data)
+            comp.parent = dirs[parent]
+            wixfile = comp.childs[0]
+            if entry.path in self.reserved:
+                wixfile.set(Id=self.reserved[entry.path])
+            item, md5 = self.stream_file(wixfile, entry, record, stored,
+                                         get_filehash, hash_all)
+            key_folder = None
+            if item is not wixfile:
+                # Source component is written already, so the folder
+                # becomes KeyPath of the copy
+                comp.childs[0] = item
+                key_folder = WixCreateFolder(self.ctx)
+                comp.add(key_folder)
+            yield comp, None
+            yield item, md5
+            if key_folder is not None:
+                yield key_folder, None
+        while scanned:
+            for item in self.close_group(groups.pop(scanned.pop(), None),
+                                         stored, get_filehash, hash_all):
+                yield item
+
+    def stream_file(self, wixfile, entry, record, stored, get_filehash,
+                    hash_all):
+        # Returns (File or CopyFile element, md5) for a scanned file
+        inodes, sources = stored
+        file_id = source_id = wixfile.get('Id')
+        if entry.ino is not None:
+            source_id = inodes.get(entry.ino, file_id)
+            if source_id == file_id and record:
+                inodes[entry.ino] = file_id
+        md5 = None
+        if source_id == file_id and (hash_all or self.dedup and entry.size):
+            # Hardlinks are not read again
+            md5 = get_filehash(entry.path, entry.size, entry.mtime)
+            if self.dedup and entry.size:
+                source_id = sources.setdefault((entry.size, md5), file_id)
+                if entry.ino in inodes:
+                    # Later hardlinks refer to the stored file
+                    inodes[entry.ino] = source_id
+        if source_id == file_id or entry.path in self.reserved:
+            return wixfile, md5
+        comp = wixfile.parent
+        copy = WixCopyFile(self.ctx, wixfile, source_id,
+                           comp.parent.get('Id'))
+        copy.parent = comp
+        return copy, md5
+
+    def close_group(self, group, stored, get_filehash, hash_all):
+        # Returns (element, md5) pairs to yield for folder component
+        # of a scanned folder
+        if group is None:
+            return []
+        comp, files = group
+        items = []
+        for wixfile, entry, record in files:
+            item, md5 = self.stream_file(wixfile, entry, record, stored,
+                                         get_filehash, hash_all)
+            if item is wixfile and not comp.childs:
+                # The first stored file is KeyPath of folder component,
+                # the component keeps it only
+                comp.add(wixfile)
+            items.append((item, md5))
+        if not comp.childs:
+            # Folder component of copies only
+            key_folder = WixCreateFolder(self.ctx)
+            key_folder.parent = comp
+            comp.childs = [key_folder]
+            items.append((key_folder, None))
+        items.append((comp, None))
+        return items
+
+    def write_payload(self, db, feature_id):
+        # Streaming mode: payload rows go straight into table writers
+        for item, md5 in self.stream_payload(db.get_filehash, True):
+            item.write_msi_records(db)
+            if item.is_comp:
+                db.tables[msi.MT_FEATURECOMPONENTS].add(feature_id,
+                                                        item.get('Id'))
+            elif item.is_file:
+                if md5 is None:
+                    md5 = db.get_filehash(item.path, item.size, item.mtime)
+                db.tables[msi.MT_FILEHASH].add(item.get('Id'), 0, *md5)
+
+    def write_payload_xml(self, fp, indent):
+        # Streaming mode: payload elements are written while scanning,
+        # Ids of payload components are spooled for Feature element
+        import tempfile
+        self.payload_refs = tempfile.TemporaryFile('w+')
+        # Stack items are [folder, indent, start tag written,
+        # elements of folder component]
+        stack = [[self, indent, False, None]]
+        for item, _md5 in self.stream_payload(self.get_filehash):
+            folder = item.parent
+            if not item.is_dir and not item.is_comp:
+                comp, folder = folder, folder.parent
+                if not isinstance(comp, WixDirComponent):
+                    # Written with its component
+                    continue
+            while stack[-1][0] is not folder:
+                self.close_folder_xml(fp, *stack.pop())
+            top = stack[-1]
+            if not top[2]:
+                # Install folder itself is written by the base method
+                WixElement.write_tag(top[0], fp, top[1], True)
+                top[2] = True
+            if item.is_dir:
+                stack.append([item, top[1] + INDENT, False, None])
+            elif isinstance(item, WixDirComponent):
+                # Its elements are written when the folder is closed
+                self.payload_refs.write(item.get('Id') + '\n')
+            elif item.is_comp:
+                item.write_xml(fp, top[1] + INDENT)
+                self.payload_refs.write(item.get('Id') + '\n')
+            elif top[3] is None:
+                top[3] = [item]
+            else:
+                top[3].append(item)
+        while stack:
+            self.close_folder_xml(fp, *stack.pop())
+
+    @staticmethod
+    def close_folder_xml(fp, folder, indent, started, group):
+        if not started:
+            WixElement.write_tag(folder, fp, indent, False)
+            return
+        if group is not None:
+            comp = group[0].parent
+            childs, comp.childs = comp.childs, group
+            comp.write_xml(fp, indent + INDENT)
+            comp.childs = childs
+        fp.write('%s</%s>\n' % (indent * ' ', folder.tag))
+
+    def write_tag(self, fp, indent, has_childs=None):
+        if not self.streaming:
+            return super(WixInstallDir, self).write_tag(fp, indent,
+                                                        has_childs)
+        self.write_payload_xml(fp, indent)
+        return False
 
     def write_msi_records(self, db):
         table = db.tables[msi.MT_DIRECTORY]
         table.add(self.get('Id'), self.parent.get('Id'), self.get('Name'))
+        if self.streaming:
+            product = self.parent.parent.parent
+            self.write_payload(db, product.get_feature().get('Id'))
 
 
 class WixPfDir(WixElement):
+    __slots__ = ()
     tag = 'Directory'
     is_dir = True
 
-    def __init__(self, data):
+    def __init__(self, ctx, data):
         pid = 'ProgramFiles64Folder' if data.get('Win64') == 'yes' \
             else 'ProgramFilesFolder'
-        super(WixPfDir, self).__init__(Id=pid, Name='PFiles')
-        self.add(WixInstallDir(data))
+        super(WixPfDir, self).__init__(ctx, Id=pid, Name='PFiles')
+        self.add(WixInstallDir(ctx, data))
 
     def write_msi_records(self, db):
         table = db.tables[msi.MT_DIRECTORY]
@@ -407,14 +1058,16 @@ class WixPfDir(WixElement):
 
 
 class WixTargetDir(WixElement):
+    __slots__ = ()
     tag = 'Directory'
     is_dir = True
     nl = True
 
-    def __init__(self, data):
+    def __init__(self, ctx, data):
+        super(WixTargetDir, self).__init__(ctx, Id='TARGETDIR',
+                                           Name='SourceDir')
         self.comment = 'Installed file tree'
-        super(WixTargetDir, self).__init__(Id='TARGETDIR', Name='SourceDir')
-        self.add(WixPfDir(data))
+        self.add(WixPfDir(ctx, data))
 
     def write_msi_records(self, db):
         table = db.tables[msi.MT_DIRECTORY]
@@ -422,13 +1075,35 @@ class WixTargetDir(WixElement):
 
 
 class WixFeature(WixElement):
+    __slots__ = ()
     tag = 'Feature'
     nl = True
 
-    def __init__(self, data):
-        super(WixFeature, self).__init__(Title=data.get('Name'), Level='1')
-        for item in COMPONENTS:
-            self.add(WixComponentRef(Id=item))
+    def __init__(self, ctx, data, components):
+        super(WixFeature, self).__init__(ctx, Title=data.get('Name'),
+                                         Level='1')
+        for item in components:
+            self.add(WixComponentRef(ctx, Id=item.get('Id')))
+
+    def write_tag(self, fp, indent, has_childs=None):
+        install_dir = self.parent.get_install_dir() \
+            if self.parent.tag == 'Product' else None
+        refs = install_dir.payload_refs if install_dir is not None else None
+        if refs is None:
+            return super(WixFeature, self).write_tag(fp, indent, has_childs)
+        # Streamed payload components go first as in the model tree
+        install_dir.payload_refs = None
+        super(WixFeature, self).write_tag(fp, indent, True)
+        child_indent = indent + INDENT
+        refs.seek(0)
+        for line in refs:
+            item = WixComponentRef(install_dir.ctx, Id=line.rstrip('\n'))
+            item.write_xml(fp, child_indent)
+        refs.close()
+        for child in self.childs:
+            child.write_xml(fp, child_indent)
+        fp.write('%s</%s>\n' % (indent * ' ', self.tag))
+        return False
 
     def write_msi_records(self, db):
         table = db.tables[msi.MT_FEATURE]
@@ -439,10 +1114,11 @@ class WixFeature(WixElement):
 
 
 class WixShortcut(WixElement):
+    __slots__ = ()
     tag = 'Shortcut'
 
-    def __init__(self, shortcut_data):
-        super(WixShortcut, self).__init__(**shortcut_data)
+    def __init__(self, ctx, shortcut_data):
+        super(WixShortcut, self).__init__(ctx, **shortcut_data)
 
     def write_msi_records(self, db):
         table = db.tables[msi.MT_SHORTCUT]
@@ -458,10 +1134,11 @@ class WixShortcut(WixElement):
 
 
 class WixRemoveFolder(WixElement):
+    __slots__ = ()
     tag = 'RemoveFolder'
 
-    def __init__(self, **kwargs):
-        super(WixRemoveFolder, self).__init__(**kwargs)
+    def __init__(self, ctx, **kwargs):
+        super(WixRemoveFolder, self).__init__(ctx, **kwargs)
 
     def write_msi_records(self, db):
         table = db.tables[msi.MT_REMOVEFILE]
@@ -471,11 +1148,12 @@ class WixRemoveFolder(WixElement):
 
 
 class WixRegistryValue(WixElement):
+    __slots__ = ()
     tag = 'RegistryValue'
     id_prefix = 'reg'
 
-    def __init__(self, **kwargs):
-        super(WixRegistryValue, self).__init__(**kwargs)
+    def __init__(self, ctx, **kwargs):
+        super(WixRegistryValue, self).__init__(ctx, **kwargs)
 
     def write_msi_records(self, db):
         table = db.tables[msi.MT_REGISTRY]
@@ -491,17 +1169,19 @@ class WixRegistryValue(WixElement):
 
 
 class WixDirectoryRef(WixElement):
+    __slots__ = ()
     tag = 'DirectoryRef'
 
-    def __init__(self, **kwargs):
-        super(WixDirectoryRef, self).__init__(**kwargs)
+    def __init__(self, ctx, **kwargs):
+        super(WixDirectoryRef, self).__init__(ctx, **kwargs)
 
 
 class WixComponentRef(WixElement):
+    __slots__ = ()
     tag = 'ComponentRef'
 
-    def __init__(self, **kwargs):
-        super(WixComponentRef, self).__init__(**kwargs)
+    def __init__(self, ctx, **kwargs):
+        super(WixComponentRef, self).__init__(ctx, **kwargs)
 
     def write_msi_records(self, db):
         table = db.tables[msi.MT_FEATURECOMPONENTS]
@@ -509,26 +1189,28 @@ class WixComponentRef(WixElement):
 
 
 class WixShortcutComponent(WixComponent):
+    __slots__ = ()
     tag = 'Component'
 
-    def __init__(self, data, shortcut_data):
-        super(WixShortcutComponent, self).__init__(**data)
-        self.add(WixShortcut(shortcut_data))
-        self.add(WixRemoveFolder(Id=shortcut_data['DirectoryRef'],
+    def __init__(self, ctx, data, shortcut_data):
+        super(WixShortcutComponent, self).__init__(ctx, data=data)
+        self.add(WixShortcut(ctx, shortcut_data))
+        self.add(WixRemoveFolder(ctx, Id=shortcut_data['DirectoryRef'],
                                  On='uninstall'))
         reg_key = 'Software\\%s\\%s' % (data['Manufacturer'].replace(' ', '_'),
                                         data['Name'].replace(' ', '_'))
-        self.add(WixRegistryValue(Root='HKCU', Key=reg_key,
+        self.add(WixRegistryValue(ctx, Root='HKCU', Key=reg_key,
                                   Name=shortcut_data['Name'], Type='integer',
                                   Value='1', KeyPath='yes'))
 
 
 class WixEnvironment(WixElement):
+    __slots__ = ()
     tag = 'Environment'
     id_prefix = 'env'
 
-    def __init__(self, **kwargs):
-        super(WixEnvironment, self).__init__(**kwargs)
+    def __init__(self, ctx, **kwargs):
+        super(WixEnvironment, self).__init__(ctx, **kwargs)
 
     def write_msi_records(self, db):
         table = db.tables[msi.MT_ENVIRONMENT]
@@ -542,12 +1224,20 @@ class WixEnvironment(WixElement):
 
 
 class WixPackage(WixElement):
+    __slots__ = ('ctx',)
     tag = 'Package'
 
-    def __init__(self, data):
-        super(WixPackage, self).__init__(**data)
-        if not WIXL:
-            self.set(Platform='x64' if data.get('Win64') else 'x86')
+    def __init__(self, ctx, data):
+        super(WixPackage, self).__init__(ctx, **data)
+        self.ctx = ctx
+        self.set(Platform='x64' if data.get('Win64') else 'x86')
+
+    def items(self):
+        items = super(WixPackage, self).items()
+        if self.ctx.wixl:
+            # Platform is not written for wixl
+            items = [item for item in items if item[0] != 'Platform']
+        return items
 
     def write_msi_records(self, db):
         if self.get('InstallScope') == "perMachine":
@@ -557,70 +1247,81 @@ class WixPackage(WixElement):
 class WixProduct(WixElement):
     tag = 'Product'
 
-    def __init__(self, data):
-        super(WixProduct, self).__init__(**data)
-        self.set(Id=utils.get_guid())
-        self.add(WixPackage(data))
-        COMPONENTS[:] = []
-        self.add(WixMedia(data))
+    def __init__(self, ctx, data):
+        super(WixProduct, self).__init__(ctx, **data)
+        self.ctx = ctx
+        # Product code changes with version in deterministic mode
+        self.set(Id=ctx.ids.get_guid('ProductCode:%s' % data.get('Version')))
+        self.add(WixPackage(ctx, data))
+        self.add(WixMedia(ctx, data))
         media_name = '%s %s Installation' % (data['Name'], data['Version'])
-        self.add(WixProperty('DiskPrompt', media_name))
+        self.add(WixProperty(ctx, 'DiskPrompt', media_name))
 
         self.set_conditions(data)
         self.set_icon(data)
 
         # Recursive scanning
-        target_dir = WixTargetDir(data)
+        target_dir = WixTargetDir(ctx, data)
         self.add(target_dir)
 
         self.set_shortcuts(data, target_dir)
         self.set_envvars(data)
 
-        if COMPONENTS:
-            self.add(WixFeature(data))
+        install_dir = self.get_install_dir()
+        if not install_dir.streaming:
+            install_dir.deduplicate()
+
+        components = [item for item in self.walk() if item.is_comp]
+        if components or data.get('_Streaming'):
+            self.add(WixFeature(ctx, data, components))
 
     def set_conditions(self, data):
+        ctx = self.ctx
         if data.get('_OsCondition'):
-            self.add(WixOsCondition(data['_OsCondition']))
+            self.add(WixOsCondition(ctx, data['_OsCondition']))
         if data.get('_CheckX64'):
-            self.add(WixArchCondition())
+            self.add(WixArchCondition(ctx))
         if data.get('_Conditions'):
             for msg, cnd in data['_Conditions']:
-                self.add(WixCondition(msg, cnd))
+                self.add(WixCondition(ctx, msg, cnd))
 
     def set_icon(self, data):
+        ctx = self.ctx
         if data.get('_AppIcon'):
             icon = data['_AppIcon']
             icon_name = os.path.basename(icon)
-            self.add(WixIcon(icon))
-            self.add(WixProperty('ARPPRODUCTICON', icon_name))
+            self.add(WixIcon(ctx, icon))
+            self.add(WixProperty(ctx, 'ARPPRODUCTICON', icon_name))
         if data.get('_Icons'):
             for icon in data.get('_Icons'):
-                self.add(WixIcon(icon))
+                self.add(WixIcon(ctx, icon))
 
     def set_shortcuts(self, data, target_dir):
+        ctx = self.ctx
         if data.get('_Shortcuts') and data.get('_ProgramMenuFolder'):
-            pm_dir = WixDirectory(Id='ProgramMenuFolder', Name='')
+            pm_dir = WixDirectory(ctx, Id='ProgramMenuFolder', Name='')
             pm_dir.pop('Name')
             pm_dir.comment = 'Application ProgramMenu folder'
             target_dir.add(pm_dir)
-            shortcut_dir = WixDirectory(Id=utils.get_id('mnu'),
+            shortcut_dir = WixDirectory(ctx, Id=ctx.ids.get_id('mnu'),
                                         Name=data.get('_ProgramMenuFolder'))
             pm_dir.add(shortcut_dir)
-            ref = shortcut_dir.attrs['Id']
+            ref = shortcut_dir.get('Id')
 
-            dir_ref = WixDirectoryRef(Id=ref)
+            dir_ref = WixDirectoryRef(ctx, Id=ref)
             self.add(dir_ref)
             for shortcut in data.get('_Shortcuts'):
                 target = os.path.join(data['_SourceDir'], shortcut['Target'])
-                work_dir_id, target_id = self.find_by_path(target_dir, target)
+                install_dir = self.get_install_dir()
+                install_dir.targets.add(target)
+                work_dir_id, target_id = install_dir.find_by_path(target)
                 shortcut_data = {
                     'DirectoryRef': ref,
                     'WorkingDirectory': work_dir_id,
                 }
                 shortcut_data.update(shortcut)
                 shortcut_data['Target'] = '[#%s]' % target_id
-                component = WixShortcutComponent(data, shortcut_data)
+                component = WixShortcutComponent(ctx, data, shortcut_data)
                 dir_ref.add(component)
                 if shortcut.get('AddOnDesktop'):
                     desktop_dir = None
@@ -629,13 +1330,13 @@ class WixProduct(WixElement):
                             desktop_dir = child
                             break
                     if desktop_dir is None:
-                        desktop_dir = WixDirectory(Id='DesktopFolder',
+                        desktop_dir = WixDirectory(ctx, Id='DesktopFolder',
                                                    Name='Desktop')
                         desktop_dir.comment = 'Desktop folder'
                         target_dir.add(desktop_dir)
-                    desktop_dir_ref = WixDirectoryRef(Id='DesktopFolder')
+                    desktop_dir_ref = WixDirectoryRef(ctx, Id='DesktopFolder')
                     self.add(desktop_dir_ref)
-                    desktop_component = WixComponent(**data)
+                    desktop_component = WixComponent(ctx, data=data)
                     desktop_dir_ref.add(desktop_component)
                     desktop_shortcut_data = {
                         'DirectoryRef': 'DesktopFolder',
@@ -644,13 +1345,14 @@ class WixProduct(WixElement):
                     desktop_shortcut_data.update(shortcut)
                     desktop_shortcut_data.pop('Description')
                     desktop_shortcut_data['Target'] = '[#%s]' % target_id
-                    desktop_component.add(WixShortcut(desktop_shortcut_data))
+                    desktop_component.add(WixShortcut(ctx,
+                                                      desktop_shortcut_data))
 
                     reg_key = 'Software\\%s\\%s' % (
                         data['Manufacturer'].replace(' ', '_'),
                         data['Name'].replace(' ', '_'))
                     name = desktop_shortcut_data['Name']
-                    reg_val = WixRegistryValue(Root='HKCU', Key=reg_key,
+                    reg_val = WixRegistryValue(ctx, Root='HKCU', Key=reg_key,
                                                Name=name,
                                                Type='integer',
                                                Value='1', KeyPath='yes')
@@ -660,21 +1362,23 @@ class WixProduct(WixElement):
                     # Shortcut ref
                     target_ref = shortcut.get('Name')
                     description = shortcut.get('Description')
-                    component.add(WixRegistryValue(Root='HKCR', Key=target_ref,
+                    component.add(WixRegistryValue(ctx, Root='HKCR',
+                                                   Key=target_ref,
                                                    Value=description))
                     # Shortcut open option
                     key = target_ref + '\\shell\\open'
                     value = 'Open with %s' % shortcut['Name']
-                    component.add(WixRegistryValue(Root='HKCR', Key=key,
+                    component.add(WixRegistryValue(ctx, Root='HKCR', Key=key,
                                                    Value=value))
                     key = target_ref + '\\shell\\open\\command'
                     value = '"[#%s]" "%%1"' % target_id
-                    component.add(WixRegistryValue(Root='HKCR', Key=key,
+                    component.add(WixRegistryValue(ctx, Root='HKCR', Key=key,
                                                    Value=value))
                     # OpenWith menu item
                     for item in shortcut.get('OpenWith'):
                         key = item + '\\OpenWithProgids'
-                        component.add(WixRegistryValue(Root='HKCR', Key=key,
+                        component.add(WixRegistryValue(ctx, Root='HKCR',
+                                                       Key=key,
                                                        Name=target_ref))
                 for item in shortcut.get('Open', []):
                     ext = item['Extension']
@@ -684,48 +1388,52 @@ class WixProduct(WixElement):
                     target_ref = shortcut.get('Name') + ext
 
                     # Shortcut ref
-                    component.add(WixRegistryValue(Root='HKCR', Key=target_ref,
+                    component.add(WixRegistryValue(ctx, Root='HKCR',
+                                                   Key=target_ref,
                                                    Value=description))
                     # Shortcut icon
                     key = target_ref + '\\DefaultIcon'
                     value = '"[#%s]",%s' % (target_id, icon_index)
-                    component.add(WixRegistryValue(Root='HKCR', Key=key,
+                    component.add(WixRegistryValue(ctx, Root='HKCR', Key=key,
                                                    Value=value))
                     # Shortcut open option
                     key = target_ref + '\\shell\\open'
                     value = 'Open with %s' % shortcut['Name']
-                    component.add(WixRegistryValue(Root='HKCR', Key=key,
+                    component.add(WixRegistryValue(ctx, Root='HKCR', Key=key,
                                                    Value=value))
                     key = target_ref + '\\shell\\open\\command'
                     value = '"[#%s]" "%%1"' % target_id
-                    component.add(WixRegistryValue(Root='HKCR', Key=key,
+                    component.add(WixRegistryValue(ctx, Root='HKCR', Key=key,
                                                    Value=value))
                     if item.get('EditWith'):
                         # Shortcut edit option
                         key = target_ref + '\\shell\\edit'
                         value = 'Edit with %s' % shortcut['Name']
-                        component.add(WixRegistryValue(Root='HKCR', Key=key,
+                        component.add(WixRegistryValue(ctx, Root='HKCR',
+                                                       Key=key,
                                                        Value=value))
                         key = target_ref + '\\shell\\edit\\command'
                         value = '"[#%s]" "%%1"' % target_id
-                        component.add(WixRegistryValue(Root='HKCR', Key=key,
+                        component.add(WixRegistryValue(ctx, Root='HKCR',
+                                                       Key=key,
                                                        Value=value))
                     # File association
-                    component.add(WixRegistryValue(Root='HKCR', Key=ext,
+                    component.add(WixRegistryValue(ctx, Root='HKCR', Key=ext,
                                                    Value=target_ref))
-                    component.add(WixRegistryValue(Root='HKCR', Key=ext,
+                    component.add(WixRegistryValue(ctx, Root='HKCR', Key=ext,
                                                    Name='Content Type',
                                                    Value=mime))
                     key = ext + '\\OpenWithProgids'
-                    component.add(WixRegistryValue(Root='HKCR', Key=key,
+                    component.add(WixRegistryValue(ctx, Root='HKCR', Key=key,
                                                    Name=target_ref))
 
     def set_envvars(self, data):
+        ctx = self.ctx
         if data.get('_AddToPath') or data.get('_AddBeforePath'):
-            dir_ref = WixDirectoryRef(Id='TARGETDIR')
+            dir_ref = WixDirectoryRef(ctx, Id='TARGETDIR')
             self.add(dir_ref)
             comp_data = {'Win64': 'yes'} if data.get('Win64') else {}
-            comp = WixComponent(**comp_data)
+            comp = WixComponent(ctx, data=comp_data)
             dir_ref.add(comp)
             env_data = {'Name': 'PATH',
                         'Value': '',
@@ -736,25 +1444,36 @@ class WixProduct(WixElement):
             if data.get('_AddToPath'):
                 for path in data.get('_AddToPath'):
                     env_data['Value'] = '[INSTALLDIR]%s' % path
-                    comp.add(WixEnvironment(**env_data))
+                    comp.add(WixEnvironment(ctx, **env_data))
             if data.get('_AddBeforePath'):
                 for path in data.get('_AddBeforePath'):
                     env_data['Value'] = '[INSTALLDIR]%s' % path
                     env_data['Part'] = 'first'
-                    comp.add(WixEnvironment(**env_data))
-
-    def find_by_path(self, parent, path):
-        work_dir_id = target_id = None
-        for item in parent.childs:
-            if item.is_comp and item.childs[0].path == path:
-                work_dir_id = parent.attrs['Id']
-                target_id = item.childs[0].attrs['Id']
-                return work_dir_id, target_id
-            elif item.is_dir:
-                work_dir_id, target_id = self.find_by_path(item, path)
-                if work_dir_id is not None:
-                    return work_dir_id, target_id
-        return work_dir_id, target_id
+                    comp.add(WixEnvironment(ctx, **env_data))
+
+    def get_install_dir(self):
+        # Models loaded from WXS have no scanned install folder
+        for item in self.childs:
+            if isinstance(item, WixTargetDir) and item.childs and \
+                    isinstance(item.childs[0], WixPfDir):
+                return item.childs[0].childs[0]
+
+    def get_feature(self):
+        for item in self.childs:
+            if item.tag == 'Feature':
+                return item
+
+    def update_feature(self, data):
+        ctx = self.ctx
+        components = [item for item in self.walk() if item.is_comp]
+        feature = self.get_feature()
+        if feature is None:
+            if components:
+                self.add(WixFeature(ctx, data, components))
+            return
+        feature.childs = []
+        for item in components:
+            feature.add(WixComponentRef(ctx, Id=item.get('Id')))
 
     def write_msi_records(self, db):
         table = db.tables[msi.MT_PROPERTY]
@@ -769,13 +1488,20 @@ class WixProduct(WixElement):
 class Wix(WixElement):
     tag = 'Wix'
 
-    def __init__(self, data):
+    def __init__(self, data, ctx=None):
         self.msi_data = defaults()
         self.msi_data.update(data)
         self.source_dir = self.msi_data.get('_SourceDir', '.')
-        super(Wix, self).__init__(xmlns=XMLNS)
+        self.ctx = ctx = ctx or utils.BuildContext()
+        ctx.codepage = self.msi_data['Codepage']
+        if self.msi_data.get('_StableIds'):
+            upgrade_code = self.msi_data.get('UpgradeCode')
+            namespace = uuid.UUID(upgrade_code) if upgrade_code else \
+                uuid.uuid5(uuid.NAMESPACE_URL, self.msi_data.get('Name'))
+            ctx.ids = utils.IdFactory(namespace, self.source_dir)
+        super(Wix, self).__init__(ctx, xmlns=XMLNS)
         self.pop('Id')
-        self.add(WixProduct(self.msi_data))
+        self.add(WixProduct(ctx, self.msi_data))
         self.comment = 'Generated by %s %s' % \
                        (data['_pkgname'], data['_pkgver'])
 
@@ -784,14 +1510,53 @@ class Wix(WixElement):
         fp.write('%s<?xml version="1.0" encoding="utf-8"?>\n' % tab)
         super(Wix, self).write_xml(fp, indent)
 
-    def write_msi_records(self, db):
-        msi.MSI_CODEPAGE = self.msi_data['Codepage']
+    def set_context(self, ctx):
+        """Binds the model to another build context keeping its Ids state"""
+        ctx.codepage = self.ctx.codepage
+        ctx.ids = self.ctx.ids
+        for item in self.walk():
+            if getattr(item, 'ctx', None) is not None:
+                item.ctx = ctx
+
+    def save_snapshot(self, path):
+        """Saves the model, so MSI or WXS could be written by later jobs
+        without scanning the source folder and building the model.
+        """
+        ctx = self.ctx
+        projections, ctx.projections = ctx.projections, {}
+        try:
+            with open(path, 'wb') as fp:
+                pickle.dump({'version': SNAPSHOT_VERSION, 'model': self}, fp,
+                            pickle.HIGHEST_PROTOCOL)
+        finally:
+            ctx.projections = projections
+
+    @staticmethod
+    def load_snapshot(path, ctx=None):
+        """Loads the model saved by save_snapshot() binding it to ctx"""
+        with open(path, 'rb') as fp:
+            data = pickle.load(fp)
+        if not isinstance(data, dict) or \
+                data.get('version') != SNAPSHOT_VERSION:
+            raise Exception('Unsupported model snapshot %s' % path)
+        wixmodel = data['model']
+        if ctx is not None:
+            wixmodel.set_context(ctx)
+        return wixmodel
+
+    def update(self, paths):
+        """Applies changes of listed source folders to the model"""
+        product = self.get_product()
+        if product.get_install_dir().update(paths):
+            product.update_feature(self.msi_data)
+            return True
+        return False
 
     def get_product(self):
         return self.childs[0]
 
     def get_package(self):
-        return self.get_product().childs[0]
+        return self.get_product().find('Package')
 
     def get_media(self):
-        return self.get_product().childs[1]
+        return self.get_product().find('Media')
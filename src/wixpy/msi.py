@@ -17,23 +17,26 @@
 #   You should have received a copy of the GNU General Public License
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import atexit
+import collections
+import hashlib
 import os
+import sys
+import threading
 
+from wixpy import backend
+from wixpy import scanner
 from wixpy import utils
 from wixpy import validate
 
-if os.name != 'nt':
-    from wixpy import libmsi
-else:
-    from wixpy import libmsiw as libmsi
+# Rows kept in memory by streamed table before writing them into database
+STREAM_BATCH = 10000
 
-MSI_CODEPAGE = '1252'
 
-
-def msi_str(text):
+def msi_str(text, codepage):
     if not utils.IS_PY3:
         text = text.decode('utf-8'). \
-            encode('cp%s' % MSI_CODEPAGE, errors='replace')
+            encode('cp%s' % codepage, errors='replace')
     return text
 
 
@@ -280,6 +283,7 @@ MT_REGISTRY = 'Registry'
 MT_SERVICECONTROL = 'ServiceControl'
 MT_SERVICEINSTALL = 'ServiceInstall'
 MT_FILE = 'File'
+MT_DUPLICATEFILE = 'DuplicateFile'
 MT_ADMINEXECUTESEQUENCE = 'AdminExecuteSequence'
 MT_ADMINUISEQUENCE = 'AdminUISequence'
 MT_ADVTEXECUTESEQUENCE = 'AdvtExecuteSequence'
@@ -304,9 +308,10 @@ TABLE_ORDER = [MT_VALIDATION, MT_ADMINEXECUTESEQUENCE, MT_ADMINUISEQUENCE,
                MT_INSTALLUISEQUENCE, MT_DIRECTORY, MT_MEDIA, MT_PROPERTY,
                MT_ICON, MT_BINARY, MT_COMPONENT, MT_FEATURE,
                MT_FEATURECOMPONENTS, MT_REMOVEFILE, MT_REGISTRY,
-               MT_SERVICECONTROL, MT_SERVICEINSTALL, MT_FILE, MT_STREAMS,
-               MT_SHORTCUT, MT_UPGRADE, MT_LAUNCHCONDITION, MT_APPSEARCH,
-               MT_SIGNATURE, MT_CUSTOMACTION, MT_REGLOCATOR, MT_CREATEFOLDER,
+               MT_SERVICECONTROL, MT_SERVICEINSTALL, MT_FILE,
+               MT_DUPLICATEFILE, MT_STREAMS, MT_SHORTCUT, MT_UPGRADE,
+               MT_LAUNCHCONDITION, MT_APPSEARCH, MT_SIGNATURE,
+               MT_CUSTOMACTION, MT_REGLOCATOR, MT_CREATEFOLDER,
                MT_ENVIRONMENT, MT_FILEHASH, MT_ERROR]
 
 MT_ACTION = (('Action', 'CHAR(72) NOT NULL'),
@@ -435,6 +440,14 @@ MT_TABLES = {
         ('Sequence', 'LONG NOT NULL '
                      'PRIMARY KEY `File`'),
     ),
+    MT_DUPLICATEFILE: (
+        ('FileKey', 'CHAR(72) NOT NULL'),
+        ('Component_', 'CHAR(72) NOT NULL'),
+        ('File_', 'CHAR(72) NOT NULL'),
+        ('DestName', 'CHAR(255) LOCALIZABLE'),
+        ('DestFolder', 'CHAR(72) '
+                       'PRIMARY KEY `FileKey`'),
+    ),
     MT_ADMINEXECUTESEQUENCE: MT_ACTION,
     MT_ADMINUISEQUENCE: MT_ACTION,
     MT_ADVTEXECUTESEQUENCE: MT_ACTION,
@@ -545,28 +558,30 @@ MT_TABLES = {
 # ----------- MSI objects -----------
 
 
-class MsiSummaryInfo(libmsi.SummaryInfo):
+class MsiSummaryInfo(backend.SummaryInfo):
     def __init__(self, model):
         super(MsiSummaryInfo, self).__init__()
 
         # Wix model root nodes
         prod = model.get_product()
         pkg = model.get_package()
+        codepage = pkg.get('SummaryCodepage')
 
         # MSI info data
-        self.title = msi_str('%s Installation Database' % prod.get('Name'))
-        self.author = msi_str(prod.get('Manufacturer'))
-        self.subject = msi_str(pkg.get('Description'))
-        self.comments = msi_str(pkg.get('Comments'))
+        self.title = msi_str('%s Installation Database' % prod.get('Name'),
+                             codepage)
+        self.author = msi_str(prod.get('Manufacturer'), codepage)
+        self.subject = msi_str(pkg.get('Description'), codepage)
+        self.comments = msi_str(pkg.get('Comments'), codepage)
         arch = 'x64' if pkg.get('Platform') == 'x64' else 'Intel'
         self.template = '%s;%s' % (arch, pkg.get('Languages'))
-        self.keywords = msi_str(pkg.get('Keywords'))
-        self.codepage = int(pkg.get('SummaryCodepage'))
+        self.keywords = msi_str(pkg.get('Keywords'), codepage)
+        self.codepage = int(codepage)
         self.uuid = '{%s}' % prod.get('Id')
         self.filetime = utils.filetime_now()
         version = int(pkg.get('InstallerVersion'))
         self.version = 200 if arch == 'x64' and version < 200 else version
-        self.appname = msi_str(prod.get('Name'))
+        self.appname = msi_str(prod.get('Name'), codepage)
         self.security = 2
 
         self.source = 0
@@ -576,43 +591,143 @@ class MsiSummaryInfo(libmsi.SummaryInfo):
             self.source |= SourceFlags.NO_PRIVILEGES
 
 
-class MsiTable(libmsi.Table):
+class MsiTable(backend.Table):
     length = None
     name = None
     records = None
+    count = 0
+    stream_db = None
+    created = False
+    codepage = None
 
-    def __init__(self, name):
+    def __init__(self, name, codepage):
         super(MsiTable, self).__init__(name, MT_TABLES[name])
+        self.codepage = codepage
 
     def add(self, *args):
         if len(args) != self.length:
             raise ValueError('Incorrect members number for record!')
         rec = list(args)
         self.records.append(rec)
+        self.count += 1
+        if self.stream_db is not None and len(self.records) >= STREAM_BATCH:
+            self.flush()
         return rec
 
+    def open_stream(self, db):
+        # Rows are written into database by batches while being added
+        self._create_table(db)
+        self.stream_db = db
+
+    def flush(self):
+        if self.records:
+            self._write_records(self.stream_db)
+            self.records = []
+
     def add_action(self, action):
         self.add(action, MSI_ACTIONS[action][0], MSI_ACTIONS[action][1])
 
     def _normalize_str(self, text):
-        return msi_str(text)
+        return msi_str(text, self.codepage)
 
     def write_msi(self, db):
-        if self.records:
-            if not self.name == MT_STREAMS:
+        if self.stream_db is not None:
+            self.flush()
+        elif self.records:
+            if not (self.created or self.name == MT_STREAMS):
                 self._create_table(db)
             if self.name == MT_DIRECTORY:
                 self.records.reverse()
             self._write_records(db)
 
 
-class MsiDatabase(libmsi.Database):
-    model = None
+STREAMED_TABLES = (MT_COMPONENT, MT_FEATURECOMPONENTS, MT_FILE,
+                   MT_DUPLICATEFILE, MT_FILEHASH)
 
-    def __init__(self, model):
+# Tables having the same rows for all packages with the same table set
+TEMPLATE_TABLES = (MT_VALIDATION, MT_ADMINEXECUTESEQUENCE, MT_ADMINUISEQUENCE,
+                   MT_ADVTEXECUTESEQUENCE, MT_INSTALLEXECUTESEQUENCE,
+                   MT_INSTALLUISEQUENCE)
+
+# Database templates by (database class, codepage, table names, schema
+# digest) with flag of temporary template. Least recently used table
+# sets over TEMPLATE_LIMIT are evicted and temporary templates removed.
+# Templates saved into template cache folder are kept for later runs.
+TEMPLATES = collections.OrderedDict()
+TEMPLATE_LIMIT = 16
+TEMPLATES_LOCK = threading.Lock()
+# Changed when template content changes without changing schema or rows
+TEMPLATE_VERSION = 1
+
+
+def _remove_template(key, item):
+    template, temporary = item
+    if temporary:
+        key[0].remove_template(template)
+
+
+def store_template(key, item):
+    """Caches (template, temporary) of the table set, replaced and evicted
+    temporary templates are removed
+    """
+    with TEMPLATES_LOCK:
+        old = TEMPLATES.pop(key, None)
+        if old is not None and old[0] is not item[0]:
+            _remove_template(key, old)
+        TEMPLATES[key] = item
+        while len(TEMPLATES) > TEMPLATE_LIMIT:
+            _remove_template(*TEMPLATES.popitem(last=False))
+
+
+def clear_templates():
+    with TEMPLATES_LOCK:
+        while TEMPLATES:
+            _remove_template(*TEMPLATES.popitem())
+
+
+def prune_templates(cache_dir):
+    """Removes least recently used template files over TEMPLATE_LIMIT"""
+    try:
+        paths = [os.path.join(cache_dir, name)
+                 for name in os.listdir(cache_dir)
+                 if name.startswith('template-')]
+        paths.sort(key=os.path.getmtime)
+        for path in paths[:-TEMPLATE_LIMIT]:
+            os.remove(path)
+    except OSError:
+        pass
+
+
+atexit.register(clear_templates)
+
+
+class MsiDatabase(backend.Database):
+    """MSI package writer, get_database() combines it with backend"""
+    model = None
+    backend_name = None
+    streaming = False
+    hash_cache = None
+    cabinet_cache = None
+    summary_class = MsiSummaryInfo
+    table_class = MsiTable
+
+    def __init__(self, model, hash_cache=None, cabinet_cache=None):
         super(MsiDatabase, self).__init__()
         self.model = model
-        self.tables = {key: MsiTable(key) for key in MT_TABLES.keys()}
+        # pymsi.CabinetCache of watch mode rebuilds
+        self.cabinet_cache = cabinet_cache
+        # Hashes computed by deduplication are reused
+        install_dir = model.get_product().get_install_dir()
+        hashes = install_dir.hashes if install_dir is not None else None
+        if hash_cache is None:
+            hash_cache = hashes or None
+        elif hashes:
+            hash_cache.update(hashes)
+        self.hash_cache = hash_cache
+        codepage = model.ctx.codepage
+        self.tables = {key: self.table_class(key, codepage)
+                       for key in MT_TABLES.keys()}
+        self.streaming = bool(model.msi_data.get('_Streaming'))
 
     def set_action_sequences(self):
         # AdminExecuteSequence
@@ -639,7 +754,7 @@ class MsiDatabase(libmsi.Database):
         tb.add_action('CostFinalize')
         tb.add_action('InstallValidate')
         tb.add_action('InstallInitialize')
-        if self.tables[MT_SHORTCUT].records:
+        if self.tables[MT_SHORTCUT].count:
             tb.add_action('CreateShortcuts')
         tb.add_action('PublishFeatures')
         tb.add_action('PublishProduct')
@@ -647,7 +762,7 @@ class MsiDatabase(libmsi.Database):
 
         # InstallExecuteSequence
         tb = self.tables[MT_INSTALLEXECUTESEQUENCE]
-        if self.tables[MT_APPSEARCH].records:
+        if self.tables[MT_APPSEARCH].count:
             tb.add_action('AppSearch')
         tb.add_action('CostInitialize')
         tb.add_action('FileCost')
@@ -660,63 +775,154 @@ class MsiDatabase(libmsi.Database):
         tb.add_action('ValidateProductID')
         tb.add_action('ProcessComponents')
         tb.add_action('UnpublishFeatures')
-        if self.tables[MT_SHORTCUT].records:
+        if self.tables[MT_SHORTCUT].count:
             tb.add_action('RemoveShortcuts')
             tb.add_action('CreateShortcuts')
-        if self.tables[MT_FILE].records:
+        if self.tables[MT_FILE].count:
             tb.add_action('InstallFiles')
             tb.add_action('RemoveFiles')
-        if not self.tables[MT_FILE].records and \
-                self.tables[MT_REMOVEFILE].records:
+        if not self.tables[MT_FILE].count and \
+                self.tables[MT_REMOVEFILE].count:
             tb.add_action('RemoveFiles')
-        if self.tables[MT_REGISTRY].records:
+        if self.tables[MT_DUPLICATEFILE].count:
+            tb.add_action('DuplicateFiles')
+            tb.add_action('RemoveDuplicateFiles')
+        if self.tables[MT_REGISTRY].count:
             tb.add_action('WriteRegistryValues')
             tb.add_action('RemoveRegistryValues')
         tb.add_action('RegisterUser')
         tb.add_action('RegisterProduct')
-        if self.tables[MT_UPGRADE].records:
+        if self.tables[MT_UPGRADE].count:
             tb.add_action('FindRelatedProducts')
             tb.add_action('MigrateFeatureStates')
-        if self.tables[MT_LAUNCHCONDITION].records:
+        if self.tables[MT_LAUNCHCONDITION].count:
             tb.add_action('LaunchConditions')
-        if self.tables[MT_SERVICECONTROL].records:
+        if self.tables[MT_SERVICECONTROL].count:
             tb.add_action('StartServices')
             tb.add_action('StopServices')
             tb.add_action('DeleteServices')
-        if self.tables[MT_SERVICEINSTALL].records:
+        if self.tables[MT_SERVICEINSTALL].count:
             tb.add_action('InstallServices')
-        if self.tables[MT_CREATEFOLDER].records:
+        if self.tables[MT_CREATEFOLDER].count:
             tb.add_action('RemoveFolders')
             tb.add_action('CreateFolders')
-        if self.tables[MT_ENVIRONMENT].records:
+        if self.tables[MT_ENVIRONMENT].count:
             tb.add_action('WriteEnvironmentStrings')
             tb.add_action('RemoveEnvironmentStrings')
 
         # InstallUISequence
         tb = self.tables[MT_INSTALLUISEQUENCE]
-        if self.tables[MT_APPSEARCH].records:
+        if self.tables[MT_APPSEARCH].count:
             tb.add_action('AppSearch')
         tb.add_action('CostInitialize')
         tb.add_action('FileCost')
         tb.add_action('CostFinalize')
         tb.add_action('ValidateProductID')
         tb.add_action('ExecuteAction')
-        if self.tables[MT_UPGRADE].records:
+        if self.tables[MT_UPGRADE].count:
             tb.add_action('FindRelatedProducts')
             tb.add_action('MigrateFeatureStates')
-        if self.tables[MT_LAUNCHCONDITION].records:
+        if self.tables[MT_LAUNCHCONDITION].count:
             tb.add_action('LaunchConditions')
 
+    def build_cached_cabinet(self, cabfile, compressed=True, embed=True):
+        # Cabinet is written by pure Python writer for any backend,
+        # as it keeps compressed folders of unchanged files
+        from wixpy import pymsi
+        pymsi.write_cabinet(cabfile, self.files, compressed,
+                            self.cabinet_cache)
+        if embed:
+            self.tables[MT_STREAMS].add(os.path.basename(cabfile),
+                                        ('filepath', cabfile))
+
+    def get_filehash(self, filepath, size, mtime):
+        return utils.get_filehash(self.hash_cache, filepath, size, mtime)
+
     def set_filehash(self):
         tb = self.tables[MT_FILEHASH]
-        for filepath, file_id in self.files:
-            tb.add(file_id, 0, *utils.compute_md5(filepath))
+        for filepath, file_id, size, mtime in self.files:
+            tb.add(file_id, 0, *self.get_filehash(filepath, size, mtime))
 
-    def write_msi(self, msifile):
-        self.init_db(msifile)
+    def set_template_tables(self):
+        utils.echo_msg('Creating sequences...')
+        self.set_action_sequences()
+
+        for record in validate.RECORDS:
+            if record[0] in (MT_VALIDATION, MT_STREAMS) or \
+                    (record[0] in self.tables and
+                     self.tables[record[0]].count):
+                self.tables[MT_VALIDATION].add(*record)
+
+    def get_template_path(self, digest):
+        """Returns path of template file in template cache or None"""
+        cache_dir = self.model.msi_data.get('_TemplateCache', True)
+        if not cache_dir:
+            return None
+        if cache_dir is True:
+            cache_dir = scanner.default_cache_dir()
+        return os.path.join(cache_dir, 'template-%s' % digest)
+
+    def init_template_db(self, msifile):
+        """Creates database from template holding schema of package
+        tables, action sequences and _Validation rows. These depend on the
+        table set only, so template is saved when the table set is written
+        first time and then reused. Template files in template cache are
+        reused by later runs as well.
+        """
+        self.set_template_tables()
+        names = [item for item in TABLE_ORDER if item in TEMPLATE_TABLES or
+                 (item != MT_STREAMS and self.tables[item].records)]
+        codepage = self.model.ctx.codepage
+        schema = [(item, self.tables[item].tbl_spec) for item in names] + \
+            [(item, self.tables[item].records) for item in TEMPLATE_TABLES]
+        signature = (TEMPLATE_VERSION, sys.version_info[0], self.backend_name,
+                     codepage, schema)
+        digest = hashlib.md5(repr(signature).encode('utf-8')).hexdigest()
+        key = (self.__class__, codepage, tuple(names), digest)
+        path = self.get_template_path(digest)
+        with TEMPLATES_LOCK:
+            # Recently used table sets are moved to the end
+            item = TEMPLATES.pop(key, None)
+            if item is None and path is not None:
+                template = self.read_template(path)
+                if template is not None:
+                    item = (template, False)
+                    try:
+                        # Template file of recently used table set is kept
+                        os.utime(path, None)
+                    except OSError:
+                        pass
+            if item is not None:
+                TEMPLATES[key] = item
+                # Loaded under the lock, so template is not removed
+                # while being copied
+                self.load_template(msifile, item[0])
+        if item is None:
+            self.init_db(msifile)
+            for name in names:
+                self.tables[name]._create_table(self.db)
+            for name in TEMPLATE_TABLES:
+                self.tables[name]._write_records(self.db)
+            template = self.save_template(msifile, path)
+            if template is not None:
+                store_template(key, (template, template != path))
+                if path is not None:
+                    prune_templates(os.path.dirname(path))
+        for name in names:
+            self.tables[name].created = True
+        for name in TEMPLATE_TABLES:
+            self.tables[name].records = []
 
-        utils.echo_msg('Writing SummaryInfo')
-        MsiSummaryInfo(self.model).write_msi(self.db)
+    def write_msi(self, msifile):
+        if self.streaming:
+            # Streamed rows are written while the model is being written,
+            # so table set is not known in advance and template is not used
+            self.files = utils.FileSpool()
+            self.init_db(msifile)
+            utils.echo_msg('Writing SummaryInfo')
+            self.summary_class(self.model).write_msi(self.db)
+            for item in STREAMED_TABLES:
+                self.tables[item].open_stream(self.db)
 
         utils.echo_msg('Building tables...')
         self.model.write_msi(self)
@@ -724,11 +930,10 @@ class MsiDatabase(libmsi.Database):
         # Setting LastSequence value
         self.medias[0][1] = len(self.files)
 
-        utils.echo_msg('Creating sequences...')
-        self.set_action_sequences()
-
-        utils.echo_msg('Computing file hashes...')
-        self.set_filehash()
+        if not self.streaming:
+            # Streaming mode computes hashes while scanning
+            utils.echo_msg('Computing file hashes...')
+            self.set_filehash()
 
         utils.echo_msg('Building CAB-file...')
         pkg = self.model.get_package()
@@ -736,19 +941,43 @@ class MsiDatabase(libmsi.Database):
         cabfile = os.path.join(os.path.dirname(msifile), media.get('Cabinet'))
         embed = media.get('EmbedCab') == 'yes'
         compressed = pkg.get('Compressed') == 'yes'
-        self.build_cabinet(cabfile, compressed, embed)
-
-        for record in validate.RECORDS:
-            if record[0] in (MT_VALIDATION, MT_STREAMS) or \
-                    (record[0] in self.tables and
-                     self.tables[record[0]].records):
-                self.tables[MT_VALIDATION].records.append(record)
+        if self.cabinet_cache is not None:
+            self.build_cached_cabinet(cabfile, compressed, embed)
+        else:
+            self.build_cabinet(cabfile, compressed, embed)
 
         utils.echo_msg('Writing tables...')
+        if self.streaming:
+            self.set_template_tables()
+        else:
+            self.init_template_db(msifile)
+            utils.echo_msg('Writing SummaryInfo')
+            self.summary_class(self.model).write_msi(self.db)
         for item in TABLE_ORDER:
             self.tables[item].write_msi(self.db)
 
         self.commit_db()
+        if self.streaming:
+            self.files.close()
 
         if embed and os.path.exists(cabfile):
             os.remove(cabfile)
+
+
+DATABASES = {}
+
+
+def get_database(backend_name=None):
+    """Returns MsiDatabase class writing package through MSI backend"""
+    module = backend.get_backend(backend_name)
+    cls = DATABASES.get(module.__name__)
+    if cls is None:
+        summary = type('MsiSummaryInfo', (MsiSummaryInfo, module.SummaryInfo),
+                       {})
+        table = type('MsiTable', (MsiTable, module.Table), {})
+        cls = type('MsiDatabase', (MsiDatabase, module.Database),
+                   {'summary_class': summary, 'table_class': table,
+                    'backend_name': module.__name__})
+        # Concurrent builds agree on the class stored first
+        cls = DATABASES.setdefault(module.__name__, cls)
+    return cls
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#
+#   In-memory MSI backend
+#
+#   Copyright (C) 2018 by Igor E. Novikov
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Backend recording MSI content in memory instead of writing files, so
+model and table generation run without libmsi. Committed databases are
+kept in DATABASES by MSI file path until they are popped with
+pop_database().
+"""
+
+import os
+import threading
+
+from wixpy import backend
+
+# Concurrent builds commit databases under DATABASES_LOCK
+DATABASES = {}
+DATABASES_LOCK = threading.Lock()
+
+
+def pop_database(path):
+    """Returns and forgets database committed to path, None if absent"""
+    with DATABASES_LOCK:
+        return DATABASES.pop(path, None)
+
+
+class MemoryDatabase(object):
+    """Recorded MSI content: summary property dict, table specs, table
+    rows and (file_id, filepath) list of cabinet files.
+    """
+    path = None
+    summary = None
+    cabinet = None
+    committed = False
+
+    def __init__(self, path):
+        self.path = path
+        self.summary = {}
+        self.specs = {}
+        self.rows = {}
+        self.cabinet = []
+
+
+class SummaryInfo(backend.SummaryInfo):
+    def write_msi(self, db):
+        db.summary = {key: getattr(self, key) for key in (
+            'title', 'author', 'subject', 'comments', 'template', 'keywords',
+            'codepage', 'uuid', 'filetime', 'version', 'appname',
+            'security', 'source')}
+
+
+class Table(backend.Table):
+    def _create_table(self, db):
+        db.specs[self.name] = self.tbl_spec
+        db.rows[self.name] = []
+
+    def _write_records(self, db):
+        rows = db.rows.setdefault(self.name, [])
+        for record in self.records:
+            rows.append([self._normalize_str(item) if isinstance(item, str)
+                         else item for item in record])
+
+
+class Database(backend.Database):
+    def build_cabinet(self, cabfile, compressed=True, embed=True):
+        # Cabinet file is not created, stream keeps its path only and
+        # cabinet files are recorded on commit
+        if embed:
+            self.tables['_Streams'].add(os.path.basename(cabfile),
+                                        ('filepath', cabfile))
+
+    def init_db(self, msifile):
+        self.db = MemoryDatabase(msifile)
+
+    def commit_db(self):
+        self.db.cabinet = [(file_id, filepath) for filepath, file_id,
+                           _size, _mtime in self.files]
+        self.db.committed = True
+        with DATABASES_LOCK:
+            DATABASES[self.db.path] = self.db
+
+    def save_template(self, msifile, path=None):
+        # Recorded rows are cheaper to write again than to copy
+        return None
+
+    @staticmethod
+    def read_template(path):
+        return None
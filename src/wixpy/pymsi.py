@@ -0,0 +1,842 @@
+# -*- coding: utf-8 -*-
+#
+#   Pure Python MSI backend
+#
+#   Copyright (C) 2018 by Igor E. Novikov
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Backend writing MSI database without libmsi. Table rows are kept in
+memory as columns of stored values referring to the string pool. On commit
+string pool, _Tables, _Columns, table streams, binary and _Streams streams
+and summary information are serialized into OLE compound file at once.
+Cabinet is compressed with zlib (MSZIP).
+"""
+
+import array
+import collections
+import copy
+import itertools
+import os
+import pickle
+import re
+import struct
+import sys
+import tempfile
+import time
+import uuid
+import zlib
+
+from wixpy import backend
+from wixpy import utils
+
+if utils.IS_PY3:
+    unichr = chr
+
+MSI_CLSID = uuid.UUID('000C1084-0000-0000-C000-000000000046').bytes_le
+FMTID_SUMMARY = uuid.UUID('F29F85E0-4FF9-1068-AB91-08002B27B3D9').bytes_le
+SUMMARY_STREAM = u'\x05SummaryInformation'
+DEFAULT_CODEPAGE = 1252
+CHUNK_SIZE = 1024 * 1024
+
+# ----------- MSI tables -----------
+
+# Column type bits
+MSITYPE_VALID = 0x0100
+MSITYPE_LOCALIZABLE = 0x0200
+MSITYPE_STRING = 0x0800
+MSITYPE_NULLABLE = 0x1000
+MSITYPE_KEY = 0x2000
+
+COLUMN_TYPES = {
+    'CHAR': MSITYPE_STRING | 0x400,
+    'LONGCHAR': MSITYPE_STRING | 0x400,
+    'SHORT': 0x400 | 2,
+    'INT': 0x400 | 2,
+    'LONG': 4,
+    'OBJECT': MSITYPE_STRING | MSITYPE_VALID,
+}
+
+SYSTEM_TABLES = {
+    '_Tables': (
+        ('Name', 'CHAR(64) NOT NULL PRIMARY KEY `Name`'),
+    ),
+    '_Columns': (
+        ('Table', 'CHAR(64) NOT NULL'),
+        ('Number', 'INT NOT NULL'),
+        ('Name', 'CHAR(64) NOT NULL'),
+        ('Type', 'INT NOT NULL PRIMARY KEY `Table`, `Number`'),
+    ),
+}
+
+UINT = 'I' if array.array('I').itemsize == 4 else 'L'
+
+
+def column_types(table_spec):
+    """Returns (name, type) column list for MT_TABLES table spec"""
+    columns = []
+    keys = []
+    for name, spec in table_spec:
+        spec, _sep, pkey = spec.partition('PRIMARY KEY')
+        keys += re.findall('`([^`]+)`', pkey)
+        match = re.match(r'\s*([A-Z]+)\s*(?:\((\d+)\))?', spec)
+        if not match or match.group(1) not in COLUMN_TYPES:
+            raise ValueError('Unsupported column type: %s' % spec)
+        tp = COLUMN_TYPES[match.group(1)] | MSITYPE_VALID
+        if match.group(2):
+            tp |= int(match.group(2))
+        if 'NOT NULL' not in spec:
+            tp |= MSITYPE_NULLABLE
+        if 'LOCALIZABLE' in spec:
+            tp |= MSITYPE_LOCALIZABLE
+        columns.append((name, tp))
+    return [(name, tp | MSITYPE_KEY if name in keys else tp)
+            for name, tp in columns]
+
+
+def is_binary(tp):
+    return tp & ~(MSITYPE_NULLABLE | MSITYPE_KEY) == \
+        MSITYPE_STRING | MSITYPE_VALID
+
+
+def column_width(tp, sref_width):
+    if is_binary(tp):
+        return 2
+    elif tp & MSITYPE_STRING:
+        return sref_width
+    return 2 if tp & 0xff <= 2 else 4
+
+
+def encode_name(name, table=False):
+    """Compresses stream name the way MSI does: pairs of [0-9A-Za-z._]
+    characters are packed into single UTF-16 character
+    """
+    def utf2mime(char):
+        if '0' <= char <= '9':
+            return ord(char) - ord('0')
+        elif 'A' <= char <= 'Z':
+            return ord(char) - ord('A') + 10
+        elif 'a' <= char <= 'z':
+            return ord(char) - ord('a') + 36
+        return {'.': 62, '_': 63}.get(char)
+
+    chars = [unichr(0x4840)] if table else []
+    index = 0
+    while index < len(name):
+        first = utf2mime(name[index])
+        index += 1
+        if first is None:
+            chars.append(name[index - 1])
+            continue
+        second = utf2mime(name[index]) if index < len(name) else None
+        if second is None:
+            chars.append(unichr(0x4800 + first))
+        else:
+            chars.append(unichr(0x3800 + first + (second << 6)))
+            index += 1
+    name = u''.join(chars)
+    if len(name) > 31:
+        raise Exception('Stream name "%s" is too long' % name)
+    return name
+
+
+def pack_column(values, width):
+    """Packs stored column values as little-endian integers"""
+    data = array.array('H' if width == 2 else UINT, values)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    data = data.tobytes() if utils.IS_PY3 else data.tostring()
+    if width == 3:
+        packed = bytearray(len(values) * 3)
+        for index in range(3):
+            packed[index::3] = data[index::4]
+        data = bytes(packed)
+    return data
+
+
+class TableData(object):
+    """MSI table as lists of stored column values"""
+    name = None
+    columns = None
+    values = None
+    keys = None
+    count = 0
+
+    def __init__(self, name, table_spec):
+        self.name = name
+        self.columns = column_types(table_spec)
+        self.values = [array.array(UINT) for _item in self.columns]
+        self.keys = [index for index, (_name, tp) in enumerate(self.columns)
+                     if tp & MSITYPE_KEY]
+
+    def get_stream(self, sref_width):
+        """Returns table stream data, rows are sorted by primary key
+        stored values as libmsi does
+        """
+        order = range(self.count)
+        if self.keys:
+            keys = [self.values[index] for index in self.keys]
+            order = sorted(order, key=lambda row: [item[row] for item in keys])
+        return b''.join(
+            pack_column([values[row] for row in order],
+                        column_width(tp, sref_width))
+            for values, (_name, tp) in zip(self.values, self.columns))
+
+
+class MsiFile(object):
+    """MSI database being written, strings are kept in the pool by id
+    with their reference counts, id 0 is null string
+    """
+    path = None
+    codepage = DEFAULT_CODEPAGE
+    summary = None
+
+    def __init__(self, path):
+        self.path = path
+        self.strings = {}
+        self.pool = [None]
+        self.refs = [0]
+        # Tables are committed in creation order
+        self.tables = collections.OrderedDict()
+        # (name, data or ('filepath', path)) list
+        self.streams = []
+
+    def copy(self, path):
+        """Returns copy of the database to be written into path"""
+        db = copy.copy(self)
+        db.path = path
+        db.strings = dict(self.strings)
+        db.pool = list(self.pool)
+        db.refs = list(self.refs)
+        db.streams = list(self.streams)
+        db.tables = collections.OrderedDict()
+        for name, table in self.tables.items():
+            db.tables[name] = copy.copy(table)
+            db.tables[name].values = [values[:] for values in table.values]
+        return db
+
+    def add_string(self, text):
+        if not text:
+            return 0
+        index = self.strings.get(text)
+        if index is None:
+            index = self.strings[text] = len(self.pool)
+            self.pool.append(text)
+            self.refs.append(0)
+        self.refs[index] += 1
+        return index
+
+    def create_table(self, name, table_spec, codepage=None):
+        if codepage:
+            self.codepage = int(codepage)
+        self.tables[name] = TableData(name, table_spec)
+
+    def insert(self, table, record):
+        stream = None
+        for value, values, (_name, tp) in zip(record, table.values,
+                                              table.columns):
+            if value is None:
+                values.append(0)
+            elif is_binary(tp):
+                if not (isinstance(value, tuple) and value[0] == 'filepath'):
+                    msg = 'Incompatible type of record item: %s %s'
+                    raise ValueError(msg % (str(type(value)), str(value)))
+                stream = value
+                values.append(1)
+            elif tp & MSITYPE_STRING:
+                if isinstance(value, int):
+                    value = str(value)
+                values.append(self.add_string(value))
+            else:
+                # Integers are stored with sign bit flipped, 0 is null
+                offset = 0x8000 if tp & 0xff <= 2 else 0x80000000
+                values.append((int(value) + offset) & 0xffffffff)
+        table.count += 1
+        if stream is not None:
+            # Binary stream name consists of table name and key values
+            name = '.'.join([table.name] + [str(record[index])
+                                            for index in table.keys])
+            self.add_stream(encode_name(name), stream)
+
+    def add_stream(self, name, data):
+        self.streams.append((name, data))
+
+    def get_string_pool(self, sref_width):
+        encoding = 'cp%d' % self.codepage
+        pool = array.array('H', [self.codepage & 0xffff,
+                                 (self.codepage >> 16) |
+                                 (0x8000 if sref_width == 3 else 0)])
+        data = []
+        for text, refs in zip(self.pool[1:], self.refs[1:]):
+            if not isinstance(text, bytes):
+                text = text.encode(encoding, 'replace')
+            refs = min(refs, 0xffff)
+            if len(text) > 0xffff:
+                # Long string length follows empty entry
+                pool.extend([0, refs, len(text) & 0xffff, len(text) >> 16])
+            else:
+                pool.extend([len(text), refs])
+            data.append(text)
+        if sys.byteorder == 'big':
+            pool.byteswap()
+        pool = pool.tobytes() if utils.IS_PY3 else pool.tostring()
+        return pool, b''.join(data)
+
+    def commit(self):
+        tables = [TableData(name, SYSTEM_TABLES[name])
+                  for name in ('_Tables', '_Columns')]
+        for table in list(self.tables.values()):
+            self.insert(tables[0], [table.name])
+            for index, (name, tp) in enumerate(table.columns):
+                self.insert(tables[1], [table.name, index + 1, name, tp])
+        tables += self.tables.values()
+
+        sref_width = 3 if len(self.pool) > 0xffff else 2
+        pool, data = self.get_string_pool(sref_width)
+        streams = [
+            (encode_name('_StringPool', True), pool),
+            (encode_name('_StringData', True), data),
+        ]
+        for table in tables:
+            streams.append((encode_name(table.name, True),
+                            table.get_stream(sref_width)))
+        if self.summary is not None:
+            streams.append((SUMMARY_STREAM, self.summary))
+        write_storage(self.path, MSI_CLSID, streams + self.streams)
+
+
+# ----------- Summary information -----------
+
+PID_CODEPAGE = 1
+PID_TITLE = 2
+PID_SUBJECT = 3
+PID_AUTHOR = 4
+PID_KEYWORDS = 5
+PID_COMMENTS = 6
+PID_TEMPLATE = 7
+PID_LASTAUTHOR = 8
+PID_REVNUMBER = 9
+PID_CREATE_DTM = 12
+PID_LASTSAVE_DTM = 13
+PID_PAGECOUNT = 14
+PID_WORDCOUNT = 15
+PID_APPNAME = 18
+PID_SECURITY = 19
+
+VT_I2 = 2
+VT_I4 = 3
+VT_LPSTR = 30
+VT_FILETIME = 64
+
+
+def property_set(fmtid, properties, codepage):
+    """Returns property set stream of single section containing
+    (pid, vt, value) properties
+    """
+    index = []
+    data = []
+    offset = 8 + 8 * len(properties)
+    for pid, vt, value in properties:
+        if vt == VT_I2:
+            item = struct.pack('<IHH', vt, value & 0xffff, 0)
+        elif vt == VT_I4:
+            item = struct.pack('<Ii', vt, value)
+        elif vt == VT_FILETIME:
+            item = struct.pack('<IQ', vt, value)
+        else:
+            if not isinstance(value, bytes):
+                value = value.encode('cp%d' % codepage, 'replace')
+            value += b'\0'
+            item = struct.pack('<II', vt, len(value)) + value + \
+                b'\0' * (-len(value) % 4)
+        index.append(struct.pack('<II', pid, offset))
+        data.append(item)
+        offset += len(item)
+    header = struct.pack('<HHI16sI', 0xfffe, 0, 0x00020006, b'\0' * 16, 1)
+    return header + fmtid + struct.pack('<III', 48, offset, len(properties)) \
+        + b''.join(index + data)
+
+
+# ----------- Compound file -----------
+
+SECTOR_SIZE = 512
+MINI_SECTOR_SIZE = 64
+MINI_STREAM_CUTOFF = 4096
+DIFSECT = 0xfffffffc
+FATSECT = 0xfffffffd
+ENDOFCHAIN = 0xfffffffe
+FREESECT = 0xffffffff
+NOSTREAM = 0xffffffff
+
+
+def sectors(size, sector_size=SECTOR_SIZE):
+    return (size + sector_size - 1) // sector_size
+
+
+def build_tree(nodes, entries):
+    """Links sorted directory entries into balanced red-black tree,
+    returns root entry index. Deepest level is red, others are black.
+    """
+    depths = {}
+
+    def link(items, depth):
+        if not items:
+            return NOSTREAM
+        middle = len(items) // 2
+        node = items[middle]
+        depths[node] = depth
+        entries[node][1] = link(items[:middle], depth + 1)
+        entries[node][2] = link(items[middle + 1:], depth + 1)
+        return node
+
+    root = link(nodes, 0)
+    max_depth = max(depths.values()) if depths else 0
+    for node, depth in depths.items():
+        entries[node][0] = 0 if depth == max_depth and depth else 1
+    return root
+
+
+def write_storage(path, clsid, streams):
+    """Writes OLE compound file (version 3) containing (name, data or
+    ('filepath', path)) streams in root storage. File streams are copied
+    by chunks.
+    """
+    sizes = [os.path.getsize(data[1]) if isinstance(data, tuple)
+             else len(data) for _name, data in streams]
+    for (name, _data), size in zip(streams, sizes):
+        # Version 3 file keeps 32-bit stream sizes
+        if size > 0xffffffff:
+            raise Exception('Stream %s exceeds 4 GB' % name)
+    fat = []
+    minifat = []
+    starts = []
+
+    def allocate(table, count):
+        start = len(table)
+        table.extend(range(start + 1, start + count))
+        table.append(ENDOFCHAIN)
+        return start
+
+    for size in sizes:
+        if not size:
+            starts.append(ENDOFCHAIN)
+        elif size < MINI_STREAM_CUTOFF:
+            starts.append(allocate(minifat,
+                                   sectors(size, MINI_SECTOR_SIZE)))
+        else:
+            starts.append(allocate(fat, sectors(size)))
+    ministream_size = len(minifat) * MINI_SECTOR_SIZE
+    ministream_start = allocate(fat, sectors(ministream_size)) \
+        if minifat else ENDOFCHAIN
+    minifat_count = sectors(len(minifat) * 4)
+    minifat_start = allocate(fat, minifat_count) if minifat else ENDOFCHAIN
+    dir_start = allocate(fat, sectors((len(streams) + 1) * 128))
+
+    fat_count = difat_count = 0
+    while True:
+        total = len(fat) + fat_count + difat_count
+        count = sectors(total * 4)
+        difat = sectors(max(0, count - 109) * 4, SECTOR_SIZE - 4)
+        if (count, difat) == (fat_count, difat_count):
+            break
+        fat_count, difat_count = count, difat
+    fat_start = len(fat)
+    fat += [FATSECT] * fat_count + [DIFSECT] * difat_count
+    fat += [FREESECT] * (fat_count * SECTOR_SIZE // 4 - len(fat))
+    fat_sectors = list(range(fat_start, fat_start + fat_count))
+    difat_start = fat_start + fat_count if difat_count else ENDOFCHAIN
+
+    # Directory: root storage and streams sorted by name length and
+    # uppercase name
+    entries = [[1, NOSTREAM, NOSTREAM] for _item in range(len(streams) + 1)]
+    nodes = sorted(range(1, len(streams) + 1),
+                   key=lambda index: (len(streams[index - 1][0]),
+                                      streams[index - 1][0].upper()))
+    root_child = build_tree(nodes, entries)
+
+    def dir_entry(name, kind, color, left, right, child, entry_clsid,
+                  start, size):
+        name = name.encode('utf-16-le')
+        return struct.pack('<64sHBBIII16sIQQII', name,
+                           len(name) + 2 if name else 0, kind, color,
+                           left, right, child, entry_clsid, 0, 0, 0,
+                           start, size) + b'\0' * 4
+
+    directory = [dir_entry(u'Root Entry', 5, 1, NOSTREAM, NOSTREAM,
+                           root_child, clsid, ministream_start,
+                           ministream_size)]
+    for index, (name, _data) in enumerate(streams):
+        color, left, right = entries[index + 1]
+        directory.append(dir_entry(name, 2, color, left, right, NOSTREAM,
+                                   b'\0' * 16, starts[index], sizes[index]))
+    while len(directory) % 4:
+        directory.append(dir_entry(u'', 0, 0, NOSTREAM, NOSTREAM, NOSTREAM,
+                                   b'\0' * 16, 0, 0))
+
+    def pad(fp, size=SECTOR_SIZE):
+        if fp.tell() % size:
+            fp.write(b'\0' * (size - fp.tell() % size))
+
+    def pack(values, filler):
+        values = values + [filler] * (-len(values) % (SECTOR_SIZE // 4))
+        return struct.pack('<%dI' % len(values), *values)
+
+    def write_data(fp, data, size):
+        if not isinstance(data, tuple):
+            fp.write(data)
+            return
+        copied = 0
+        with open(data[1], 'rb') as source:
+            chunk = source.read(CHUNK_SIZE)
+            while chunk and copied < size:
+                fp.write(chunk[:size - copied])
+                copied += len(chunk)
+                chunk = source.read(CHUNK_SIZE)
+        if copied < size:
+            raise Exception('File %s is changed while writing' % data[1])
+
+    difat = fat_sectors[:109]
+    header = struct.pack('<8s16sHHHHH6sIIIIIIIII', b'\xd0\xcf\x11\xe0\xa1'
+                         b'\xb1\x1a\xe1', b'\0' * 16, 0x3e, 3, 0xfffe, 9, 6,
+                         b'\0' * 6, 0, fat_count, dir_start, 0,
+                         MINI_STREAM_CUTOFF, minifat_start, minifat_count,
+                         difat_start, difat_count)
+    header += struct.pack('<109I', *(difat + [FREESECT] * (109 - len(difat))))
+
+    with open(path, 'wb') as fp:
+        fp.write(header)
+        for (_name, data), size in zip(streams, sizes):
+            if size >= MINI_STREAM_CUTOFF:
+                write_data(fp, data, size)
+                pad(fp)
+        for (_name, data), size in zip(streams, sizes):
+            if 0 < size < MINI_STREAM_CUTOFF:
+                write_data(fp, data, size)
+                pad(fp, MINI_SECTOR_SIZE)
+        pad(fp)
+        if minifat:
+            fp.write(pack(minifat, FREESECT))
+        fp.write(b''.join(directory))
+        fp.write(pack(fat, FREESECT))
+        rest = fat_sectors[109:]
+        for index in range(difat_count):
+            values = rest[:127]
+            rest = rest[127:]
+            values += [FREESECT] * (127 - len(values))
+            values.append(difat_start + index + 1
+                          if index + 1 < difat_count else ENDOFCHAIN)
+            fp.write(struct.pack('<128I', *values))
+
+
+# ----------- Cabinet -----------
+
+CAB_BLOCK_SIZE = 32768
+# CFFOLDER holds 16-bit block count, CFHEADER and CFFOLDER hold 32-bit
+# cabinet size and offsets
+CAB_FOLDER_SIZE = CAB_BLOCK_SIZE * 0xffff
+CAB_MAX_SIZE = 0xffffffff
+CAB_COMPRESSION_NONE = 0
+CAB_COMPRESSION_MSZIP = 1
+# With CabinetCache a folder ends after files whose Id CRC is divisible
+# by CAB_SPLIT or at CAB_SPLIT_SIZE, so changed file touches its folder only
+CAB_SPLIT = 32
+CAB_SPLIT_SIZE = 4 * 1024 * 1024
+
+
+class CabinetCache(object):
+    """Compressed folders of the last written cabinet keyed by their
+    files. Watch mode keeps it between rebuilds, so only folders having
+    changed files are compressed again. Folder data is kept in temporary
+    file.
+    """
+    fp = None
+
+    def __init__(self):
+        self.folders = {}
+        self.fp = None
+        self.last = None
+
+    def begin(self):
+        # Folders not used by the next cabinet are dropped
+        self.last = (self.folders, self.fp)
+        self.folders = {}
+        self.fp = tempfile.TemporaryFile()
+
+    def end(self):
+        if self.last[1] is not None:
+            self.last[1].close()
+        self.last = None
+
+    def get(self, key):
+        """Returns (data, block count, file records) or None"""
+        folders, fp = self.last
+        item = folders.get(key)
+        if item is None:
+            return None
+        offset, length, count, records = item
+        fp.seek(offset)
+        data = fp.read(length)
+        self.add(key, data, count, records)
+        return data, count, records
+
+    def add(self, key, data, count, records):
+        self.fp.seek(0, os.SEEK_END)
+        self.folders[key] = (self.fp.tell(), len(data), count, records)
+        self.fp.write(data)
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+        self.folders = {}
+        self.fp = None
+
+
+def dos_datetime(mtime):
+    # File mtime is in nanoseconds
+    tm = time.localtime(mtime // 10 ** 9)
+    if tm.tm_year < 1980:
+        return (1 << 5) | 1, 0
+    return ((tm.tm_year - 1980) << 9) | (tm.tm_mon << 5) | tm.tm_mday, \
+        (tm.tm_hour << 11) | (tm.tm_min << 5) | (tm.tm_sec // 2)
+
+
+def read_blocks(files, folder, records):
+    """Yields 32K data blocks of folder files, CFFILE records are
+    collected on the fly
+    """
+    block = b''
+    offset = 0
+    for filepath, file_id, _size, mtime in files:
+        start = offset
+        with open(filepath, 'rb') as fp:
+            while True:
+                data = fp.read(CAB_BLOCK_SIZE - len(block))
+                if not data:
+                    break
+                block += data
+                offset += len(data)
+                if len(block) == CAB_BLOCK_SIZE:
+                    yield block
+                    block = b''
+        name = file_id if isinstance(file_id, bytes) \
+            else file_id.encode('utf-8')
+        # 0x20 is archive attribute, 0x80 marks UTF-8 name
+        attribs = 0x20 if max(bytearray(name) or [0]) < 0x80 else 0xa0
+        date, tm = dos_datetime(mtime)
+        records.append(struct.pack('<IIHHHH', offset - start, start, folder,
+                                   date, tm, attribs) + name + b'\0')
+    if block:
+        yield block
+
+
+def compress_block(block):
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                  zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = compressor.compress(block) + compressor.flush()
+    if len(data) > len(block) + 5:
+        # Single stored deflate block for incompressible data
+        data = struct.pack('<BHH', 1, len(block), len(block) ^ 0xffff) + \
+            block
+    return b'CK' + data
+
+
+def write_cabinet(cabfile, files, compressed=True, cache=None):
+    """Writes cabinet of (filepath, file_id, size, mtime) files. Data
+    blocks are written by MSZIP compressor one by one, cabinet headers
+    are written at the end. files are iterated twice, so they can be
+    spooled out of memory. Folders found in CabinetCache are copied
+    instead of being compressed.
+    """
+    if len(files) > 0xffff:
+        raise Exception('Too many files for a cabinet: %d' % len(files))
+    # Files are split into folders limited by CFDATA block count,
+    # folders are file counts
+    folders = []
+    # Cache keys of folders, folder files
+    keys = []
+    folder_size = 0
+    names_size = 0
+    limit = CAB_FOLDER_SIZE
+    for item in files:
+        filepath, file_id, size, _mtime = item
+        if size > CAB_FOLDER_SIZE:
+            raise Exception('File %s is too large for a cabinet: %d bytes'
+                            % (filepath, size))
+        if not folders or folder_size + size > limit:
+            folders.append(0)
+            keys.append([compressed])
+            folder_size = 0
+            limit = CAB_FOLDER_SIZE
+        folders[-1] += 1
+        folder_size += size
+        name = file_id.encode('utf-8') \
+            if not isinstance(file_id, bytes) else file_id
+        names_size += 17 + len(name)
+        if cache is not None:
+            keys[-1].append(item)
+            if zlib.crc32(name) % CAB_SPLIT == 0 or \
+                    folder_size > CAB_SPLIT_SIZE:
+                limit = -1
+
+    files_offset = 36 + 8 * len(folders)
+    data_offset = files_offset + names_size
+    compression = CAB_COMPRESSION_MSZIP if compressed \
+        else CAB_COMPRESSION_NONE
+    folder_records = []
+    file_records = []
+    if cache is not None:
+        cache.begin()
+    try:
+        with open(cabfile, 'w+b') as fp:
+            fp.seek(data_offset)
+            items = iter(files)
+            for index, file_count in enumerate(folders):
+                start = fp.tell()
+                folder = itertools.islice(items, file_count)
+                key = tuple(keys[index]) if cache is not None else None
+                cached = cache.get(key) if cache is not None else None
+                if cached is not None:
+                    data, count, records = cached
+                    fp.write(data)
+                    for _item in folder:
+                        pass
+                else:
+                    count = 0
+                    records = []
+                    for block in read_blocks(folder, 0, records):
+                        data = compress_block(block) if compressed \
+                            else block
+                        fp.write(struct.pack('<IHH', 0, len(data),
+                                             len(block)))
+                        fp.write(data)
+                        count += 1
+                    if cache is not None:
+                        size = fp.tell() - start
+                        fp.seek(start)
+                        cache.add(key, fp.read(size), count, records)
+                if count > 0xffff:
+                    # Files grown after being scanned
+                    raise Exception('Cabinet folder exceeds %d data blocks'
+                                    % 0xffff)
+                # Records are collected with folder index 0
+                folder_id = struct.pack('<H', index)
+                file_records += [record[:8] + folder_id + record[10:]
+                                 for record in records]
+                folder_records.append(struct.pack('<IHH', start, count,
+                                                  compression))
+                if fp.tell() > CAB_MAX_SIZE:
+                    raise Exception('Cabinet %s exceeds 4 GB' % cabfile)
+            size = fp.tell()
+            fp.seek(0)
+            fp.write(struct.pack('<4sIIIIIBBHHHHH', b'MSCF', 0, size, 0,
+                                 files_offset, 0, 3, 1, len(folders),
+                                 len(files), 0, 0, 0))
+            fp.write(b''.join(folder_records + file_records))
+    except Exception:
+        # Incomplete cabinet is not left behind
+        if os.path.exists(cabfile):
+            os.remove(cabfile)
+        raise
+    finally:
+        if cache is not None:
+            cache.end()
+
+
+# ----------- Backend classes -----------
+
+class SummaryInfo(backend.SummaryInfo):
+    def write_msi(self, db):
+        properties = [
+            (PID_CODEPAGE, VT_I2, self.codepage),
+            (PID_TITLE, VT_LPSTR, self.title),
+            (PID_SUBJECT, VT_LPSTR, self.subject),
+            (PID_AUTHOR, VT_LPSTR, self.author),
+            (PID_KEYWORDS, VT_LPSTR, self.keywords),
+            (PID_COMMENTS, VT_LPSTR, self.comments),
+            (PID_TEMPLATE, VT_LPSTR, self.template),
+            (PID_LASTAUTHOR, VT_LPSTR, self.author),
+            (PID_REVNUMBER, VT_LPSTR, self.uuid),
+            (PID_CREATE_DTM, VT_FILETIME, self.filetime),
+            (PID_LASTSAVE_DTM, VT_FILETIME, self.filetime),
+            (PID_PAGECOUNT, VT_I4, self.version),
+            (PID_WORDCOUNT, VT_I4, self.source),
+            (PID_APPNAME, VT_LPSTR, self.appname),
+            (PID_SECURITY, VT_I4, self.security), ]
+        db.summary = property_set(
+            FMTID_SUMMARY, [item for item in properties
+                            if item[2] is not None],
+            self.codepage or DEFAULT_CODEPAGE)
+
+
+class Table(backend.Table):
+    # Codepage of string values, wixpy.msi tables set it
+    codepage = None
+
+    def _create_table(self, db):
+        db.create_table(self.name, self.tbl_spec, self.codepage)
+
+    def _write_records(self, db):
+        if self.name == '_Streams':
+            # Streams are not stored as table rows
+            for name, data in self.records:
+                db.add_stream(encode_name(name), data)
+            return
+        table = db.tables[self.name]
+        for record in self.records:
+            db.insert(table, [self._normalize_str(item)
+                              if isinstance(item, str) else item
+                              for item in record])
+
+
+class Database(backend.Database):
+    def build_cabinet(self, cabfile, compressed=True, embed=True):
+        write_cabinet(cabfile, self.files, compressed)
+        if embed:
+            self.tables['_Streams'].add(os.path.basename(cabfile),
+                                        ('filepath', cabfile))
+
+    def init_db(self, msifile):
+        self.db = MsiFile(msifile)
+
+    def commit_db(self):
+        self.db.commit()
+
+    def save_template(self, msifile, path=None):
+        template = self.db.copy(msifile)
+        if path is not None:
+            try:
+                backend.write_file(path, lambda fp: pickle.dump(template,
+                                                               fp, 2))
+            except (IOError, OSError, pickle.PickleError):
+                pass
+        return template
+
+    @staticmethod
+    def read_template(path):
+        try:
+            with open(path, 'rb') as fp:
+                template = pickle.load(fp)
+        except Exception:
+            # Missing or broken template
+            return None
+        return template if isinstance(template, MsiFile) else None
+
+    def load_template(self, msifile, template):
+        self.db = template.copy(msifile)
+
+    @staticmethod
+    def remove_template(template):
+        # Templates are kept in memory
+        pass
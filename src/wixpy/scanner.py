@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+#
+#   Source tree scanner
+#
+#   Copyright (C) 2018 by Igor E. Novikov
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import fnmatch
+import os
+import hashlib
+import pickle
+import re
+import stat
+import sys
+import tempfile
+import time
+
+HAS_SCANDIR = hasattr(os, 'scandir')
+
+
+def get_futures():
+    """Returns concurrent.futures module or None if it is not available.
+    It is imported on demand, as it takes long to import.
+    """
+    try:
+        from concurrent import futures
+    except ImportError:
+        return None
+    return futures
+
+
+def _mtime_ns(st):
+    if hasattr(st, 'st_mtime_ns'):
+        return st.st_mtime_ns
+    return int(st.st_mtime * 10 ** 9)
+
+
+def _file_id(st):
+    # (st_dev, st_ino) or None if platform does not report inodes
+    return (st.st_dev, st.st_ino) if st.st_ino else None
+
+
+class Entry(object):
+    """Directory entry with stat data taken once during the scan.
+
+    ino is (st_dev, st_ino) pair of the physical file, for folders it is
+    set for symlinks only. nlink is hardlink count of files, 0 if platform
+    does not report it. mtime is None for files taken from scan cache,
+    their size and mtime are not checked during the scan.
+    """
+    __slots__ = ('name', 'path', 'is_dir', 'size', 'mtime', 'ino', 'is_link',
+                 'nlink')
+
+    def __init__(self, name, path, is_dir, size=None, mtime=None, ino=None,
+                 is_link=False, nlink=1):
+        self.name = name
+        self.path = path
+        self.is_dir = is_dir
+        self.size = size
+        self.mtime = mtime
+        self.ino = ino
+        self.is_link = is_link
+        self.nlink = nlink
+
+
+class PathFilter(object):
+    """Include/exclude glob matcher compiled once per scan.
+
+    Patterns without a slash are matched against entry names, patterns
+    with a slash against paths relative to the source folder (using "/"
+    as separator). Excluded folders are not descended into. Include
+    patterns are applied to files only, so folders are always scanned.
+    """
+    flags = re.I if os.name == 'nt' else 0
+
+    def __init__(self, include=None, exclude=None):
+        self.signature = (tuple(include or ()), tuple(exclude or ()))
+        self.include = self._compile(include)
+        self.exclude = self._compile(exclude)
+
+    def _compile(self, patterns):
+        if not patterns:
+            return None
+        names = [fnmatch.translate(item) for item in patterns
+                 if '/' not in item.strip('/')]
+        paths = [fnmatch.translate(item.strip('/')) for item in patterns
+                 if '/' in item.strip('/')]
+        return (re.compile('|'.join(names), self.flags) if names else None,
+                re.compile('|'.join(paths), self.flags) if paths else None)
+
+    @staticmethod
+    def _match(matcher, rel_dir, name):
+        names, paths = matcher
+        if names is not None and names.match(name):
+            return True
+        if paths is not None:
+            rel_path = '%s/%s' % (rel_dir, name) if rel_dir else name
+            return paths.match(rel_path) is not None
+        return False
+
+    def excludes(self, rel_dir, name):
+        return self.exclude is not None and \
+            self._match(self.exclude, rel_dir, name)
+
+    def includes(self, rel_dir, name):
+        return self.include is None or \
+            self._match(self.include, rel_dir, name)
+
+
+def _file_entry(name, path, st, is_link):
+    return Entry(name, path, False, st.st_size, _mtime_ns(st), _file_id(st),
+                 is_link, st.st_nlink)
+
+
+def stat_file(path):
+    """Returns entry of a single file following symlinks"""
+    return _file_entry(os.path.basename(path), path, os.stat(path), False)
+
+
+def _listdir_scandir(path, skip_hidden, path_filter, rel_dir, follow_links):
+    entries = []
+    for item in os.scandir(path):
+        if skip_hidden and item.name.startswith('.'):
+            continue
+        if path_filter and path_filter.excludes(rel_dir, item.name):
+            continue
+        try:
+            is_link = item.is_symlink()
+            if is_link and not follow_links:
+                continue
+            if item.is_dir():
+                ino = _file_id(os.stat(item.path)) if is_link else None
+                entries.append(Entry(item.name, item.path, True, ino=ino,
+                                     is_link=is_link))
+            elif item.is_file():
+                if path_filter and not path_filter.includes(rel_dir,
+                                                            item.name):
+                    continue
+                entries.append(_file_entry(item.name, item.path,
+                                           item.stat(), is_link))
+        except OSError:
+            # Broken symlinks and entries removed during the scan
+            continue
+    return entries
+
+
+def _listdir_stat(path, skip_hidden, path_filter, rel_dir, follow_links):
+    entries = []
+    for name in os.listdir(path):
+        if skip_hidden and name.startswith('.'):
+            continue
+        if path_filter and path_filter.excludes(rel_dir, name):
+            continue
+        item_path = os.path.join(path, name)
+        try:
+            st = os.lstat(item_path)
+            is_link = stat.S_ISLNK(st.st_mode)
+            if is_link:
+                if not follow_links:
+                    continue
+                st = os.stat(item_path)
+        except OSError:
+            continue
+        if stat.S_ISDIR(st.st_mode):
+            entries.append(Entry(name, item_path, True,
+                                 ino=_file_id(st) if is_link else None,
+                                 is_link=is_link))
+        elif stat.S_ISREG(st.st_mode):
+            if path_filter and not path_filter.includes(rel_dir, name):
+                continue
+            entries.append(_file_entry(name, item_path, st, is_link))
+    return entries
+
+
+def listdir(path, skip_hidden=False, path_filter=None, rel_dir='',
+            follow_links=True):
+    """Lists directories and regular files of the folder in os.listdir()
+    order. Each file is stat'ed once, its size and mtime (in nanoseconds)
+    are kept in the returned entry. Entries rejected by path_filter are
+    skipped before stat'ing, rel_dir is the folder path relative to
+    the source folder. Symlinks are skipped if follow_links is False.
+    """
+    if HAS_SCANDIR:
+        return _listdir_scandir(path, skip_hidden, path_filter, rel_dir,
+                                follow_links)
+    return _listdir_stat(path, skip_hidden, path_filter, rel_dir,
+                         follow_links)
+
+
+def rel_dir(root, path):
+    """Returns folder path relative to the root with "/" separators"""
+    rel_path = path[len(root):].strip(os.sep)
+    return rel_path.replace(os.sep, '/') if os.sep != '/' else rel_path
+
+
+def default_cache_dir():
+    """Returns per-user folder of scan manifests and MSI templates"""
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    elif sys.platform == 'darwin':
+        base = os.path.expanduser('~/Library/Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or \
+            os.path.expanduser('~/.cache')
+    return os.path.join(base, 'wixpy')
+
+
+class ScanCache(object):
+    """Persistent manifest of directory listings.
+
+    Listings are keyed by folder path and validated by folder inode, size
+    and mtime_ns. Adding, removing or renaming an entry changes its folder
+    only, so each folder is stat'ed once, but on a cache hit the folder is
+    not read and its files are not stat'ed. Their entries have mtime set
+    to None, file size and mtime are checked when the file is written into
+    the package. Folders modified less than RACY_TIME before the scan are
+    listed again on the next build, as their later changes may keep the
+    same mtime.
+    """
+    VERSION = 3
+    # Seconds, covers coarse mtime resolution of FAT and network shares
+    RACY_TIME = 2
+    filepath = None
+    signature = None
+    started = 0
+
+    def __init__(self, cache_dir, root, options=()):
+        self.signature = (self.VERSION, root, tuple(options))
+        digest = hashlib.md5(repr(self.signature).encode('utf-8'))
+        self.filepath = os.path.join(cache_dir,
+                                     'manifest-' + digest.hexdigest())
+        self.started = int((time.time() - self.RACY_TIME) * 10 ** 9)
+        self.dirs = {}
+        self.updated = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.filepath, 'rb') as fp:
+                data = pickle.load(fp)
+            if data.get('signature') == self.signature:
+                self.dirs = data['dirs']
+        except Exception:
+            # Missing or broken manifest
+            self.dirs = {}
+
+    def save(self):
+        """Writes manifest, the cache is skipped if it cannot be written"""
+        dirpath = os.path.dirname(self.filepath)
+        try:
+            if not os.path.isdir(dirpath):
+                os.makedirs(dirpath)
+            fd, tmp_path = tempfile.mkstemp(dir=dirpath)
+            with os.fdopen(fd, 'wb') as fp:
+                pickle.dump({'signature': self.signature,
+                             'dirs': self.updated}, fp, 2)
+            if os.path.exists(self.filepath) and \
+                    not hasattr(os, 'replace'):
+                os.remove(self.filepath)
+            getattr(os, 'replace', os.rename)(tmp_path, self.filepath)
+        except (IOError, OSError):
+            pass
+
+    def listdir(self, path, skip_hidden=False, path_filter=None, rel_dir='',
+                follow_links=True):
+        st = os.stat(path)
+        key = (st.st_ino, st.st_size, _mtime_ns(st))
+        cached = self.dirs.get(path)
+        if cached is not None and cached[0] == key:
+            self.updated[path] = cached
+            return [Entry(name, os.path.join(path, name), is_dir, size,
+                          None, ino, is_link, nlink)
+                    for name, is_dir, size, ino, is_link, nlink in cached[1]]
+        entries = listdir(path, skip_hidden, path_filter, rel_dir,
+                          follow_links)
+        if key[2] < self.started:
+            self.updated[path] = (key, [(e.name, e.is_dir, e.size, e.ino,
+                                         e.is_link, e.nlink)
+                                        for e in entries])
+        return entries
+
+
+class Walker(object):
+    """Walks the source tree and yields (parent_path, entry) pairs in the
+    same depth-first order as recursive listdir() calls would do.
+    Symlinked folders pointing to a folder being walked are skipped,
+    so cyclic links do not loop.
+
+    With jobs > 1 directory listings are read in a thread pool ahead of
+    the consumer: subfolders of the folders being walked are submitted in
+    walk order, at most PREFETCH listings per job are pending, and results
+    are merged back in deterministic order. With sort set entries of each
+    folder are yielded in name order instead of os.listdir() order.
+    """
+    # Pending listings per job
+    PREFETCH = 8
+
+    path = None
+    skip_hidden = False
+    root = None
+    jobs = 1
+    cache = None
+    path_filter = None
+    follow_links = True
+    sort = False
+
+    def __init__(self, path, skip_hidden=False, jobs=1, cache_dir=None,
+                 path_filter=None, root=None, follow_links=True, sort=False):
+        self.path = path
+        self.root = root or path
+        self.skip_hidden = skip_hidden
+        self.jobs = max(1, int(jobs or 1))
+        self.path_filter = path_filter
+        self.follow_links = follow_links
+        self.sort = sort
+        if cache_dir:
+            options = [bool(skip_hidden), bool(follow_links)]
+            if path_filter is not None:
+                options.append(path_filter.signature)
+            self.cache = ScanCache(cache_dir, path, options)
+        self.pool = None
+        self.pending = {}
+
+    def _list(self, path):
+        rel_path = rel_dir(self.root, path) if self.path_filter else ''
+        if self.cache is not None:
+            entries = self.cache.listdir(path, self.skip_hidden,
+                                         self.path_filter, rel_path,
+                                         self.follow_links)
+        else:
+            entries = listdir(path, self.skip_hidden, self.path_filter,
+                              rel_path, self.follow_links)
+        if self.sort:
+            entries.sort(key=lambda item: item.name)
+        return entries
+
+    def _prefetch(self, stack):
+        # Submits next subfolders to list, deepest folders go first
+        limit = self.jobs * self.PREFETCH
+        for item in reversed(stack):
+            listing = item[1]
+            index = max(item[2], item[4])
+            while index < len(listing) and len(self.pending) < limit:
+                entry = listing[index]
+                index += 1
+                # Symlinked folders are listed after the cycle check only
+                if entry.is_dir and not entry.is_link:
+                    self.pending[entry.path] = \
+                        self.pool.submit(self._list, entry.path)
+            item[4] = index
+            if len(self.pending) >= limit:
+                break
+
+    def _get_listing(self, path):
+        future = self.pending.pop(path, None)
+        if future is None:
+            return self._list(path)
+        return future.result()
+
+    @staticmethod
+    def _is_cycle(stack, entry):
+        if entry.ino is None:
+            return False
+        for item in stack:
+            if item[3] is None:
+                try:
+                    item[3] = _file_id(os.stat(item[0]))
+                except OSError:
+                    continue
+            if item[3] == entry.ino:
+                return True
+        return False
+
+    def walk(self):
+        futures = get_futures() if self.jobs > 1 else None
+        if futures is not None:
+            self.pool = futures.ThreadPoolExecutor(self.jobs)
+        try:
+            # Stack items are [path, listing, next entry index,
+            # folder (dev, ino), next entry index to prefetch]
+            stack = [[self.path, self._list(self.path), 0, None, 0]]
+            if self.pool is not None:
+                self._prefetch(stack)
+            while stack:
+                top = stack[-1]
+                if top[2] >= len(top[1]):
+                    stack.pop()
+                    continue
+                entry = top[1][top[2]]
+                top[2] += 1
+                if entry.is_link and entry.is_dir and \
+                        self._is_cycle(stack, entry):
+                    continue
+                yield top[0], entry
+                if entry.is_dir:
+                    listing = self._get_listing(entry.path)
+                    stack.append([entry.path, listing, 0, entry.ino, 0])
+                    if self.pool is not None:
+                        self._prefetch(stack)
+            if self.cache is not None:
+                self.cache.save()
+        finally:
+            if self.pool is not None:
+                for future in list(self.pending.values()):
+                    future.cancel()
+                self.pool.shutdown(wait=True)
+                self.pool = None
+                self.pending = {}
+
+
+def walk(path, skip_hidden=False, jobs=1, cache_dir=None, path_filter=None,
+         root=None, follow_links=True, sort=False):
+    """Walks the source tree, root is the source folder for path_filter
+    matching when a subfolder is walked.
+    """
+    return Walker(path, skip_hidden, jobs, cache_dir, path_filter,
+                  root, follow_links, sort).walk()
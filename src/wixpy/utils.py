@@ -17,7 +17,8 @@
 #   You should have received a copy of the GNU General Public License
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import hashlib
+import os
+import pickle
 import struct
 import sys
 
@@ -25,14 +26,69 @@ import time
 import uuid
 
 IS_PY3 = sys.version_info.major > 2
-
-
-def get_guid():
-    return str(uuid.uuid4()).upper()
-
-
-def get_id(prefix=''):
-    return '%s%s' % (prefix, get_guid().replace('-', ''))
+STRING_TYPES = (str,) if IS_PY3 else (str, unicode)
+
+# Characters collected by XmlWriter before encoding and writing them out
+XML_BUFFER = 256 * 1024
+
+
+class IdFactory(object):
+    """Source of element Ids and GUIDs. Values are random by default.
+    In deterministic mode they are uuid5 of a key within namespace: payload
+    elements are keyed by source path relative to root, other elements are
+    numbered in creation order.
+    """
+    namespace = None
+    root = None
+    counter = 0
+
+    def __init__(self, namespace=None, root=None):
+        self.namespace = namespace
+        self.root = root
+
+    def get_uuid(self, key=None):
+        if self.namespace is None:
+            return uuid.uuid4()
+        if key is None:
+            self.counter += 1
+            key = '#%d' % self.counter
+        return uuid.uuid5(self.namespace, key)
+
+    def get_guid(self, key=None):
+        return str(self.get_uuid(key)).upper()
+
+    def get_id(self, prefix='', key=None):
+        if key is not None:
+            key = '%s:%s' % (prefix, key)
+        return '%s%s' % (prefix, self.get_uuid(key).hex.upper())
+
+    def path_key(self, path):
+        if self.namespace is None or path is None:
+            return None
+        rel_path = path[len(self.root):].strip(os.sep) \
+            if path.startswith(self.root) else path
+        return rel_path.replace(os.sep, '/')
+
+
+class BuildContext(object):
+    """Per-build state passed through the model and MSI database instead
+    of module globals, so several builds can run in one process.
+    """
+    wixl = False
+    xml_encoding = 'utf-8'
+    codepage = '1252'
+    ids = None
+    projections = None
+    backend = None
+
+    def __init__(self, wixl=False, xml_encoding=None, ids=None,
+                 backend=None):
+        self.wixl = wixl
+        self.xml_encoding = xml_encoding or BuildContext.xml_encoding
+        self.ids = ids or IdFactory()
+        self.projections = {}
+        # MSI backend name or module, see backend.get_backend()
+        self.backend = backend
 
 
 STDOUT_ENDC = '\033[0m'
@@ -50,12 +106,57 @@ def filetime_now():
 
 
 def compute_md5(filepath):
+    import hashlib
     with open(filepath, 'rb') as fp:
         hash = hashlib.md5(fp.read()).hexdigest()
         data = bytes.fromhex(hash) if IS_PY3 else hash.decode('hex')
     return struct.unpack('<iiii', data)
 
 
+def get_filehash(cache, filepath, size, mtime):
+    """Returns MD5 of the file using cache dict of path: (size, mtime, md5)"""
+    if cache is None:
+        return compute_md5(filepath)
+    cached = cache.get(filepath)
+    if cached is not None and cached[:2] == (size, mtime):
+        return cached[2]
+    md5 = compute_md5(filepath)
+    cache[filepath] = (size, mtime, md5)
+    return md5
+
+
+class FileSpool(object):
+    """Append-only record list pickled into temporary file, streaming
+    builds keep cabinet file records there instead of memory.
+    """
+    fp = None
+    count = 0
+
+    def __init__(self):
+        import tempfile
+        self.fp = tempfile.TemporaryFile()
+        self.count = 0
+
+    def append(self, record):
+        self.fp.seek(0, os.SEEK_END)
+        pickle.dump(record, self.fp, 2)
+        self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        offset = 0
+        for _index in range(self.count):
+            self.fp.seek(offset)
+            record = pickle.load(self.fp)
+            offset = self.fp.tell()
+            yield record
+
+    def close(self):
+        self.fp.close()
+
+
 def encode_value(value):
     if isinstance(value, unicode):
         return value.encode('utf-8')
@@ -71,18 +172,35 @@ def encode_json(data):
     return data if IS_PY3 else encode_value(data)
 
 
-XML_ENCODING = 'utf-8'
-
-
 class XmlWriter(object):
+    """Collects written fragments and encodes them in batches of about
+    buffer_size characters. flush() has to be called after the last write.
+    """
     fp = None
+    encoding = None
+    buffer_size = XML_BUFFER
 
-    def __init__(self, filepointer):
+    def __init__(self, filepointer, encoding, buffer_size=XML_BUFFER):
         self.fp = filepointer
+        self.encoding = encoding
+        self.buffer_size = buffer_size
+        self.chunks = []
+        self.size = 0
 
     def write(self, text):
+        self.chunks.append(text)
+        self.size += len(text)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self.chunks:
+            return
+        text = ''.join(self.chunks)
+        self.chunks = []
+        self.size = 0
         if IS_PY3:
-            text = text.encode(XML_ENCODING, errors='replace')
-        elif XML_ENCODING != 'utf-8':
-            text = text.decode('utf-8').encode(XML_ENCODING, errors='replace')
+            text = text.encode(self.encoding, errors='replace')
+        elif self.encoding != 'utf-8':
+            text = text.decode('utf-8').encode(self.encoding, errors='replace')
         self.fp.write(text)
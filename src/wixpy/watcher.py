@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+#
+#   Source folder change watchers
+#
+#   Copyright (C) 2018 by Igor E. Novikov
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+from wixpy import scanner
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | \
+             IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | \
+             IN_MOVE_SELF
+
+EVENT = struct.Struct('iIII')
+
+# Quiet period (in seconds) closing a burst of changes
+SETTLE_TIME = 0.3
+
+
+class PollingWatcher(object):
+    """Detects changes comparing source folder snapshots"""
+    path = None
+    skip_hidden = False
+    follow_links = True
+    interval = 1.0
+
+    def __init__(self, path, skip_hidden=False, interval=1.0,
+                 follow_links=True):
+        self.path = path
+        self.skip_hidden = skip_hidden
+        self.follow_links = follow_links
+        self.interval = interval
+        self.snapshot = self._snapshot()
+
+    def _snapshot(self):
+        snapshot = {self.path: []}
+        for parent, entry in scanner.walk(self.path, self.skip_hidden,
+                                          follow_links=self.follow_links):
+            snapshot[parent].append((entry.name, entry.is_dir,
+                                     entry.size, entry.mtime))
+            if entry.is_dir:
+                snapshot[entry.path] = []
+        return snapshot
+
+    def wait(self):
+        while True:
+            time.sleep(self.interval)
+            snapshot = self._snapshot()
+            changed = set(path for path, listing in snapshot.items()
+                          if self.snapshot.get(path) != listing)
+            self.snapshot = snapshot
+            if changed:
+                return changed
+
+    def close(self):
+        self.snapshot = None
+
+
+class InotifyWatcher(object):
+    """Linux inotify(7) watcher, each source folder gets own watch.
+    Symlinked folders share the watch of their target, so watches map
+    watch descriptors to sets of folder paths.
+    """
+    path = None
+    skip_hidden = False
+    follow_links = True
+
+    def __init__(self, path, skip_hidden=False, follow_links=True):
+        self.path = path
+        self.skip_hidden = skip_hidden
+        self.follow_links = follow_links
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watches = {}
+        try:
+            self.add_tree(path)
+        except OSError:
+            self.close()
+            raise
+
+    def add_watch(self, path):
+        name = path.encode(sys.getfilesystemencoding()) \
+            if not isinstance(path, bytes) else path
+        wd = self.libc.inotify_add_watch(self.fd, name, WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise OSError(err, 'inotify_add_watch failed: %s' % path)
+        self.watches.setdefault(wd, set()).add(path)
+
+    def add_tree(self, path):
+        self.add_watch(path)
+        for _parent, entry in scanner.walk(path, self.skip_hidden,
+                                           follow_links=self.follow_links):
+            if entry.is_dir:
+                self.add_watch(entry.path)
+
+    def _read_events(self, timeout):
+        changed = set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return changed
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return changed
+            raise
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size:offset + EVENT.size + length]
+            offset += EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                for paths in self.watches.values():
+                    changed.update(paths)
+                continue
+            paths = self.watches.get(wd)
+            if paths is None:
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd)
+                continue
+            changed.update(paths)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                name = name.rstrip(b'\0').decode(sys.getfilesystemencoding())
+                if not (self.skip_hidden and name.startswith('.')):
+                    for path in list(paths):
+                        self.add_tree(os.path.join(path, name))
+        return changed
+
+    def wait(self):
+        changed = set()
+        while not changed:
+            changed = self._read_events(None)
+        while True:
+            events = self._read_events(SETTLE_TIME)
+            if not events:
+                return changed
+            changed.update(events)
+
+    def close(self):
+        if self.fd is not None and self.fd >= 0:
+            os.close(self.fd)
+        self.fd = None
+        self.watches = {}
+
+
+def get_watcher(path, skip_hidden=False, interval=1.0, polling=False,
+                follow_links=True):
+    if not polling and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(path, skip_hidden, follow_links)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(path, skip_hidden, interval, follow_links)
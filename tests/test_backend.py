@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+#   MSI backend registry tests
+#
+#   Copyright (C) 2018 by Igor E. Novikov
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Checks MSI backend lookup, database classes combined with backends and
+packages written through null and custom backends.
+
+Usage: python3 -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import types
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+import wixpy  # noqa: E402
+from wixpy import backend  # noqa: E402
+from wixpy import msi  # noqa: E402
+from wixpy import nullmsi  # noqa: E402
+from wixpy import pymsi  # noqa: E402
+
+
+class RegistryTest(unittest.TestCase):
+    def test_get_backend(self):
+        self.assertIs(backend.get_backend('null'), nullmsi)
+        self.assertIs(backend.get_backend(u'python'), pymsi)
+        self.assertIs(backend.get_backend(nullmsi), nullmsi)
+        self.assertRaises(Exception, backend.get_backend, 'unknown')
+        self.assertEqual(backend.default_backend(),
+                         'libmsiw' if os.name == 'nt' else 'libmsi')
+
+    def test_get_database(self):
+        cls = msi.get_database('null')
+        self.assertIs(msi.get_database(nullmsi), cls)
+        self.assertTrue(issubclass(cls, msi.MsiDatabase))
+        self.assertTrue(issubclass(cls, nullmsi.Database))
+        self.assertTrue(issubclass(cls.table_class, nullmsi.Table))
+        self.assertTrue(issubclass(cls.summary_class, nullmsi.SummaryInfo))
+        self.assertFalse(issubclass(msi.get_database('python'),
+                                    nullmsi.Database))
+
+
+class BuildTest(unittest.TestCase):
+    tmp_dir = None
+    source_dir = None
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.tmp_dir, 'src')
+        os.makedirs(os.path.join(self.source_dir, 'm'))
+        for name in ('a.txt', 'm/b.txt'):
+            with open(os.path.join(self.source_dir, name), 'w') as fp:
+                fp.write(name)
+        self.output = os.path.join(self.tmp_dir, 'test.msi')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def build(self, msi_backend, output=None):
+        wixpy.build({
+            'Name': 'Test',
+            'UpgradeCode': '3AC4B4FF-10C4-4B8F-81AD-BAC3238BF690',
+            'Version': '1.0',
+            'Manufacturer': 'Test',
+            '_SourceDir': self.source_dir,
+            '_InstallDir': 'test',
+            '_ScanCache': False,
+        }, output=output or self.output, backend=msi_backend)
+
+    def test_null_backend(self):
+        self.build('null')
+        db = nullmsi.pop_database(self.output)
+        self.assertFalse(os.path.exists(self.output))
+        self.assertTrue(db.committed)
+        self.assertEqual(sorted(row[2] for row in db.rows['File']),
+                         ['a.txt', 'b.txt'])
+        self.assertEqual(sorted(file_id for file_id, _path in db.cabinet),
+                         sorted(row[0] for row in db.rows['File']))
+
+    def test_concurrent_builds(self):
+        outputs = [os.path.join(self.tmp_dir, 'test%d.msi' % i)
+                   for i in range(8)]
+        threads = [threading.Thread(target=self.build, args=('null', path))
+                   for path in outputs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for path in outputs:
+            self.assertTrue(nullmsi.pop_database(path).committed)
+        self.assertIsNone(nullmsi.pop_database(outputs[0]))
+
+    def test_custom_backend(self):
+        written = []
+
+        class Table(nullmsi.Table):
+            def _write_records(self, db):
+                written.append(self.name)
+                super(Table, self)._write_records(db)
+
+        custom = types.ModuleType('custommsi')
+        custom.SummaryInfo = nullmsi.SummaryInfo
+        custom.Table = Table
+        custom.Database = nullmsi.Database
+        self.build(custom)
+        nullmsi.pop_database(self.output)
+        self.assertIn('File', written)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+#   Canonical WXS output tests
+#
+#   Copyright (C) 2018 by Igor E. Novikov
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Checks that canonical WXS output does not depend on directory listing
+order and that --canonical option of wix.py script sets it.
+
+Usage: python3 -m unittest discover tests
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import wixpy  # noqa: E402
+from wixpy import scanner  # noqa: E402
+
+FILES = ('a.txt', 'b.exe', 'c.txt', 'm/c.txt', 'm/deep/d.dll', 'm/e.txt',
+         'z/e.txt', 'z/f.dll')
+
+
+class CanonicalTest(unittest.TestCase):
+    tmp_dir = None
+    source_dir = None
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.tmp_dir, 'src')
+        for name in FILES:
+            path = os.path.join(self.source_dir, *name.split('/'))
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as fp:
+                fp.write(name)
+        self.json_data = {
+            'Name': 'Test',
+            'UpgradeCode': '3AC4B4FF-10C4-4B8F-81AD-BAC3238BF690',
+            'Version': '1.0',
+            'Manufacturer': 'Test',
+            '_SourceDir': self.source_dir,
+            '_InstallDir': 'test',
+            '_ScanCache': False,
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def build_xml(self, reverse=False, **options):
+        json_data = dict(self.json_data, **options)
+        output = os.path.join(self.tmp_dir, 'test.wxs')
+        listdir = scanner.listdir
+
+        def reversed_listdir(*args):
+            return list(reversed(listdir(*args)))
+
+        if reverse:
+            scanner.listdir = reversed_listdir
+        try:
+            wixpy.build(json_data, output=output, xml_only=True)
+        finally:
+            scanner.listdir = listdir
+        with open(output, 'rb') as fp:
+            return fp.read()
+
+    def test_listing_order(self):
+        for options in ({}, {'_Streaming': True},
+                        {'_ComponentGrouping': True}, {'_ScanJobs': 4}):
+            xml = self.build_xml(_SortedScan=True, _StableIds=True,
+                                 **options)
+            self.assertEqual(self.build_xml(True, _SortedScan=True,
+                                            _StableIds=True, **options), xml)
+            self.assertNotEqual(self.build_xml(True, _StableIds=True,
+                                               **options), xml)
+
+    def test_script(self):
+        json_file = os.path.join(self.tmp_dir, 'test.json')
+        with open(json_file, 'w') as fp:
+            json.dump(self.json_data, fp)
+        output = os.path.join(self.tmp_dir, 'script.wxs')
+        script = os.path.join(ROOT, 'scripts',
+                              'py3' if sys.version_info[0] > 2 else 'py2',
+                              'wix.py')
+        env = dict(os.environ, PYTHONPATH=os.path.join(ROOT, 'src'))
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call([sys.executable, script, '--canonical',
+                                   '--xml_only', '--output=' + output,
+                                   json_file], env=env, stdout=devnull)
+        with open(output, 'rb') as fp:
+            self.assertEqual(fp.read(), self.build_xml(_SortedScan=True,
+                                                       _StableIds=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+#
+#   Payload deduplication tests
+#
+#   Copyright (C) 2018 by Igor E. Novikov
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Checks that hardlinked and symlinked payload files are stored once with
+_ComponentGrouping, including KeyPath files of folder components.
+Packages are written by in-memory null backend.
+
+Usage: python3 -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+import wixpy  # noqa: E402
+from wixpy import msi  # noqa: E402
+from wixpy import nullmsi  # noqa: E402
+from wixpy import utils  # noqa: E402
+
+
+@unittest.skipUnless(hasattr(os, 'link'), 'hardlinks are not supported')
+class GroupedHardlinksTest(unittest.TestCase):
+    tmp_dir = None
+    source_dir = None
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.tmp_dir, 'src')
+        for name in ('a', 'b', 'c'):
+            os.makedirs(os.path.join(self.source_dir, name))
+        self.write('a/x.txt', 'x')
+        self.write('a/y.txt', 'y')
+        # KeyPath file of b folder component is a hardlink
+        self.link('a/x.txt', 'b/0.txt')
+        self.write('b/z.txt', 'z')
+        # Folder component of hardlinks only
+        self.link('a/x.txt', 'c/x.txt')
+        self.link('a/y.txt', 'c/y.txt')
+        try:
+            os.symlink(os.path.join(self.source_dir, 'a'),
+                       os.path.join(self.source_dir, 'd'))
+        except (AttributeError, NotImplementedError, OSError):
+            pass
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, content):
+        with open(os.path.join(self.source_dir, name), 'w') as fp:
+            fp.write(content)
+
+    def link(self, source, name):
+        os.link(os.path.join(self.source_dir, source),
+                os.path.join(self.source_dir, name))
+
+    def build(self, streaming=False):
+        json_data = {
+            'Name': 'Test',
+            'UpgradeCode': '3AC4B4FF-10C4-4B8F-81AD-BAC3238BF690',
+            'Version': '1.0',
+            'Manufacturer': 'Test',
+            '_SourceDir': self.source_dir,
+            '_InstallDir': 'test',
+            '_ComponentGrouping': True,
+            '_Streaming': streaming,
+            '_ScanCache': False,
+        }
+        output = os.path.join(self.tmp_dir, 'test.msi')
+        wixmodel = wixpy.create_model(json_data,
+                                      ctx=utils.BuildContext(backend='null'))
+        msi.get_database('null')(wixmodel).write_msi(output)
+        return nullmsi.pop_database(output)
+
+    def check(self, db):
+        files = {row[0]: row for row in db.rows[msi.MT_FILE]}
+        # Each physical file is stored once
+        inodes = [os.stat(path).st_ino for _file_id, path in db.cabinet]
+        self.assertEqual(len(files), 3)
+        self.assertEqual(len(set(inodes)), len(inodes))
+        key_folders = set(row[1] for row in
+                          db.rows.get(msi.MT_CREATEFOLDER, []))
+        for row in db.rows[msi.MT_COMPONENT]:
+            if row[3] & msi.ComponentAttribute.REGISTRY_KEY_PATH:
+                continue
+            if row[5] is None:
+                self.assertIn(row[0], key_folders)
+            else:
+                self.assertEqual(files[row[5]][1], row[0])
+        components = set(row[0] for row in db.rows[msi.MT_COMPONENT])
+        for row in db.rows[msi.MT_DUPLICATEFILE]:
+            self.assertIn(row[1], components)
+            self.assertIn(row[2], files)
+
+    def test_grouped_hardlinks(self):
+        self.check(self.build())
+
+    def test_grouped_hardlinks_streaming(self):
+        self.check(self.build(streaming=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+#
+#   libmsi backend tests
+#
+#   Copyright (C) 2018 by Igor E. Novikov
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Checks that libmsi tables reuse prepared INSERT queries. libmsi GObject
+bindings are replaced by recording fakes, so the test runs without them.
+
+Usage: python3 -m unittest discover tests
+"""
+
+import importlib
+import os
+import sys
+import types
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+
+class FakeRecord(object):
+    def __init__(self, count):
+        self.values = [None] * count
+
+    def set_int(self, index, value):
+        self.values[index - 1] = value
+
+    def set_string(self, index, value):
+        self.values[index - 1] = value
+
+    def load_stream(self, index, path):
+        self.values[index - 1] = ('stream', path)
+
+
+class FakeQuery(object):
+    def __init__(self, db, sql):
+        self.sql = sql
+        self.rows = db.rows
+        self.opened = False
+        db.queries.append(self)
+
+    def execute(self, record=None):
+        if self.opened:
+            raise Exception('Query is executed without closing')
+        self.opened = True
+        self.rows.append((self.sql, list(record.values)))
+
+    def close(self):
+        self.opened = False
+
+
+class FakeDb(object):
+    def __init__(self):
+        self.queries = []
+        self.rows = []
+
+
+def fake_gi():
+    """Returns sys.modules entries of fake gi package"""
+    gi = types.ModuleType('gi')
+    gi.require_version = lambda name, version: None
+    repository = types.ModuleType('gi.repository')
+    libmsi = types.ModuleType('gi.repository.Libmsi')
+    libmsi.Query = types.ModuleType('Query')
+    libmsi.Query.new = FakeQuery
+    libmsi.Record = types.ModuleType('Record')
+    libmsi.Record.new = FakeRecord
+    repository.Libmsi = libmsi
+    repository.GCab = types.ModuleType('gi.repository.GCab')
+    repository.Gio = types.ModuleType('gi.repository.Gio')
+    gi.repository = repository
+    return {'gi': gi, 'gi.repository': repository}
+
+
+class PreparedInsertTest(unittest.TestCase):
+    libmsi = None
+    saved = None
+
+    def setUp(self):
+        modules = fake_gi()
+        self.saved = dict((name, sys.modules.get(name))
+                          for name in list(modules) + ['wixpy.libmsi'])
+        sys.modules.update(modules)
+        sys.modules.pop('wixpy.libmsi', None)
+        self.libmsi = importlib.import_module('wixpy.libmsi')
+
+    def tearDown(self):
+        # Backend module bound to fake bindings is not left behind
+        for name, module in self.saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+        wixpy = sys.modules['wixpy']
+        if self.saved['wixpy.libmsi'] is None and hasattr(wixpy, 'libmsi'):
+            del wixpy.libmsi
+
+    def test_prepared_queries(self):
+        table = self.libmsi.Table('File', (
+            ('File', 'CHAR(72) NOT NULL PRIMARY KEY `File`'),
+            ('Version', 'CHAR(72)'),
+            ('Sequence', 'INT NOT NULL')))
+        table.records = [['a', None, 1], ['b', '1.0', 2], ['c', None, 3],
+                         ['d', '2.0', 4]]
+        db = FakeDb()
+        table._write_records(db)
+        # Query and record per set of non-null columns
+        self.assertEqual([query.sql for query in db.queries], [
+            'INSERT INTO `File` (`File`, `Sequence`) VALUES (?, ?)',
+            'INSERT INTO `File` (`File`, `Version`, `Sequence`) '
+            'VALUES (?, ?, ?)'])
+        self.assertEqual([values for _sql, values in db.rows],
+                         [['a', 1], ['b', '1.0', 2], ['c', 3],
+                          ['d', '2.0', 4]])
+        self.assertFalse([query for query in db.queries if query.opened])
+
+
+if __name__ == '__main__':
+    unittest.main()
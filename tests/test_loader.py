@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+#   WXS loader tests
+#
+#   Copyright (C) 2018 by Igor E. Novikov
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Checks that WXS written by the model is loaded back into the same model,
+comments included, and gives the same MSI tables.
+
+Usage: python3 -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+import wixpy  # noqa: E402
+from wixpy import nullmsi  # noqa: E402
+
+FILES = ('a.txt', 'b.exe', 'm/c.txt', 'm/deep/d.dll', 'm/deep/e.txt')
+
+
+class LoaderTest(unittest.TestCase):
+    tmp_dir = None
+    source_dir = None
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.tmp_dir, 'src')
+        for name in FILES:
+            path = os.path.join(self.source_dir, *name.split('/'))
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as fp:
+                fp.write(name)
+        self.wxs = os.path.join(self.tmp_dir, 'test.wxs')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def json_data(self, **options):
+        json_data = {
+            'Name': 'Test',
+            'UpgradeCode': '3AC4B4FF-10C4-4B8F-81AD-BAC3238BF690',
+            'Version': '1.0',
+            'Manufacturer': 'Test',
+            '_SourceDir': self.source_dir,
+            '_InstallDir': 'test',
+            '_OsCondition': 601,
+            '_StableIds': True,
+            '_ScanCache': False,
+        }
+        json_data.update(options)
+        return json_data
+
+    def read(self, path):
+        with open(path, 'rb') as fp:
+            return fp.read()
+
+    def test_round_trip(self):
+        for options in ({}, {'_ComponentGrouping': True},
+                        {'_Deduplicate': True}):
+            wixpy.build(self.json_data(**options), output=self.wxs,
+                        xml_only=True)
+            output = os.path.join(self.tmp_dir, 'loaded.wxs')
+            wixpy.build(xml_file=self.wxs, output=output, xml_only=True)
+            xml = self.read(self.wxs)
+            self.assertEqual(self.read(output), xml)
+            self.assertTrue(xml.count(b'<!--') > 1)
+
+    def test_tables(self):
+        output = os.path.join(self.tmp_dir, 'test.msi')
+        wixpy.build(self.json_data(), output=self.wxs, xml_only=True)
+        wixpy.build(self.json_data(), output=output, backend='null')
+        rows = nullmsi.pop_database(output).rows
+        wixpy.build(xml_file=self.wxs, output=output, backend='null')
+        self.assertEqual(nullmsi.pop_database(output).rows, rows)
+
+    def test_relative_source(self):
+        with open(self.wxs, 'w') as fp:
+            fp.write('''<?xml version="1.0" encoding="utf-8"?>
+<Wix xmlns="http://schemas.microsoft.com/wix/2006/wi">
+  <Product Id="*" Name="Test" Language="1033" Version="1.0"
+   Manufacturer="Test" UpgradeCode="3AC4B4FF-10C4-4B8F-81AD-BAC3238BF690">
+    <Package Compressed="yes" />
+    <Media Id="1" Cabinet="test.cab" EmbedCab="yes" />
+    <Directory Id="TARGETDIR" Name="SourceDir">
+      <Component Id="cmp1" Guid="A3E2A6B6-FA2A-4D3B-9B1E-67A5CBF0AF0C">
+        <!-- Payload -->
+        <File Id="fil1" Source="src/m/c.txt" KeyPath="yes" />
+      </Component>
+    </Directory>
+    <Feature Id="Complete">
+      <ComponentRef Id="cmp1" />
+    </Feature>
+  </Product>
+</Wix>
+''')
+        output = os.path.join(self.tmp_dir, 'test.msi')
+        wixpy.build(xml_file=self.wxs, output=output, backend='null')
+        rows = nullmsi.pop_database(output).rows['File']
+        self.assertEqual([list(row[:4]) for row in rows],
+                         [['fil1', 'cmp1', 'c.txt', len('m/c.txt')]])
+
+    def test_unsupported(self):
+        with open(self.wxs, 'w') as fp:
+            fp.write('<Wix><Product Id="*"><Unknown /></Product></Wix>')
+        self.assertRaises(Exception, wixpy.build, xml_file=self.wxs,
+                          xml_only=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
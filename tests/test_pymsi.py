@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+#
+#   Pure Python MSI backend tests
+#
+#   Copyright (C) 2018 by Igor E. Novikov
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Reads back stream names, string pool, OLE compound file and cabinets
+written by pymsi and checks cabinet limits.
+
+Usage: python3 -m unittest discover tests
+"""
+
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+from wixpy import pymsi  # noqa: E402
+
+MIME = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz._'
+
+
+def decode_name(name):
+    """Returns (name, is table) of compressed stream name"""
+    chars = []
+    table = name[:1] == u'䡀'
+    for char in name[1:] if table else name:
+        code = ord(char)
+        if 0x3800 <= code < 0x4800:
+            code -= 0x3800
+            chars += [MIME[code & 0x3f], MIME[code >> 6]]
+        elif 0x4800 <= code < 0x4840:
+            chars.append(MIME[code - 0x4800])
+        else:
+            chars.append(char)
+    return u''.join(chars), table
+
+
+def read_string_pool(pool, data):
+    """Returns (codepage, long refs, [(text, refs)]) of string pool"""
+    values = struct.unpack('<%dH' % (len(pool) // 2), pool)
+    codepage = values[0] | (values[1] & 0x7fff) << 16
+    strings = []
+    offset = 0
+    index = 2
+    while index < len(values):
+        size, refs = values[index:index + 2]
+        index += 2
+        if not size and refs:
+            size = values[index] | values[index + 1] << 16
+            index += 2
+        strings.append((data[offset:offset + size], refs))
+        offset += size
+    return codepage, bool(values[1] & 0x8000), strings
+
+
+def read_storage(path):
+    """Returns (clsid, {name: data}) of OLE compound file root storage"""
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    header = struct.unpack_from('<8s16sHHHHH6sIIIIIIIII', data)
+    assert header[0] == b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+    fat_count, dir_start = header[9], header[10]
+    minifat_start, difat_start = header[13], header[15]
+    difat = list(struct.unpack_from('<109I', data, 76))
+    sector = difat_start
+    while sector != pymsi.ENDOFCHAIN:
+        values = struct.unpack_from('<128I', data, 512 + sector * 512)
+        difat += values[:127]
+        sector = values[127]
+    fat = []
+    for sector in difat[:fat_count]:
+        fat += struct.unpack_from('<128I', data, 512 + sector * 512)
+
+    def chain(start, table, read):
+        chunks = []
+        while start != pymsi.ENDOFCHAIN:
+            chunks.append(read(start))
+            start = table[start]
+        return b''.join(chunks)
+
+    def read_sector(sector):
+        return data[512 + sector * 512:1024 + sector * 512]
+
+    directory = chain(dir_start, fat, read_sector)
+    minifat = chain(minifat_start, fat, read_sector) \
+        if minifat_start != pymsi.ENDOFCHAIN else b''
+    minifat = struct.unpack('<%dI' % (len(minifat) // 4), minifat)
+    entries = []
+    for offset in range(0, len(directory), 128):
+        entry = struct.unpack_from('<64sHBBIII16sIQQII', directory, offset)
+        name = entry[0][:max(0, entry[1] - 2)].decode('utf-16-le')
+        entries.append((name, entry[2], entry[7], entry[11], entry[12]))
+    root = entries[0]
+    assert root[:2] == (u'Root Entry', 5)
+    ministream = chain(root[3], fat, read_sector)[:root[4]]
+    streams = {}
+    for name, kind, _clsid, start, size in entries[1:]:
+        if kind != 2:
+            continue
+        if size >= pymsi.MINI_STREAM_CUTOFF:
+            stream = chain(start, fat, read_sector)
+        elif size:
+            stream = chain(start, minifat,
+                           lambda item: ministream[item * 64:item * 64 + 64])
+        else:
+            stream = b''
+        streams[name] = stream[:size]
+    return root[2], streams
+
+
+def read_cabinet(cabfile):
+    """Returns (header values, folder block counts, {file_id: data}) of
+    cabinet
+    """
+    with open(cabfile, 'rb') as fp:
+        cab = fp.read()
+    header = struct.unpack_from('<4sIIIIIBBHHHHH', cab)
+    assert header[0] == b'MSCF' and header[2] == len(cab)
+    folders = []
+    counts = []
+    for index in range(header[8]):
+        offset, count, compression = struct.unpack_from(
+            '<IHH', cab, 36 + 8 * index)
+        data = b''
+        for _block in range(count):
+            _checksum, size, length = struct.unpack_from('<IHH', cab, offset)
+            block = cab[offset + 8:offset + 8 + size]
+            if compression == pymsi.CAB_COMPRESSION_MSZIP:
+                assert block[:2] == b'CK'
+                block = zlib.decompressobj(-zlib.MAX_WBITS).decompress(
+                    block[2:])
+            assert len(block) == length
+            data += block
+            offset += 8 + size
+        folders.append(data)
+        counts.append(count)
+    files = {}
+    offset = header[4]
+    for _index in range(header[9]):
+        size, start, folder = struct.unpack_from('<IIH', cab, offset)
+        end = cab.index(b'\0', offset + 16)
+        name = cab[offset + 16:end].decode('utf-8')
+        files[name] = folders[folder][start:start + size]
+        offset = end + 1
+    return header, counts, files
+
+
+class EncodeNameTest(unittest.TestCase):
+    def test_round_trip(self):
+        for name in ('_StringPool', 'File', 'Binary.bannrbmp', 'a', 'abc',
+                     'Icon.app-ico', u'Ñame.1'):
+            for table in (False, True):
+                encoded = pymsi.encode_name(name, table)
+                self.assertEqual(decode_name(encoded), (name, table))
+        # Pairs of name characters are packed
+        self.assertEqual(len(pymsi.encode_name('_Validation', True)), 7)
+
+    def test_long_name(self):
+        self.assertRaises(Exception, pymsi.encode_name, '-' * 32)
+
+
+class StringPoolTest(unittest.TestCase):
+    def test_round_trip(self):
+        db = pymsi.MsiFile('test.msi')
+        db.codepage = 1252
+        for text in (u'Name', u'Value', u'Name', u'Ñame', u'', b'raw'):
+            db.add_string(text)
+        long_text = u'x' * 0x10005
+        db.add_string(long_text)
+        pool, data = db.get_string_pool(2)
+        self.assertEqual(read_string_pool(pool, data), (1252, False, [
+            (b'Name', 2), (b'Value', 1), (u'Ñame'.encode('cp1252'), 1),
+            (b'raw', 1), (long_text.encode('cp1252'), 1)]))
+        self.assertTrue(read_string_pool(*db.get_string_pool(3))[1])
+
+
+class StorageTest(unittest.TestCase):
+    tmp_dir = None
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip(self):
+        rnd = random.Random(1)
+        streams = {}
+        for index, size in enumerate((0, 1, 64, 4095, 4096, 5000, 70000)):
+            streams[pymsi.encode_name('Stream%d' % index)] = \
+                bytes(bytearray(rnd.randrange(256) for _i in range(size)))
+        for index in range(20):
+            streams[u'Small%d' % index] = b'%d' % index
+        # Stream of 8 MB needs DIFAT sectors
+        filepath = os.path.join(self.tmp_dir, 'stream.bin')
+        with open(filepath, 'wb') as fp:
+            fp.write(b'0123456789abcdef' * (512 * 1024))
+        items = list(streams.items()) + [(u'File', ('filepath', filepath))]
+        with open(filepath, 'rb') as fp:
+            streams[u'File'] = fp.read()
+        path = os.path.join(self.tmp_dir, 'test.msi')
+        pymsi.write_storage(path, pymsi.MSI_CLSID, items)
+        self.assertEqual(read_storage(path), (pymsi.MSI_CLSID, streams))
+
+
+class CabinetTest(unittest.TestCase):
+    tmp_dir = None
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cabfile = os.path.join(self.tmp_dir, 'test.cab')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_files(self, contents):
+        files = []
+        for name, data in contents:
+            path = os.path.join(self.tmp_dir, name)
+            with open(path, 'wb') as fp:
+                fp.write(data)
+            files.append((path, name, len(data),
+                          int(os.stat(path).st_mtime * 10 ** 9)))
+        return files
+
+    def check(self, contents, compressed=True):
+        files = self.write_files(contents)
+        pymsi.write_cabinet(self.cabfile, files, compressed)
+        header, counts, files = read_cabinet(self.cabfile)
+        self.assertEqual(files, dict(contents))
+        self.assertEqual(header[9], len(contents))
+        return counts
+
+    def test_single_block(self):
+        self.assertEqual(self.check([('a.txt', b'a' * 100),
+                                     ('b.txt', b'b' * 200),
+                                     ('empty.txt', b'')]), [1])
+
+    def test_multiple_blocks(self):
+        data = b''.join(b'%d ' % index for index in range(50000))
+        counts = self.check([('a.txt', data), ('b.txt', data[:40000])])
+        self.assertEqual(counts, [-(-(len(data) + 40000) //
+                                    pymsi.CAB_BLOCK_SIZE)])
+
+    def test_stored_blocks(self):
+        rnd = random.Random(1)
+        data = bytes(bytearray(rnd.randrange(256) for _i in range(70000)))
+        self.check([('random.bin', data)])
+        # Incompressible blocks are kept as stored deflate blocks
+        with open(self.cabfile, 'rb') as fp:
+            cab = fp.read()
+        offset = struct.unpack_from('<I', cab, 36)[0]
+        self.assertEqual(struct.unpack_from('<HH2sB', cab, offset + 4),
+                         (pymsi.CAB_BLOCK_SIZE + 7, pymsi.CAB_BLOCK_SIZE,
+                          b'CK', 1))
+        self.check([('random.bin', data)], compressed=False)
+
+    def test_folders(self):
+        saved = pymsi.CAB_FOLDER_SIZE
+        pymsi.CAB_FOLDER_SIZE = pymsi.CAB_BLOCK_SIZE * 2
+        try:
+            counts = self.check([('%d.txt' % index, b'%d' % index * 20000)
+                                 for index in range(6)])
+        finally:
+            pymsi.CAB_FOLDER_SIZE = saved
+        self.assertTrue(len(counts) > 1)
+        self.assertTrue(max(counts) <= 2)
+
+    def test_limits(self):
+        files = self.write_files([('a.txt', b'a' * 100)])
+        path, name, _size, mtime = files[0]
+        # Single file does not fit 0xffff blocks of cabinet folder
+        self.assertRaises(Exception, pymsi.write_cabinet, self.cabfile,
+                          [(path, name, pymsi.CAB_FOLDER_SIZE + 1, mtime)])
+        self.assertFalse(os.path.exists(self.cabfile))
+        saved = pymsi.CAB_MAX_SIZE
+        pymsi.CAB_MAX_SIZE = 1000
+        try:
+            files = self.write_files([('b.txt', b'b' * 2000)])
+            self.assertRaises(Exception, pymsi.write_cabinet, self.cabfile,
+                              files, False)
+        finally:
+            pymsi.CAB_MAX_SIZE = saved
+        # Incomplete cabinet is removed
+        self.assertFalse(os.path.exists(self.cabfile))
+
+
+if __name__ == '__main__':
+    unittest.main()
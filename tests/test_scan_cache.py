@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+#
+#   Scan manifest cache tests
+#
+#   Copyright (C) 2018 by Igor E. Novikov
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Checks that a scan of unchanged source folder is served from the manifest
+with a single stat per folder and that changed files are picked up.
+
+Usage: python3 -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+import wixpy  # noqa: E402
+from wixpy import msi  # noqa: E402
+from wixpy import nullmsi  # noqa: E402
+from wixpy import scanner  # noqa: E402
+from wixpy import utils  # noqa: E402
+
+FOLDERS = ('a', 'b', 'c')
+FILES = 20
+
+
+class FsCalls(object):
+    """Counts os.stat/os.lstat/os.scandir/os.listdir calls in the folder"""
+    names = ('stat', 'lstat', 'scandir', 'listdir')
+
+    def __init__(self, path):
+        self.path = path
+        self.counts = dict((name, 0) for name in self.names)
+        self.saved = {}
+
+    def wrap(self, name, func):
+        def wrapper(*args, **kwargs):
+            if args and str(args[0]).startswith(self.path):
+                self.counts[name] += 1
+            return func(*args, **kwargs)
+        return wrapper
+
+    def __enter__(self):
+        for name in self.names:
+            if hasattr(os, name):
+                self.saved[name] = getattr(os, name)
+                setattr(os, name, self.wrap(name, self.saved[name]))
+        return self
+
+    def __exit__(self, *args):
+        for name, func in self.saved.items():
+            setattr(os, name, func)
+
+
+class ScanCacheTest(unittest.TestCase):
+    tmp_dir = None
+    source_dir = None
+    cache_dir = None
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.tmp_dir, 'src')
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        for folder in FOLDERS:
+            os.makedirs(os.path.join(self.source_dir, folder))
+            for index in range(FILES):
+                self.write('%s/%d.txt' % (folder, index), 'x' * index)
+        self.age_folders()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, content, mode='w'):
+        with open(os.path.join(self.source_dir, name), mode) as fp:
+            fp.write(content)
+
+    def age_folders(self):
+        # Folders modified right before the scan are not cached
+        mtime = time.time() - 60
+        for folder in FOLDERS + ('',):
+            os.utime(os.path.join(self.source_dir, folder), (mtime, mtime))
+
+    def walk(self):
+        return sorted((entry.path, entry.size) for _parent, entry in
+                      scanner.walk(self.source_dir, cache_dir=self.cache_dir))
+
+    def build(self):
+        json_data = {
+            'Name': 'Test',
+            'UpgradeCode': '3AC4B4FF-10C4-4B8F-81AD-BAC3238BF690',
+            'Version': '1.0',
+            'Manufacturer': 'Test',
+            '_SourceDir': self.source_dir,
+            '_InstallDir': 'test',
+            '_ScanCache': self.cache_dir,
+        }
+        output = os.path.join(self.tmp_dir, 'test.msi')
+        wixmodel = wixpy.create_model(json_data,
+                                      ctx=utils.BuildContext(backend='null'))
+        msi.get_database('null')(wixmodel).write_msi(output)
+        db = nullmsi.pop_database(output)
+        return [(row[2], row[3]) for row in db.rows[msi.MT_FILE]]
+
+    def test_unchanged_tree(self):
+        with FsCalls(self.source_dir) as first:
+            listing = self.walk()
+        with FsCalls(self.source_dir) as second:
+            self.assertEqual(self.walk(), listing)
+        counts = second.counts
+        self.assertEqual(counts['scandir'] + counts['listdir'], 0)
+        self.assertEqual(counts['lstat'], 0)
+        # Single stat per folder, files are not stat'ed
+        self.assertEqual(counts['stat'], len(FOLDERS) + 1)
+        self.assertTrue(first.counts['scandir'] + first.counts['listdir'] >=
+                        len(FOLDERS) + 1)
+
+    def test_changed_files(self):
+        self.build()
+        # Rewritten in place, folder timestamps are kept
+        self.write('a/5.txt', 'y' * 1000)
+        self.age_folders()
+        self.write('b/new.txt', 'new')
+        files = self.build()
+        self.assertIn(('5.txt', 1000), files)
+        self.assertEqual(files.count(('5.txt', 5)), len(FOLDERS) - 1)
+        self.assertIn(('new.txt', 3), files)
+        self.assertEqual(len(files), len(FOLDERS) * FILES + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+#
+#   Source tree scanner tests
+#
+#   Copyright (C) 2018 by Igor E. Novikov
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Checks source tree listings and walk order of the scanner, also when
+folders are listed in a thread pool, include/exclude path filters and
+symlink policy.
+
+Usage: python3 -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+import wixpy  # noqa: E402
+from wixpy import scanner  # noqa: E402
+
+FILES = ('a.txt', 'b/c.txt', 'b/d/e.txt', 'b/d/f.txt', 'b/g.txt', 'h/i.txt',
+         '.hidden/j.txt', '.k.txt', 'l.txt')
+
+
+def recursive_walk(path, skip_hidden=False):
+    """Reference walk by recursive os.listdir() calls"""
+    for name in os.listdir(path):
+        if skip_hidden and name.startswith('.'):
+            continue
+        item_path = os.path.join(path, name)
+        yield path, name
+        if os.path.isdir(item_path):
+            for item in recursive_walk(item_path, skip_hidden):
+                yield item
+
+
+class ScannerTestCase(unittest.TestCase):
+    tmp_dir = None
+    source_dir = None
+    files = FILES
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.tmp_dir, 'src')
+        os.makedirs(self.source_dir)
+        for name in self.files:
+            self.write(name, name * 3)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def path(self, name):
+        return os.path.join(self.source_dir, *name.split('/'))
+
+    def write(self, name, content):
+        path = self.path(name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fp:
+            fp.write(content)
+
+    def walk(self, **kwargs):
+        return [(parent, entry.name) for parent, entry in
+                scanner.walk(self.source_dir, **kwargs)]
+
+
+class ScannerTest(ScannerTestCase):
+    def check_listdir(self, listdir):
+        path = self.path('b')
+        entries = listdir(path, False, None, '', True)
+        self.assertEqual([entry.name for entry in entries],
+                         os.listdir(path))
+        for entry in entries:
+            st = os.stat(entry.path)
+            self.assertEqual(entry.path, os.path.join(path, entry.name))
+            self.assertEqual(entry.is_dir, os.path.isdir(entry.path))
+            if not entry.is_dir:
+                self.assertEqual(entry.size, st.st_size)
+                self.assertEqual(entry.mtime, scanner._mtime_ns(st))
+                self.assertEqual(entry.nlink, 1)
+
+    def test_listdir(self):
+        self.check_listdir(scanner._listdir_stat)
+        if scanner.HAS_SCANDIR:
+            self.check_listdir(scanner._listdir_scandir)
+
+    def test_walk_order(self):
+        self.assertEqual(self.walk(), list(recursive_walk(self.source_dir)))
+        self.assertEqual(self.walk(skip_hidden=True),
+                         list(recursive_walk(self.source_dir, True)))
+
+    def test_sorted_walk(self):
+        names = [os.path.relpath(os.path.join(parent, name),
+                                 self.source_dir).replace(os.sep, '/')
+                 for parent, name in self.walk(sort=True)]
+        self.assertEqual(names, ['.hidden', '.hidden/j.txt', '.k.txt',
+                                 'a.txt', 'b', 'b/c.txt', 'b/d', 'b/d/e.txt',
+                                 'b/d/f.txt', 'b/g.txt', 'h', 'h/i.txt',
+                                 'l.txt'])
+
+    def test_stat_file(self):
+        entry = scanner.stat_file(self.path('b/d/e.txt'))
+        self.assertEqual((entry.name, entry.is_dir, entry.size),
+                         ('e.txt', False, len('b/d/e.txt') * 3))
+
+
+class ParallelScanTest(ScannerTestCase):
+    files = ['%d/%d/%d.txt' % (index % 7, index % 5, index)
+             for index in range(200)] + ['x/y/z/deep.txt']
+
+    def test_same_order(self):
+        self.assertEqual(self.walk(jobs=4), self.walk())
+        self.assertEqual(self.walk(jobs=4, sort=True), self.walk(sort=True))
+
+    def test_pool(self):
+        threads = set()
+        pending = []
+        walker = scanner.Walker(self.source_dir, jobs=2)
+        list_folder = walker._list
+
+        def _list(path):
+            threads.add(threading.current_thread().name)
+            pending.append(len(walker.pending))
+            return list_folder(path)
+
+        walker._list = _list
+        self.assertEqual([(parent, entry.name)
+                          for parent, entry in walker.walk()], self.walk())
+        if scanner.get_futures() is not None:
+            self.assertTrue(len(threads) > 1)
+        self.assertTrue(max(pending) <= 2 * scanner.Walker.PREFETCH)
+        self.assertEqual(walker.pending, {})
+
+
+class PathFilterTest(ScannerTestCase):
+    files = ('app.exe', 'app.pdb', 'readme.txt', 'lib/x.dll', 'lib/sub/y.dll',
+             '__pycache__/m.pyc', 'tests/data/d.txt', 'tests/t.txt',
+             'data/z.txt', 'doc/z.html')
+
+    def rel_paths(self, path, **kwargs):
+        return sorted(os.path.relpath(entry.path, self.source_dir)
+                      .replace(os.sep, '/') for _parent, entry in
+                      scanner.walk(path, **kwargs) if not entry.is_dir)
+
+    def test_filters(self):
+        listed = []
+        listdir = scanner.listdir
+
+        def _listdir(path, *args):
+            listed.append(path)
+            return listdir(path, *args)
+
+        path_filter = scanner.PathFilter(['*.txt', '*.exe', 'lib/*'],
+                                         ['__pycache__', '*.pdb',
+                                          'tests/data'])
+        scanner.listdir = _listdir
+        try:
+            paths = self.rel_paths(self.source_dir, path_filter=path_filter)
+        finally:
+            scanner.listdir = listdir
+        self.assertEqual(paths, ['app.exe', 'data/z.txt', 'lib/sub/y.dll',
+                                 'lib/x.dll', 'readme.txt', 'tests/t.txt'])
+        # Excluded folders are not listed, included are listed always
+        self.assertNotIn(self.path('__pycache__'), listed)
+        self.assertNotIn(self.path('tests/data'), listed)
+        self.assertIn(self.path('doc'), listed)
+
+    def test_subfolder(self):
+        # Paths are matched relative to the source folder
+        path_filter = scanner.PathFilter(None, ['tests/data'])
+        self.assertEqual(self.rel_paths(self.path('tests'),
+                                        path_filter=path_filter,
+                                        root=self.source_dir),
+                         ['tests/t.txt'])
+
+    def test_model(self):
+        output = os.path.join(self.tmp_dir, 'test.wxs')
+        wixpy.build({
+            'Name': 'Test',
+            'UpgradeCode': '3AC4B4FF-10C4-4B8F-81AD-BAC3238BF690',
+            'Version': '1.0',
+            'Manufacturer': 'Test',
+            '_SourceDir': self.source_dir,
+            '_InstallDir': 'test',
+            '_ScanCache': False,
+            '_Include': ['*.exe', 'lib/*'],
+            '_Exclude': ['sub'],
+        }, output=output, xml_only=True)
+        with open(output, 'rb') as fp:
+            xml = fp.read()
+        for name in (b'app.exe', b'x.dll'):
+            self.assertIn(name, xml)
+        for name in (b'y.dll', b'readme.txt', b'app.pdb'):
+            self.assertNotIn(name, xml)
+
+
+@unittest.skipUnless(hasattr(os, 'symlink') and os.name != 'nt',
+                     'Symlinks are not available')
+class SymlinkTest(ScannerTestCase):
+    files = ('a/x.txt', 'b.txt')
+
+    def setUp(self):
+        super(SymlinkTest, self).setUp()
+        os.symlink(self.path('a'), self.path('a/loop'))
+        os.symlink(self.path('a'), self.path('c'))
+        os.symlink(self.path('b.txt'), self.path('d.txt'))
+        os.link(self.path('b.txt'), self.path('e.txt'))
+
+    def entries(self, **kwargs):
+        return dict((os.path.relpath(entry.path, self.source_dir)
+                     .replace(os.sep, '/'), entry) for _parent, entry in
+                    scanner.walk(self.source_dir, sort=True, **kwargs))
+
+    def test_follow(self):
+        entries = self.entries()
+        # Link to a folder being walked is skipped
+        self.assertEqual(sorted(entries), ['a', 'a/x.txt', 'b.txt', 'c',
+                                           'c/x.txt', 'd.txt', 'e.txt'])
+        self.assertTrue(entries['c'].is_link and entries['d.txt'].is_link)
+        self.assertEqual(entries['c/x.txt'].ino, entries['a/x.txt'].ino)
+        # Links and hardlinks of the same file share file id
+        self.assertEqual(entries['d.txt'].ino, entries['b.txt'].ino)
+        self.assertEqual(entries['e.txt'].ino, entries['b.txt'].ino)
+        self.assertEqual(entries['e.txt'].nlink, 2)
+
+    def test_skip(self):
+        self.assertEqual(sorted(self.entries(follow_links=False)),
+                         ['a', 'a/x.txt', 'b.txt', 'e.txt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
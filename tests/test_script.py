@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+#   wix.py script tests
+#
+#   Copyright (C) 2018 by Igor E. Novikov
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Checks that wix.py script reads JSON files in --json_encoding and reports
+missing input file instead of failing.
+
+Usage: python3 -m unittest discover tests
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SCRIPT = os.path.join(ROOT, 'scripts',
+                      'py3' if sys.version_info[0] > 2 else 'py2', 'wix.py')
+
+NAME = u'Тест'
+
+
+class ScriptTest(unittest.TestCase):
+    tmp_dir = None
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        source_dir = os.path.join(self.tmp_dir, 'src')
+        os.makedirs(source_dir)
+        with open(os.path.join(source_dir, 'a.txt'), 'w') as fp:
+            fp.write('a')
+        self.json_data = {
+            'Name': NAME,
+            'UpgradeCode': '3AC4B4FF-10C4-4B8F-81AD-BAC3238BF690',
+            'Version': '1.0',
+            'Manufacturer': 'Test',
+            '_SourceDir': source_dir,
+            '_InstallDir': 'test',
+            '_ScanCache': False,
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def run_script(self, *args):
+        """Returns exit code and stdout of wix.py run"""
+        env = dict(os.environ, PYTHONPATH=os.path.join(ROOT, 'src'))
+        proc = subprocess.Popen([sys.executable, SCRIPT] + list(args),
+                                env=env, stdout=subprocess.PIPE)
+        stdout = proc.communicate()[0]
+        return proc.returncode, stdout
+
+    def test_json_encoding(self):
+        json_file = os.path.join(self.tmp_dir, 'test.json')
+        with open(json_file, 'wb') as fp:
+            text = json.dumps(self.json_data, ensure_ascii=False)
+            if not isinstance(text, type(u'')):
+                text = text.decode('utf-8')
+            fp.write(text.encode('cp1251'))
+        output = os.path.join(self.tmp_dir, 'test.wxs')
+        code, _stdout = self.run_script('--xml_only', '--output=' + output,
+                                        '--json_encoding=cp1251', json_file)
+        self.assertEqual(code, 0)
+        with open(output, 'rb') as fp:
+            self.assertIn(('Name="%s"' % NAME).encode('utf-8'), fp.read())
+
+    def test_no_input(self):
+        code, stdout = self.run_script('--xml_only')
+        self.assertEqual(code, 1)
+        self.assertIn(b'Input JSON file is not provided!', stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
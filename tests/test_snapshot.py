@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+#
+#   Model snapshot tests
+#
+#   Copyright (C) 2018 by Igor E. Novikov
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Checks that packages built from model snapshot are the same as packages
+built from JSON data and that the source folder is not scanned again.
+
+Usage: python3 -m unittest discover tests
+"""
+
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+import wixpy  # noqa: E402
+from wixpy import nullmsi  # noqa: E402
+from wixpy import scanner  # noqa: E402
+
+FILES = ('a.txt', 'b.exe', 'm/c.txt', 'm/deep/d.dll', 'z/e.txt')
+
+
+class SnapshotTest(unittest.TestCase):
+    tmp_dir = None
+    source_dir = None
+    snapshot = None
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.tmp_dir, 'src')
+        self.snapshot = os.path.join(self.tmp_dir, 'model.snapshot')
+        for name in FILES:
+            path = os.path.join(self.source_dir, *name.split('/'))
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as fp:
+                fp.write(name)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def json_data(self):
+        return {
+            'Name': 'Test',
+            'UpgradeCode': '3AC4B4FF-10C4-4B8F-81AD-BAC3238BF690',
+            'Version': '1.0',
+            'Manufacturer': 'Test',
+            '_SourceDir': self.source_dir,
+            '_InstallDir': 'test',
+            '_StableIds': True,
+            '_ScanCache': False,
+            # Snapshot keeps complete model tree anyway
+            '_Streaming': True,
+        }
+
+    def build(self, snapshot=None, xml_only=True):
+        """Returns WXS content or null backend table rows"""
+        output = os.path.join(self.tmp_dir,
+                              'test.wxs' if xml_only else 'test.msi')
+        json_data = None if snapshot else self.json_data()
+        if json_data is not None:
+            json_data.pop('_Streaming')
+        wixpy.build(json_data, output=output, xml_only=xml_only,
+                    snapshot=snapshot, backend='null')
+        if not xml_only:
+            return nullmsi.pop_database(output).rows
+        with open(output, 'rb') as fp:
+            return fp.read()
+
+    def test_snapshot(self):
+        wixpy.save_snapshot(self.json_data(), self.snapshot)
+        walks = []
+        walk = scanner.walk
+        scanner.walk = lambda *args, **kwargs: walks.append(args)
+        try:
+            xml = self.build(self.snapshot)
+            rows = self.build(self.snapshot, False)
+        finally:
+            scanner.walk = walk
+        self.assertEqual(walks, [])
+        self.assertEqual(xml, self.build())
+        self.assertEqual(rows, self.build(xml_only=False))
+
+    def test_version(self):
+        with open(self.snapshot, 'wb') as fp:
+            pickle.dump({'version': -1, 'model': None}, fp)
+        self.assertRaises(Exception, self.build, self.snapshot)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+#
+#   Deterministic Id and GUID tests
+#
+#   Copyright (C) 2018 by Igor E. Novikov
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Checks that in _StableIds mode element Ids and GUIDs are the same for
+repeated builds and depend on installed paths only.
+
+Usage: python3 -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+import wixpy  # noqa: E402
+from wixpy import msi  # noqa: E402
+from wixpy import nullmsi  # noqa: E402
+from wixpy import utils  # noqa: E402
+
+FILES = ('a.txt', 'b.exe', 'm/c.txt', 'm/deep/d.dll', 'z/e.txt')
+NS = '{http://schemas.microsoft.com/wix/2006/wi}'
+
+
+class StableIdsTest(unittest.TestCase):
+    tmp_dir = None
+    source_dir = None
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.tmp_dir, 'src')
+        for name in FILES:
+            self.write(name)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, source_dir=None):
+        path = os.path.join(source_dir or self.source_dir, *name.split('/'))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fp:
+            fp.write(name)
+
+    def json_data(self, source_dir=None, **options):
+        json_data = {
+            'Name': 'Test',
+            'UpgradeCode': '3AC4B4FF-10C4-4B8F-81AD-BAC3238BF690',
+            'Version': '1.0',
+            'Manufacturer': 'Test',
+            '_SourceDir': source_dir or self.source_dir,
+            '_InstallDir': 'test',
+            '_StableIds': True,
+            '_ScanCache': False,
+        }
+        json_data.update(options)
+        return json_data
+
+    def build_xml(self, source_dir=None, **options):
+        output = os.path.join(self.tmp_dir, 'test.wxs')
+        wixpy.build(self.json_data(source_dir, **options), output=output,
+                    xml_only=True)
+        with open(output, 'rb') as fp:
+            return fp.read()
+
+    def get_ids(self, xml, source_dir=None):
+        """Returns product Id and {file path: (File Id, Component Id,
+        Component Guid)} of WXS
+        """
+        root = ET.fromstring(xml)
+        ids = {}
+        for component in root.iter(NS + 'Component'):
+            for item in component.iter(NS + 'File'):
+                path = os.path.relpath(item.get('Source'),
+                                       source_dir or self.source_dir)
+                ids[path.replace(os.sep, '/')] = (
+                    item.get('Id'), component.get('Id'),
+                    component.get('Guid'))
+        return root.find(NS + 'Product').get('Id'), ids
+
+    def test_repeated_builds(self):
+        xml = self.build_xml()
+        self.assertEqual(self.build_xml(), xml)
+        self.assertNotEqual(self.build_xml(_StableIds=False), xml)
+
+    def test_tables(self):
+        output = os.path.join(self.tmp_dir, 'test.msi')
+        rows = []
+        for _index in range(2):
+            wixmodel = wixpy.create_model(
+                self.json_data(), ctx=utils.BuildContext(backend='null'))
+            msi.get_database('null')(wixmodel).write_msi(output)
+            rows.append(nullmsi.pop_database(output).rows)
+        self.assertEqual(rows[0], rows[1])
+
+    def test_path_keys(self):
+        product_id, ids = self.get_ids(self.build_xml())
+        self.assertEqual(sorted(ids), sorted(FILES))
+        # Another checkout with more files
+        source_dir = os.path.join(self.tmp_dir, 'checkout')
+        for name in ('0.txt', 'm/0.txt', 'y/0.txt') + FILES:
+            self.write(name, source_dir)
+        other_id, other_ids = self.get_ids(self.build_xml(source_dir),
+                                           source_dir)
+        self.assertEqual(other_id, product_id)
+        for name in FILES:
+            self.assertEqual(other_ids[name], ids[name])
+        # ProductCode is keyed by version, component GUIDs are kept
+        new_id, new_ids = self.get_ids(self.build_xml(Version='1.1'))
+        self.assertNotEqual(new_id, product_id)
+        self.assertEqual(new_ids, ids)
+
+
+if __name__ == '__main__':
+    unittest.main()
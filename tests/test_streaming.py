@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+#   Streaming WXS output tests
+#
+#   Copyright (C) 2018 by Igor E. Novikov
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Checks that WXS written in _Streaming mode is the same as WXS of
+the model tree in canonical mode, including copies of _Deduplicate.
+
+Usage: python3 -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+import wixpy  # noqa: E402
+from wixpy import nullmsi  # noqa: E402
+
+FILES = ('a.txt', 'b.dll', 'm/c.txt', 'm/f.dll', 'm/deep/d.txt',
+         'm/deep/g.txt', 'z/e.exe', 'z/h.txt', 'zz.txt')
+
+# Duplicates across folders: grouped file listed before a subfolder with
+# its source, folder components and file components of copies only
+DUPLICATES = {'a.txt': 'x', 'b/c.txt': 'x', 'b/d.txt': 'y', 'b/e.dll': 'd',
+              'c/d.txt': 'y', 'c/e.dll': 'd', 'z.txt': 'y'}
+
+
+class StreamingXmlTest(unittest.TestCase):
+    tmp_dir = None
+    source_dir = None
+
+    files = dict((name, name) for name in FILES)
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.tmp_dir, 'src')
+        for name, content in self.files.items():
+            path = os.path.join(self.source_dir, *name.split('/'))
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as fp:
+                fp.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def json_data(self, **options):
+        json_data = {
+            'Name': 'Test',
+            'UpgradeCode': '3AC4B4FF-10C4-4B8F-81AD-BAC3238BF690',
+            'Version': '1.0',
+            'Manufacturer': 'Test',
+            '_SourceDir': self.source_dir,
+            '_InstallDir': 'test',
+            '_SortedScan': True,
+            '_StableIds': True,
+            '_ScanCache': False,
+        }
+        json_data.update(options)
+        return json_data
+
+    def build_xml(self, **options):
+        output = os.path.join(self.tmp_dir, 'test.wxs')
+        wixpy.build(self.json_data(**options), output=output, xml_only=True)
+        with open(output, 'rb') as fp:
+            return fp.read()
+
+    def check(self, **options):
+        tree = self.build_xml(_Streaming=False, **options)
+        self.assertEqual(self.build_xml(_Streaming=True, **options), tree)
+        return tree
+
+    def test_per_file_components(self):
+        self.check()
+
+    def test_grouped_components(self):
+        xml = self.check(_ComponentGrouping=True)
+        # Versioned files keep own components
+        self.assertEqual(xml.count(b'<Component '), 7)
+
+
+class DeduplicateXmlTest(StreamingXmlTest):
+    files = DUPLICATES
+
+    def test_per_file_components(self):
+        xml = self.check(_Deduplicate=True)
+        self.assertEqual(xml.count(b'<CopyFile'), 4)
+        self.assertEqual(xml.count(b'<CreateFolder'), 4)
+
+    def test_grouped_components(self):
+        xml = self.check(_Deduplicate=True, _ComponentGrouping=True)
+        self.assertEqual(xml.count(b'<CopyFile'), 4)
+        # Folder components of copies only and component of a copied DLL
+        self.assertEqual(xml.count(b'<CreateFolder'), 3)
+
+    def build_rows(self, **options):
+        output = os.path.join(self.tmp_dir, 'test.msi')
+        wixpy.build(self.json_data(_Deduplicate=True, **options),
+                    output=output, backend='null')
+        return nullmsi.pop_database(output).rows
+
+    def test_tables(self):
+        for grouping in (False, True):
+            self.assertEqual(
+                self.build_rows(_Streaming=True, _ComponentGrouping=grouping),
+                self.build_rows(_ComponentGrouping=grouping))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+#   MSI template database tests
+#
+#   Copyright (C) 2018 by Igor E. Novikov
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Checks that template database is saved into template cache on the first
+build, reused by later builds and gives the same package as a build from
+scratch.
+
+Usage: python3 -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+import wixpy  # noqa: E402
+from wixpy import msi  # noqa: E402
+from wixpy import pymsi  # noqa: E402
+from wixpy import utils  # noqa: E402
+
+
+class TemplateTest(unittest.TestCase):
+    tmp_dir = None
+    cache_dir = None
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        source_dir = os.path.join(self.tmp_dir, 'src')
+        os.makedirs(source_dir)
+        for name in ('a.txt', 'b.dll'):
+            with open(os.path.join(source_dir, name), 'w') as fp:
+                fp.write(name)
+        json_data = {
+            'Name': 'Test',
+            'UpgradeCode': '3AC4B4FF-10C4-4B8F-81AD-BAC3238BF690',
+            'Version': '1.0',
+            'Manufacturer': 'Test',
+            '_SourceDir': source_dir,
+            '_InstallDir': 'test',
+            '_ScanCache': False,
+            '_TemplateCache': self.cache_dir,
+        }
+        self.model = wixpy.create_model(
+            json_data, ctx=utils.BuildContext(backend='python'))
+        self.filetime_now = utils.filetime_now
+        utils.filetime_now = lambda: 0
+        msi.clear_templates()
+
+    def tearDown(self):
+        utils.filetime_now = self.filetime_now
+        msi.clear_templates()
+        shutil.rmtree(self.tmp_dir)
+
+    def build(self, template_cache=True):
+        """Returns package and count of created tables"""
+        self.model.msi_data['_TemplateCache'] = \
+            self.cache_dir if template_cache else False
+        created = []
+        create_table = pymsi.MsiFile.create_table
+
+        def counter(db, name, *args):
+            created.append(name)
+            return create_table(db, name, *args)
+
+        pymsi.MsiFile.create_table = counter
+        output = os.path.join(self.tmp_dir, 'test.msi')
+        try:
+            msi.get_database('python')(self.model).write_msi(output)
+        finally:
+            pymsi.MsiFile.create_table = create_table
+        with open(output, 'rb') as fp:
+            return fp.read(), len(created)
+
+    def test_template(self):
+        package, created = self.build()
+        self.assertTrue(created > 0)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        # Next run finds template file
+        msi.clear_templates()
+        self.assertEqual(self.build(), (package, 0))
+        # The same package is built without template
+        msi.clear_templates()
+        self.assertEqual(self.build(False), (package, created))
+        self.assertEqual(self.build(False), (package, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+#
+#   Watch mode tests
+#
+#   Copyright (C) 2018 by Igor E. Novikov
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Checks that source folder watchers report changed folders (symlinked
+aliases as well) and that rebuilt cabinet compresses only folders having
+changed files.
+
+Usage: python3 -m unittest discover tests
+"""
+
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+from wixpy import pymsi  # noqa: E402
+from wixpy import watcher  # noqa: E402
+
+
+class WatchTestCase(unittest.TestCase):
+    tmp_dir = None
+    source_dir = None
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.tmp_dir, 'src')
+        os.makedirs(os.path.join(self.source_dir, 'a'))
+        self.write('a/x.txt', 'x')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def path(self, name):
+        return os.path.join(self.source_dir, *name.split('/'))
+
+    def write(self, name, content):
+        with open(self.path(name), 'w') as fp:
+            fp.write(content)
+
+    def wait(self, monitor, change):
+        result = {}
+        thread = threading.Thread(
+            target=lambda: result.setdefault('paths', monitor.wait()))
+        thread.start()
+        time.sleep(0.2)
+        change()
+        thread.join(10)
+        monitor.close()
+        return result.get('paths', set())
+
+
+class PollingWatcherTest(WatchTestCase):
+    def test_changes(self):
+        monitor = watcher.PollingWatcher(self.source_dir, interval=0.05)
+        paths = self.wait(monitor, lambda: self.write('a/y.txt', 'y'))
+        self.assertIn(self.path('a'), paths)
+        self.assertNotIn(self.path('a/x.txt'), paths)
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'Linux only')
+class InotifyWatcherTest(WatchTestCase):
+    def test_symlink_aliases(self):
+        os.symlink(self.path('a'), self.path('b'))
+        try:
+            monitor = watcher.InotifyWatcher(self.source_dir)
+        except (OSError, AttributeError):
+            self.skipTest('inotify is not available')
+
+        def change():
+            os.mkdir(self.path('a/new'))
+            time.sleep(0.1)
+            self.write('a/new/z.txt', 'z')
+
+        paths = self.wait(monitor, change)
+        for name in ('a', 'b', 'a/new', 'b/new'):
+            self.assertIn(self.path(name), paths)
+
+
+def read_cabinet(cabfile):
+    """Returns {file_id: data} of MSZIP cabinet"""
+    with open(cabfile, 'rb') as fp:
+        cab = fp.read()
+    folder_count, file_count = struct.unpack_from('<HH', cab, 26)
+    folders = []
+    for index in range(folder_count):
+        offset, count, _compression = struct.unpack_from(
+            '<IHH', cab, 36 + 8 * index)
+        data = b''
+        for _block in range(count):
+            _checksum, size, _length = struct.unpack_from('<IHH', cab,
+                                                          offset)
+            block = cab[offset + 10:offset + 8 + size]
+            data += zlib.decompressobj(-zlib.MAX_WBITS).decompress(block)
+            offset += 8 + size
+        folders.append(data)
+    files = {}
+    offset = struct.unpack_from('<I', cab, 16)[0]
+    for _index in range(file_count):
+        size, start, folder = struct.unpack_from('<IIH', cab, offset)
+        end = cab.index(b'\0', offset + 16)
+        name = cab[offset + 16:end].decode('utf-8')
+        files[name] = folders[folder][start:start + size]
+        offset = end + 1
+    return files
+
+
+class CabinetCacheTest(WatchTestCase):
+    def setUp(self):
+        super(CabinetCacheTest, self).setUp()
+        for index in range(300):
+            self.write('a/%d.txt' % index, ('%d' % index) * 4000)
+
+    def write_cabinet(self, cache):
+        files = []
+        contents = {}
+        for name in sorted(os.listdir(self.path('a'))):
+            path = self.path('a/' + name)
+            with open(path, 'rb') as fp:
+                contents[name] = fp.read()
+            files.append((path, name, len(contents[name]),
+                          int(os.stat(path).st_mtime * 10 ** 9)))
+        cabfile = os.path.join(self.tmp_dir, 'test.cab')
+        pymsi.write_cabinet(cabfile, files, cache=cache)
+        self.assertEqual(read_cabinet(cabfile), contents)
+
+    def test_changed_folders(self):
+        cache = pymsi.CabinetCache()
+        blocks = []
+        compress_block = pymsi.compress_block
+
+        def counter(block):
+            blocks.append(len(block))
+            return compress_block(block)
+
+        pymsi.compress_block = counter
+        try:
+            self.write_cabinet(cache)
+            total = len(blocks)
+            del blocks[:]
+            self.write_cabinet(cache)
+            self.assertEqual(blocks, [])
+            self.write('a/7.txt', 'changed')
+            self.write('a/new.txt', 'new')
+            self.write_cabinet(cache)
+        finally:
+            pymsi.compress_block = compress_block
+            cache.close()
+        self.assertTrue(0 < len(blocks) < total / 4, (len(blocks), total))
+
+
+if __name__ == '__main__':
+    unittest.main()